@@ -0,0 +1,64 @@
+/*
+ * Copyright (C) 2023 Patrick Pedersen, TU-DO Makerspace
+
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ *
+ * Description: Steps the DAC through a range of values in fixed time
+ *              intervals (a "staircase"), driven by a 1 ms timer tick.
+ *              Used by the tuning tools to sweep the oscillator without
+ *              pacing every DAC change over MIDI.
+ *
+ */
+
+#ifndef _STAIRCASE_H_INCLUDED
+#define _STAIRCASE_H_INCLUDED
+
+#include <stdint.h>
+#include <stdbool.h>
+
+/**
+ * @brief Starts a staircase, replacing a running one
+ * @param start First DAC value, set immediately
+ * @param end Last DAC value, the staircase stops once the next step would pass it
+ * @param stride Difference between two steps (> 0), applied towards end
+ * @param dwell Time each step is held in ms (> 0)
+ * @param set_dac Callback which sets the DAC
+ * @return Number of steps of the staircase
+ *
+ * Step N is set N * dwell ms after the call. The steps are taken
+ * by staircase_tick(), which must be called every ms (i.e. from
+ * a timer interrupt).
+ */
+uint16_t staircase_start(uint16_t start, uint16_t end, uint16_t stride, uint16_t dwell,
+			 void (*set_dac)(uint16_t value));
+
+/**
+ * @brief Stops a running staircase, the DAC keeps its current value
+ */
+void staircase_stop(void);
+
+/**
+ * @brief Advances a running staircase by 1 ms
+ */
+void staircase_tick(void);
+
+/**
+ * @brief Returns true once after a staircase has been completed
+ * @param steps Set to the number of steps taken
+ *
+ * Stopped staircases are not reported.
+ */
+bool staircase_completed(uint16_t *steps);
+
+#endif // _STAIRCASE_H_INCLUDED
@@ -26,6 +26,7 @@
 #include <log.h>
 #include <msp49xx.h>
 #include <midirx.h>
+#include <staircase.h>
 
 ////////////////////////////////////////////
 // Defines (Pins, Magic Numbers, etc.)
@@ -60,6 +61,11 @@
 #define OPEN_GATE() GPIO_WriteHigh(GATE_PORT, GATE_PIN)
 #define CLOSE_GATE() GPIO_WriteLow(GATE_PORT, GATE_PIN)
 
+// Staircase Timer (1 ms tick, see staircase.h)
+
+#define STAIRCASE_TIMER_PRESCALER TIM4_PRESCALER_128
+#define STAIRCASE_TIMER_PERIOD 124 // 16 MHz / 128 / (124 + 1) = 1 kHz
+
 // UART + MIDI + SYSEX
 
 #define EEPROM_MIDI_2_DAC_LUT_START FLASH_DATA_START_PHYSICAL_ADDRESS
@@ -82,6 +88,25 @@
 
 #define SYSEX_WRITE_MIDI_2_DAC_LUT 0x03
 
+#define SYSEX_WRITE_MIDI_2_DAC_LUT_BLOCK 0x04
+#define SYSEX_LUT_BLOCK_MAX_ENTRIES 16 // Requires MAX_SYSEX_LEN >= 5 + 2 * 16
+
+#define SYSEX_READ_MIDI_2_DAC_LUT 0x05
+#define SYSEX_MIDI_2_DAC_LUT_DUMP 0x11
+
+#define SYSEX_DAC_STAIRCASE 0x06
+#define SYSEX_DAC_STAIRCASE_DONE 0x12
+
+#define SYSEX_SYNC 0x07
+
+#define SYSEX_ACK 0x10
+#define SYSEX_ACK_OK 0x00
+#define SYSEX_ACK_BAD_CHECKSUM 0x01
+#define SYSEX_ACK_BAD_MESSAGE 0x02
+
+#define SYSEX_START 0xF0
+#define SYSEX_END 0xF7
+
 ////////////////////////////////////////////
 // Global MIDI to DAC Look-up Table
 ////////////////////////////////////////////
@@ -149,7 +174,7 @@ void setup_clocks(void)
 	CLK_PeripheralClockConfig(CLK_PERIPHERAL_UART1, ENABLE);
 	CLK_PeripheralClockConfig(CLK_PERIPHERAL_TIMER1, DISABLE);
 	CLK_PeripheralClockConfig(CLK_PERIPHERAL_TIMER2, DISABLE);
-	CLK_PeripheralClockConfig(CLK_PERIPHERAL_TIMER4, DISABLE);
+	CLK_PeripheralClockConfig(CLK_PERIPHERAL_TIMER4, ENABLE);
 }
 
 /**
@@ -188,6 +213,18 @@ void setup_uart(void)
 	UART1_Cmd(ENABLE);
 }
 
+/**
+ * @brief Sets up the timer driving DAC staircases (see staircase.h)
+ */
+void setup_timer(void)
+{
+	TIM4_DeInit();
+	TIM4_TimeBaseInit(STAIRCASE_TIMER_PRESCALER, STAIRCASE_TIMER_PERIOD);
+	TIM4_ClearFlag(TIM4_FLAG_UPDATE);
+	TIM4_ITConfig(TIM4_IT_UPDATE, ENABLE);
+	TIM4_Cmd(ENABLE);
+}
+
 /**
  * @brief Sets up the EEPROM
  */
@@ -244,6 +281,39 @@ void midi2dac_write_eeprom(uint8_t note, uint16_t dacval)
 	FLASH_Lock(FLASH_MEMTYPE_DATA);
 }
 
+/**
+ * @brief Burns a range of the MIDI to DAC LUT to "EEPROM" (Data flash)
+ * @param first First MIDI note of the range
+ * @param count Number of LUT entries in the range
+ *
+ * Writes a range of the global MIDI to DAC LUT to "EEPROM" (Data flash)
+ * with a single unlock/lock cycle. The flash is programmed one word
+ * (i.e. two LUT entries) at a time and words which already hold the
+ * correct values are skipped, saving both time and flash wear.
+ */
+void midi2dac_write_eeprom_range(uint8_t first, uint8_t count)
+{
+	FLASH_Unlock(FLASH_MEMTYPE_DATA);
+	while (FLASH_GetFlagStatus(FLASH_FLAG_DUL) == RESET);
+
+	// Words are aligned to even notes
+	for (uint8_t i = first & ~1; i < first + count; i += 2) {
+		uint16_t addr = EEPROM_MIDI_2_DAC_LUT_START + (i * 2);
+
+		if (FLASH_ReadByte(addr) == (midi2dac[i] >> 8) &&
+		    FLASH_ReadByte(addr + 1) == (midi2dac[i] & 0xFF) &&
+		    FLASH_ReadByte(addr + 2) == (midi2dac[i + 1] >> 8) &&
+		    FLASH_ReadByte(addr + 3) == (midi2dac[i + 1] & 0xFF)) {
+			continue;
+		}
+
+		FLASH_ProgramWord(addr, ((uint32_t)midi2dac[i] << 16) | midi2dac[i + 1]);
+		FLASH_WaitForLastOperation(FLASH_MEMTYPE_DATA);
+	}
+
+	FLASH_Lock(FLASH_MEMTYPE_DATA);
+}
+
 ////////////////////////////////////////////
 // SPI
 ////////////////////////////////////////////
@@ -270,6 +340,14 @@ void spi_write16(uint16_t data)
 	GPIO_WriteHigh(CS_PORT, CS_PIN);
 }
 
+/**
+ * @brief Sets the DAC to a 12-bit value
+ */
+void set_dac(uint16_t value)
+{
+	spi_write16(mcp49xx_data(cfg, value));
+}
+
 ////////////////////////////////////////////
 // MIDI
 ////////////////////////////////////////////
@@ -324,7 +402,8 @@ void handle_midi_msg(midi_msg_t *msg)
 
 		LOG_DEBUG("Note %d is mapped to DAC value %d", note, dacval);
 
-		spi_write16(mcp49xx_data(cfg, dacval));
+		staircase_stop();
+		set_dac(dacval);
 
 		LOG_DEBUG("DAC set to %d", dacval);
 
@@ -349,6 +428,221 @@ void handle_midi_msg(midi_msg_t *msg)
 // SYSEX
 ////////////////////////////////////////////
 
+/**
+ * @brief Sends a SYSEX message over UART
+ * @param buf SYSEX data, excluding the start and end byte
+ * @param len Length of the SYSEX data
+ */
+void sysex_send(const uint8_t *buf, uint8_t len)
+{
+	putchar(SYSEX_START);
+	for (uint8_t i = 0; i < len; i++)
+		putchar(buf[i]);
+	putchar(SYSEX_END);
+}
+
+/**
+ * @brief Acknowledges a SYSEX command
+ * @param cmd Message type of the acknowledged command
+ * @param status SYSEX_ACK_OK on success, otherwise an error code
+ *
+ * Sends the following SYSEX message:
+ *
+ * 	0xF0 <MANUFACTURER_ID> <ACK> <CMD> <STATUS> 0xF7
+ */
+void sysex_ack(uint8_t cmd, uint8_t status)
+{
+	const uint8_t buf[] = {SYSEX_MANUFACTURER_ID, SYSEX_ACK, cmd, status};
+	sysex_send(buf, sizeof(buf));
+}
+
+/**
+ * @brief Checksum of SYSEX data
+ * @param buf SYSEX data
+ * @param len Length of the SYSEX data
+ * @return XOR of all bytes, limited to 7 bits
+ */
+uint8_t sysex_checksum(const uint8_t *buf, uint8_t len)
+{
+	uint8_t sum = 0;
+	for (uint8_t i = 0; i < len; i++)
+		sum ^= buf[i];
+	return sum & 0x7F;
+}
+
+/**
+ * @brief Handles a WRITE MIDI 2 DAC LUT BLOCK message
+ * @param buf SYSEX message buffer
+ * @param len Length of the SYSEX message
+ * @return SYSEX_ACK_OK on success, otherwise an error code
+ *
+ * Expects the following format:
+ *
+ * 	<MANUFACTURER_ID> <MESSAGE_TYPE> <FIRST NOTE> <COUNT>
+ * 	<DAC VALUE MSB> <DAC VALUE LSB> ... (COUNT times) <CHECKSUM>
+ *
+ * The checksum covers everything from <FIRST NOTE> to the last DAC value.
+ * The LUT is only modified if the whole message is valid.
+ */
+uint8_t handle_lut_block(uint8_t *buf, size_t len)
+{
+	if (len < 5) {
+		return SYSEX_ACK_BAD_MESSAGE;
+	}
+
+	const uint8_t first = buf[2];
+	const uint8_t count = buf[3];
+
+	if (count == 0 || count > SYSEX_LUT_BLOCK_MAX_ENTRIES ||
+	    len != 5 + 2 * count || first + count > MIDI_N_NOTES) {
+		return SYSEX_ACK_BAD_MESSAGE;
+	}
+
+	if (sysex_checksum(&buf[2], len - 3) != buf[len - 1]) {
+		return SYSEX_ACK_BAD_CHECKSUM;
+	}
+
+	for (uint8_t i = 0; i < count; i++) {
+		uint16_t dacval = buf[4 + 2 * i] << 7 | buf[5 + 2 * i];
+		if (dacval > MAX_DAC_VALUE) {
+			return SYSEX_ACK_BAD_MESSAGE;
+		}
+	}
+
+	for (uint8_t i = 0; i < count; i++) {
+		midi2dac[first + i] = buf[4 + 2 * i] << 7 | buf[5 + 2 * i];
+	}
+
+	midi2dac_write_eeprom_range(first, count);
+
+	return SYSEX_ACK_OK;
+}
+
+/**
+ * @brief Handles a READ MIDI 2 DAC LUT message
+ * @param buf SYSEX message buffer
+ * @param len Length of the SYSEX message
+ * @return SYSEX_ACK_OK if the LUT has been dumped, otherwise an error code
+ *
+ * Expects the following format:
+ *
+ * 	<MANUFACTURER_ID> <MESSAGE_TYPE> <FIRST NOTE> <COUNT>
+ *
+ * and replies with the requested entries of the LUT, using the same
+ * format as a WRITE MIDI 2 DAC LUT BLOCK message:
+ *
+ * 	0xF0 <MANUFACTURER_ID> <LUT DUMP> <FIRST NOTE> <COUNT>
+ * 	<DAC VALUE MSB> <DAC VALUE LSB> ... (COUNT times) <CHECKSUM> 0xF7
+ *
+ * The reported values are those loaded by midi2dac_from_eeprom() or
+ * written since.
+ */
+uint8_t handle_lut_read(uint8_t *buf, size_t len)
+{
+	if (len != 4) {
+		return SYSEX_ACK_BAD_MESSAGE;
+	}
+
+	const uint8_t first = buf[2];
+	const uint8_t count = buf[3];
+
+	if (count == 0 || count > SYSEX_LUT_BLOCK_MAX_ENTRIES ||
+	    first + count > MIDI_N_NOTES) {
+		return SYSEX_ACK_BAD_MESSAGE;
+	}
+
+	uint8_t reply[5 + 2 * SYSEX_LUT_BLOCK_MAX_ENTRIES];
+	reply[0] = SYSEX_MANUFACTURER_ID;
+	reply[1] = SYSEX_MIDI_2_DAC_LUT_DUMP;
+	reply[2] = first;
+	reply[3] = count;
+
+	for (uint8_t i = 0; i < count; i++) {
+		// 7-bit encoding, see SET DAC
+		reply[4 + 2 * i] = (midi2dac[first + i] >> 7) & 0x7F;
+		reply[5 + 2 * i] = midi2dac[first + i] & 0x7F;
+	}
+
+	reply[4 + 2 * count] = sysex_checksum(&reply[2], 2 + 2 * count);
+	sysex_send(reply, 5 + 2 * count);
+
+	return SYSEX_ACK_OK;
+}
+
+/**
+ * @brief Handles a DAC STAIRCASE message
+ * @param buf SYSEX message buffer
+ * @param len Length of the SYSEX message
+ * @return SYSEX_ACK_OK if the staircase has been started, otherwise an error code
+ *
+ * Expects the following format:
+ *
+ * 	<MANUFACTURER_ID> <MESSAGE_TYPE> <START MSB> <START LSB> <END MSB> <END LSB>
+ * 	<STRIDE MSB> <STRIDE LSB> <DWELL MSB> <DWELL LSB> <CHECKSUM>
+ *
+ * All values use the 7-bit encoding of SET DAC, the dwell time is given
+ * in ms. The checksum covers everything from <START MSB> to <DWELL LSB>.
+ *
+ * The DAC is set to the start value right away and then stepped by the
+ * stride towards the end value every dwell ms (see staircase.h), so step
+ * N begins N * dwell ms (+/- 1 ms) after the acknowledgement. Once the last
+ * step has been held for the dwell time, the following message is sent:
+ *
+ * 	0xF0 <MANUFACTURER_ID> <STAIRCASE DONE> <STEPS MSB> <STEPS LSB> 0xF7
+ *
+ * A SET DAC or NOTE ON message stops a running staircase, in which case
+ * no STAIRCASE DONE message is sent.
+ */
+uint8_t handle_staircase(uint8_t *buf, size_t len)
+{
+	if (len != 11) {
+		return SYSEX_ACK_BAD_MESSAGE;
+	}
+
+	if (sysex_checksum(&buf[2], len - 3) != buf[len - 1]) {
+		return SYSEX_ACK_BAD_CHECKSUM;
+	}
+
+	const uint16_t start = buf[2] << 7 | buf[3];
+	const uint16_t end = buf[4] << 7 | buf[5];
+	const uint16_t stride = buf[6] << 7 | buf[7];
+	const uint16_t dwell = buf[8] << 7 | buf[9];
+
+	if (start > MAX_DAC_VALUE || end > MAX_DAC_VALUE || stride == 0 || dwell == 0) {
+		return SYSEX_ACK_BAD_MESSAGE;
+	}
+
+	// Align the first tick to the start of the staircase
+	TIM4_SetCounter(0);
+	const uint16_t steps = staircase_start(start, end, stride, dwell, set_dac);
+	LOG_DEBUG("Started staircase with %d steps", steps);
+
+	return SYSEX_ACK_OK;
+}
+
+/**
+ * @brief Reports completed staircases to the host (see handle_staircase())
+ *
+ * Called from the main loop, as the staircase is completed in the timer
+ * interrupt. Note that the host should not send any commands which are
+ * replied to while a staircase is running, as the replies could interleave.
+ */
+void report_staircase(void)
+{
+	uint16_t steps;
+	if (!staircase_completed(&steps)) {
+		return;
+	}
+
+	const uint8_t buf[] = {
+	    SYSEX_MANUFACTURER_ID,
+	    SYSEX_DAC_STAIRCASE_DONE,
+	    (steps >> 7) & 0x7F,
+	    steps & 0x7F,
+	};
+	sysex_send(buf, sizeof(buf));
+}
+
 /**
  * @brief SYSEX message callback, handles incoming SYSEX messages
  * @param buf SYSEX message buffer passed by midirx
@@ -369,6 +663,21 @@ void handle_midi_msg(midi_msg_t *msg)
  * 	- On SET GATE <GATE VALUE>:
  * 		- Open or close the GATE
  * 		- The GATE value is expected to be either 0x00 (close) or 0x01 (open)
+ * 	- On WRITE MIDI 2 DAC LUT <NOTE> <DAC VALUE MSB> <DAC VALUE LSB>:
+ * 		- Set and burn a single LUT entry
+ * 	- On WRITE MIDI 2 DAC LUT BLOCK <FIRST NOTE> <COUNT> <DAC VALUES...> <CHECKSUM>:
+ * 		- Set and burn up to 16 consecutive LUT entries (see handle_lut_block())
+ * 		- Replies with an ACK message (see sysex_ack())
+ * 	- On READ MIDI 2 DAC LUT <FIRST NOTE> <COUNT>:
+ * 		- Replies with up to 16 consecutive LUT entries (see handle_lut_read())
+ * 		- Invalid requests are answered with an ACK message carrying an error
+ * 	- On DAC STAIRCASE <START> <END> <STRIDE> <DWELL> <CHECKSUM>:
+ * 		- Steps the DAC from start to end in timer driven steps (see handle_staircase())
+ * 		- Replies with an ACK message (see sysex_ack())
+ * 	- On SYNC:
+ * 		- Replies with an ACK message (see sysex_ack())
+ * 		- As messages are handled in order, the ACK tells the host that all
+ * 		  previously sent messages (ex. SET DAC) have been handled
  * 	- Invalid or unhandled messages are discarded
  *
  **/
@@ -397,7 +706,8 @@ void handle_sysex_msg(uint8_t *buf, size_t len)
 			// To transmit the 12-bits required for the DAC,
 			// we need to combine two 7-bit values into one 12-bit value.
 			uint16_t value = buf[2] << 7 | buf[3];
-			spi_write16(mcp49xx_data(cfg, value));
+			staircase_stop();
+			set_dac(value);
 			LOG_DEBUG("Set DAC to %d", value);
 		} else {
 			LOG_DEBUG("Bad SET DAC message");
@@ -447,6 +757,47 @@ void handle_sysex_msg(uint8_t *buf, size_t len)
 		} else {
 			LOG_DEBUG("Bad WRITE MIDI 2 DAC LUT message");
 		}
+		break;
+	case SYSEX_WRITE_MIDI_2_DAC_LUT_BLOCK: {
+		LOG_DEBUG("Received WRITE MIDI 2 DAC LUT BLOCK message");
+
+		const uint8_t status = handle_lut_block(buf, len);
+		if (status != SYSEX_ACK_OK) {
+			LOG_DEBUG("Bad WRITE MIDI 2 DAC LUT BLOCK message");
+		}
+
+		sysex_ack(SYSEX_WRITE_MIDI_2_DAC_LUT_BLOCK, status);
+		break;
+	}
+	case SYSEX_READ_MIDI_2_DAC_LUT: {
+		LOG_DEBUG("Received READ MIDI 2 DAC LUT message");
+
+		const uint8_t status = handle_lut_read(buf, len);
+		if (status != SYSEX_ACK_OK) {
+			LOG_DEBUG("Bad READ MIDI 2 DAC LUT message");
+			sysex_ack(SYSEX_READ_MIDI_2_DAC_LUT, status);
+		}
+		break;
+	}
+	case SYSEX_DAC_STAIRCASE: {
+		LOG_DEBUG("Received DAC STAIRCASE message");
+
+		const uint8_t status = handle_staircase(buf, len);
+		if (status != SYSEX_ACK_OK) {
+			LOG_DEBUG("Bad DAC STAIRCASE message");
+		}
+
+		sysex_ack(SYSEX_DAC_STAIRCASE, status);
+		break;
+	}
+	case SYSEX_SYNC:
+		if (len == 2) {
+			LOG_DEBUG("Received SYNC message");
+			sysex_ack(SYSEX_SYNC, SYSEX_ACK_OK);
+		} else {
+			LOG_DEBUG("Bad SYNC message");
+		}
+		break;
 	default:
 		break;
 	}
@@ -459,8 +810,9 @@ void handle_sysex_msg(uint8_t *buf, size_t len)
 /**
  * @brief Main function
  *
- * Sets up callbacks and peripherals and then enters an infinite loop.
- * The callbacks are called by the midirx library through external interrupts.
+ * Sets up callbacks and peripherals and then enters an infinite loop,
+ * which reports completed DAC staircases. The callbacks are called by
+ * the midirx library through external interrupts.
  */
 void main(void)
 {
@@ -472,6 +824,7 @@ void main(void)
 	
 	setup_gpios();
 	setup_spi();
+	setup_timer();
 
 	midirx_set_status_filter(status_filter);
 	midirx_on_midi_msg(handle_midi_msg);
@@ -484,7 +837,7 @@ void main(void)
 
 	LOG("Listening for MIDI messages...");
 	while (true)
-		;
+		report_staircase();
 }
 
 // See: https://community.st.com/s/question/0D50X00009XkhigSAB/what-is-the-purpose-of-define-usefullassert
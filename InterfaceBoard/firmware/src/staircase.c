@@ -0,0 +1,98 @@
+/*
+ * Copyright (C) 2023 Patrick Pedersen, TU-DO Makerspace
+
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ *
+ * Description: Defines functions exposed by the staircase.h header file.
+ * 	    	For more information, please refer to the header file.
+ *
+ */
+
+#include <stddef.h>
+#include <staircase.h>
+
+// Staircase state, shared between the timer and UART interrupts
+static volatile bool active = false;
+static volatile bool completed = false;
+static volatile uint16_t value;
+static volatile uint16_t steps_left;
+static volatile uint16_t steps_taken;
+static volatile int16_t step;
+static volatile uint16_t dwell_ms;
+static volatile uint16_t elapsed_ms;
+static void (*set_dac_callback)(uint16_t value) = NULL;
+
+// See header file for documentation.
+uint16_t staircase_start(uint16_t start, uint16_t end, uint16_t stride, uint16_t dwell,
+			 void (*set_dac)(uint16_t value))
+{
+	active = false;
+	completed = false;
+
+	const uint16_t span = (end >= start) ? end - start : start - end;
+
+	value = start;
+	step = (end >= start) ? (int16_t)stride : -(int16_t)stride;
+	steps_left = span / stride;
+	steps_taken = 1;
+	dwell_ms = dwell;
+	elapsed_ms = 0;
+	set_dac_callback = set_dac;
+
+	set_dac_callback(value);
+	active = true;
+
+	return steps_left + 1;
+}
+
+// See header file for documentation.
+void staircase_stop(void)
+{
+	active = false;
+}
+
+// See header file for documentation.
+void staircase_tick(void)
+{
+	if (!active)
+		return;
+
+	if (++elapsed_ms < dwell_ms)
+		return;
+
+	elapsed_ms = 0;
+
+	if (steps_left == 0) {
+		// The last step has been held for its dwell time
+		active = false;
+		completed = true;
+		return;
+	}
+
+	value += step;
+	steps_left--;
+	steps_taken++;
+	set_dac_callback(value);
+}
+
+// See header file for documentation.
+bool staircase_completed(uint16_t *steps)
+{
+	if (!completed)
+		return false;
+
+	completed = false;
+	*steps = steps_taken;
+	return true;
+}
@@ -32,6 +32,7 @@
 /* Includes ------------------------------------------------------------------*/
 #include <stm8s_it.h>
 #include <midirx_uart_parser.h>
+#include <staircase.h>
 
 /** @addtogroup Template_Project
  * @{
@@ -490,9 +491,8 @@ INTERRUPT_HANDLER(TIM6_UPD_OVF_TRG_IRQHandler, 23)
  */
 INTERRUPT_HANDLER(TIM4_UPD_OVF_IRQHandler, 23)
 {
-	/* In order to detect unexpected events during development,
-	   it is recommended to set a breakpoint on the following instruction.
-	*/
+	TIM4_ClearITPendingBit(TIM4_IT_UPDATE);
+	staircase_tick();
 }
 #endif /* (STM8S903) || (STM8AF622x)*/
 
@@ -0,0 +1,205 @@
+# Capture archive of the Dampflog tuning tools
+#
+# A capture archive stores the raw audio of every measurement of a tuning
+# session along with the DAC value, the measured frequency and the note and
+# search phase it was taken for (see Tuner.msr_after_dac_chng). The archive
+# is a directory holding:
+#   - captures.f32: All samples as raw float32, one capture after another
+#   - index.json:   Sample rate and the position and metadata of every capture
+#
+# The samples are read back through a memory map, so even long sessions are
+# only loaded as far as they are accessed.
+#
+# A ReplayDampflog plays an archived session back in place of a Dampflog
+# (same interface as dampflog_sim.SimulatedDampflog), which allows replaying
+# real sessions offline, ex. to debug the tuning algorithm or to benchmark
+# estimators and strategies on real captures (see bench_tuning.py).
+
+import json
+import os
+import numpy as np
+
+from transport import SYSEX_CMD_SET_DAC, SYSEX_MANUFACTURER_ID, UART_MIDI_BAUDRATE, midi_data_to_uint14
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+DATA_FILE = "captures.f32"
+INDEX_FILE = "index.json"
+
+#####################################################
+# Capture Archive
+#####################################################
+
+class CaptureArchive:
+    # Opens an archive for writing (mode "w", replaces an existing archive)
+    # or reading (mode "r")
+    def __init__(self, path, mode="r", sample_rate=44100):
+        self.path = path
+        self.mode = mode
+
+        if mode == "w":
+            os.makedirs(path, exist_ok=True)
+            self.sample_rate = sample_rate
+            self.captures = []
+            self.length = 0
+            self.file = open(os.path.join(path, DATA_FILE), "wb")
+            self.data = None
+        elif mode == "r":
+            with open(os.path.join(path, INDEX_FILE)) as f:
+                index = json.load(f)
+            self.sample_rate = index["sample_rate"]
+            self.captures = index["captures"]
+            self.length = sum(c["length"] for c in self.captures)
+            self.file = None
+            self.data = np.memmap(os.path.join(path, DATA_FILE), dtype=np.float32, mode="r") if self.length else np.zeros(0, dtype=np.float32)
+        else:
+            raise ValueError("Invalid archive mode: {}".format(mode))
+
+    # Appends a capture. The frequency is the one measured from it.
+    def add(self, sample, dac, freq, note=None, phase=None, t=None):
+        sample = np.ravel(sample).astype(np.float32)
+        self.file.write(sample.tobytes())
+        self.captures.append({
+            "offset": self.length,
+            "length": len(sample),
+            "dac": int(dac),
+            "freq": float(freq) if np.isfinite(freq) else None,
+            "note": note,
+            "phase": phase,
+            "t": t,
+        })
+        self.length += len(sample)
+
+    # Returns the samples of the i-th capture
+    def samples(self, i):
+        c = self.captures[i]
+        return self.data[c["offset"]:c["offset"] + c["length"]]
+
+    # Returns the DAC values and their mean measured frequencies, sorted by DAC value
+    def response(self):
+        points = {}
+        for c in self.captures:
+            if c["freq"] is not None:
+                points.setdefault(c["dac"], []).append(c["freq"])
+        dac = np.array(sorted(points))
+        return dac, np.array([np.mean(points[v]) for v in dac])
+
+    # Writes the index, the archive can't be written to afterwards
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        with open(os.path.join(self.path, INDEX_FILE), "w") as f:
+            json.dump({"sample_rate": self.sample_rate, "captures": self.captures}, f)
+            f.write("\n")
+
+#####################################################
+# Replay
+#####################################################
+
+# Plays an archived session back in place of a Dampflog. Acts as MIDI
+# port, audio input and clock at once, like dampflog_sim.SimulatedDampflog.
+#
+# Every capture is returned for the DAC value it was taken at, repeated
+# captures of the same DAC value in the order they were recorded. If a DAC value
+# hasn't been archived, the capture of the closest DAC value is resampled to
+# the frequency interpolated between the archived ones (see dac_to_freq).
+# Commands other than SET DAC are accepted but have no effect, so only
+# measurements of single DAC values (not sweeps) are replayed faithfully.
+class ReplayDampflog:
+    def __init__(self, archive):
+        self.archive = archive
+        self.sample_rate = archive.sample_rate
+        self.time = 0.0
+        self.dac = 0
+        self.replayed = {}      # DAC value -> number of captures returned
+        self.resampled = 0      # Number of captures returned for DAC values that weren't archived
+
+        self.by_dac = {}
+        for i, c in enumerate(archive.captures):
+            if c["freq"] is not None:
+                self.by_dac.setdefault(c["dac"], []).append(i)
+        self.response_dac, self.response_freq = archive.response()
+        if len(self.response_dac) == 0:
+            raise ValueError("Archive doesn't contain any valid captures: {}".format(archive.path))
+
+    ######## Clock ########
+
+    def now(self):
+        return self.time
+
+    def sleep(self, duration):
+        self.time += duration
+
+    ######## Response ########
+
+    # Frequency of a DAC value, interpolated between the archived ones in
+    # log-frequency
+    def dac_to_freq(self, dac_val):
+        return 2 ** np.interp(dac_val, self.response_dac, np.log2(self.response_freq))
+
+    ######## MIDI Port ########
+
+    def send(self, msg):
+        self.sleep(len(msg.bytes()) * 10 / UART_MIDI_BAUDRATE)
+        data = list(msg.data) if msg.type == "sysex" else []
+        if len(data) == 4 and data[0] == SYSEX_MANUFACTURER_ID and data[1] == SYSEX_CMD_SET_DAC:
+            self.dac = midi_data_to_uint14(data[2], data[3])
+
+    # The Dampflog never replies during a replay
+    def poll(self):
+        return None
+
+    def close(self):
+        pass
+
+    ######## Audio Input ########
+
+    # Returns n samples of the next capture of the current DAC value
+    def capture(self, n):
+        captures = self.by_dac.get(self.dac)
+        ratio = 1.0
+        if captures is None:
+            nearest = self.response_dac[np.argmin(np.abs(self.response_dac - self.dac))]
+            captures = self.by_dac[int(nearest)]
+            ratio = self.dac_to_freq(self.dac) / self.dac_to_freq(nearest)
+            self.resampled += 1
+
+        k = self.replayed.get(self.dac, 0)
+        self.replayed[self.dac] = k + 1
+        x = np.asarray(self.archive.samples(captures[k % len(captures)]), dtype=np.float64)
+
+        # Repeats short captures, resamples to shift the frequency by ratio
+        m = int(np.ceil(n * ratio)) + 1
+        if len(x) < m:
+            x = np.resize(x, m)
+        if ratio != 1.0:
+            x = np.interp(np.arange(n) * ratio, np.arange(len(x)), x)
+        return x[:n]
+
+    def mark(self):
+        return int(round(self.time * self.sample_rate))
+
+    # Same as dampflog_sim.SimulatedDampflog.record()
+    def record(self, duration, start=None):
+        if start is not None and start > self.mark():
+            self.sleep((start - self.mark()) / self.sample_rate)
+        n = int(duration * self.sample_rate)
+        self.time += n / self.sample_rate
+        return self.capture(n).reshape(-1, 1)
+
+    def read(self, duration):
+        return self.record(duration)
+
+    def flush(self):
+        pass
+
+    def stats(self):
+        return {
+            "frames": self.mark(),
+            "overruns": 0,
+            "dropped": 0,
+        }
@@ -0,0 +1,175 @@
+# Audio input backends of the Dampflog tuning tools
+#
+# Every backend provides:
+#   - record(duration, start=None): Returns the next samples (or the samples
+#     beginning at the absolute sample index start, see mark())
+#   - read(duration): Returns the next block of the continuous input stream
+#   - flush(): Drops everything that hasn't been read yet
+#   - mark(): Returns the absolute index of the next incoming sample
+#   - stats(): Returns the capture counters
+#   - close()
+# See dampflog_sim.py for the simulated backend.
+#
+# A multichannel input (ex. an audio interface recording several Dampflogs)
+# is demultiplexed with SoundDeviceInput.channel(), which returns a backend
+# for a single channel of the shared stream.
+
+import time
+import numpy as np
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+DEFAULT_CAPACITY = 4        # seconds
+DEFAULT_BLOCKSIZE = 256     # frames per callback
+
+#####################################################
+# Helper Functions
+#####################################################
+
+# Parses an audio device given on the command line by its name or index
+def parse_device(value):
+    return int(value) if value.isdigit() else value
+
+#####################################################
+# Sounddevice Input
+#####################################################
+
+# Captures an input device (default input device if device is None) into a
+# preallocated float32 ring buffer with one column per channel. A single input stream is kept open
+# until close(), so measurements neither pay for stream setup nor allocate.
+#
+# The ring buffer is stored twice in a row, so the latest samples are always
+# available as one contiguous array. Samples are returned as views into the
+# ring buffer. A view remains valid until the capacity (seconds) has passed.
+# Used directly, the input behaves like a mono backend of the first channel.
+# sounddevice (and PortAudio) is only imported once an input is opened, so
+# the simulator and benchmarks run without them.
+class SoundDeviceInput:
+    def __init__(self, sample_rate=44100, device=None, capacity=DEFAULT_CAPACITY,
+                 blocksize=DEFAULT_BLOCKSIZE, channels=1):
+        import sounddevice as sd
+
+        self.sample_rate = sample_rate
+        self.device = device
+        self.channels = channels
+        self.capacity = int(capacity * sample_rate)
+        self.buffer = np.zeros((2 * self.capacity, channels), dtype=np.float32)
+
+        self.frames = 0     # Total number of captured frames
+        self.overruns = 0   # Input overflows reported by PortAudio
+        self.dropped = 0    # Requested frames that had already been overwritten
+        self.mono = ChannelInput(self, 0)
+
+        self.stream = sd.InputStream(
+            samplerate=sample_rate,
+            channels=channels,
+            dtype="float32",
+            device=device,
+            blocksize=blocksize,
+            callback=self.callback,
+        )
+        self.stream.start()
+
+    # Called by PortAudio from its own thread
+    def callback(self, indata, frames, time_info, status):
+        if status.input_overflow:
+            self.overruns += 1
+
+        data = indata
+        w = self.frames % self.capacity
+        n = min(frames, self.capacity - w)
+
+        self.buffer[w:w + n] = data[:n]
+        self.buffer[w + self.capacity:w + self.capacity + n] = data[:n]
+        if n < frames:
+            self.buffer[:frames - n] = data[n:]
+            self.buffer[self.capacity:self.capacity + frames - n] = data[n:]
+
+        self.frames += frames
+
+    def mark(self):
+        return self.frames
+
+    # Returns a view of the n frames of a channel beginning at the absolute
+    # index start, waiting until all of them have been captured
+    def view(self, start, n, channel=0):
+        n = min(n, self.capacity)
+        oldest = self.frames - self.capacity
+        if start < oldest:
+            self.dropped += oldest - start
+            start = oldest
+
+        end = start + n
+        while self.frames < end:
+            time.sleep((end - self.frames) / self.sample_rate)
+
+        e = end % self.capacity + self.capacity
+        return self.buffer[e - n:e, channel]
+
+    # Returns a backend for a single channel, see ChannelInput
+    def channel(self, channel):
+        if channel < 0 or channel >= self.channels:
+            raise ValueError("Invalid channel: {}".format(channel))
+        return ChannelInput(self, channel)
+
+    def record(self, duration, start=None):
+        return self.mono.record(duration, start)
+
+    def read(self, duration):
+        return self.mono.read(duration)
+
+    def flush(self):
+        self.mono.flush()
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "overruns": self.overruns,
+            "dropped": self.dropped,
+        }
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+# A single channel of a SoundDeviceInput.
+# Every channel keeps its own read() cursor, so several consumers (ex. the
+# tuners in farm.py) can share one stream. Closing a channel leaves the
+# stream open, it is closed with its SoundDeviceInput.
+class ChannelInput:
+    def __init__(self, source, channel):
+        self.source = source
+        self.channel = channel
+        self.sample_rate = source.sample_rate
+        self.cursor = 0     # Absolute index of the next frame returned by read()
+
+    def mark(self):
+        return self.source.mark()
+
+    def record(self, duration, start=None):
+        if start is None:
+            start = self.source.frames
+        return self.source.view(start, int(duration * self.sample_rate), self.channel).reshape(-1, 1)
+
+    def read(self, duration):
+        n = int(duration * self.sample_rate)
+        oldest = self.source.frames - self.source.capacity
+        if self.cursor < oldest:
+            self.source.dropped += oldest - self.cursor
+            self.cursor = oldest
+        sample = self.source.view(self.cursor, n, self.channel)
+        self.cursor += n
+        return sample
+
+    def flush(self):
+        self.cursor = self.source.frames
+
+    def stats(self):
+        return self.source.stats()
+
+    def close(self):
+        pass
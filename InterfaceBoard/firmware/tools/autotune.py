@@ -1,308 +1,40 @@
-import serial
+import csv
+import json
+import re
+import sys
 import time
-import sounddevice as sd
-import numpy as np
-import scipy.io.wavfile as wav
 import argparse
 import mido
-from matplotlib import pyplot as plt
 
-#####################################################
-# Constants/Parameters
-#####################################################
-
-# DAC
-
-MAX_DAC_VAL = 0x0FFF
-
-# MIDI
-
-MAX_MIDI_NOTE = 127
-UART_MIDI_BAUDRATE = 31250
-
-# Sysex
-
-SYSEX_MANUFACTURER_ID = 0x7D
-SYSEX_START = 0xF0
-SYSEX_END = 0xF7
-
-SYSEX_CMD_SET_DAC = 0x01
-SYSEX_CMD_SET_GATE = 0x02
-SYSEX_CMD_SET_GATE_CLOSE = 0x00
-SYSEX_CMD_SET_GATE_OPEN = 0x01
-SYSEX_WRITE_MIDI_2_DAC_LUT = 0x03
-
-# Recording
+import archive
+import audio
+import dampflog_sim
+import instrument
+import pitch
+import profiles
+import transport
+import tuning
+from tuning import MAX_DAC_VAL, MAX_MIDI_NOTE, OSC_MIN_NOTE, OSC_MAX_NOTE, RECORD_SAMPLE_RATE
 
-MIDO_WAIT_TIME = 0.1        # seconds
-# ATTACK_TIME = 0.01          # seconds
-ATTACK_TIME = 0             # MIDO_WAIT_TIME aleardy does the job
-RECORD_DURATION = 0.3       # seconds
-RECORD_SAMPLE_RATE = 44100  # Hz
-RECORD_CHANNELS = 1         # mono
-
-# Oscillator Parameters
-
-OSC_MIN_NOTE = 46 # A#2
-OSC_MAX_NOTE = 76 # E5
-OSC_STARTUP_SETTLE_TIME = 3 # seconds
+# The tuning engine itself resides in tuning.py.
+# main() may also be called from other scripts (ex. a test rig) with
+# a list of arguments, it returns the exit code.
 
 #####################################################
-# Step Table
+# Constants/Parameters
 #####################################################
 
-# The step table stores the "expected" differences in DAC
-# values (based on previous tuning) between each MIDI note.
-# It allows the tuning algorithm to make an educated guess
-# for the DAC value of the next note and then proceeds to
-# fine tune from there. This saves a lot of time as the algorithm
-# doesn't have to increment through every single DAC value.
-# The step table has been generated from prior tuning.
-
-STEP_TABLE = [
-    1600,
-    245,
-    101,
-    91,
-    86,
-    81,
-    75,
-    69,
-    65,
-    62,
-    58,
-    55,
-    51,
-    50,
-    45,
-    44,
-    42,
-    40,
-    38,
-    38,
-    38,
-    38,
-    39,
-    40,
-    44,
-    49,
-    54,
-    69,
-    56,
-    96,
-    50
+OUTPUT_FORMATS = ["json", "csv"]
+RESULT_FIELDS = [
+    "note", "name", "dac", "error", "ci", "captures", "measurements", "time", "stored_dac", "retuned", "drift",
+    "extended", "extrapolated"
 ]
 
 #####################################################
 # Helper Functions
 #####################################################
 
-######## Recording ########
-
-# Records a sample from the default input device
-def record_sample(duration):
-    myrecording = sd.rec(
-        int(duration * RECORD_SAMPLE_RATE),
-        samplerate=RECORD_SAMPLE_RATE,
-        channels=1,
-        dtype="float64",
-    )
-    sd.wait()
-    return myrecording
-
-# Plays a recorded sample (see record_sample)
-def play_sample(sample):
-    sd.play(sample, RECORD_SAMPLE_RATE)
-    sd.wait()
-
-######## Frequency Analysis ########
-
-# Determines the frequency of a sample via postive zero intercepts
-def get_freq(sample):
-    positive_zero_intercepts = []
-    for i in range(len(sample)):
-        if i == 0:
-            continue
-        if sample[i] > 0 and sample[i - 1] < 0:
-            positive_zero_intercepts.append(i)
-
-    diffs = []
-    for i in range(len(positive_zero_intercepts)):
-        if i == 0:
-            continue
-        diffs.append(positive_zero_intercepts[i] - positive_zero_intercepts[i - 1])
-
-    return RECORD_SAMPLE_RATE / np.mean(diffs)
-
-# Determines the error in cents between a target frequency and a measured frequency
-def error_in_cents(target_freq, measured_freq):
-    return 1200 * np.log2(measured_freq / target_freq)
-
-######## MIDI ########
-
-WELL_TEMPERED_A = 440
-
-# Converts a MIDI note number to a frequency
-def midi_note_to_freq(note):
-    return WELL_TEMPERED_A * 2 ** ((note - 69) / 12)
-
-# Determines the closest MIDI note number to a frequency
-def closest_midi_note_to_freq(freq):
-    closest_note = int(round(12 * np.log2(freq / WELL_TEMPERED_A) + 69))
-    error = freq - midi_note_to_freq(closest_note)
-    return closest_note, error
-
-# Converts a MIDI note number to a note name and octave (ex. 46 becomes A#2)
-def midi_note_to_name_oct(midinote):
-    notes = [
-        "C",
-        "C#",
-        "D",
-        "D#",
-        "E",
-        "F",
-        "F#",
-        "G",
-        "G#",
-        "A",
-        "A#",
-        "B",
-    ]
-    return notes[midinote % 12] + str(midinote // 12 - 1)
-
-######## DAC ########
-
-def uint14_to_midi_data(val):
-    return [val >> 7, val & 0x7F]
-
-# Sets the DAC value via sysex
-def set_dac(port, value):
-    if value < 0 or value > MAX_DAC_VAL:
-        raise ValueError("DAC value out of range")
-    d = uint14_to_midi_data(value)
-    msg = mido.Message("sysex", data=[SYSEX_MANUFACTURER_ID, SYSEX_CMD_SET_DAC, d[0], d[1]])
-    port.send(msg)
-    time.sleep(MIDO_WAIT_TIME)
-
-######## MIDI to DAC Look-up Table ########
-
-def write_dac(note, value):
-    if value < 0 or value > MAX_DAC_VAL:
-        raise ValueError("DAC value out of range")
-    d = uint14_to_midi_data(value)
-    msg = mido.Message("sysex", data=[SYSEX_MANUFACTURER_ID, SYSEX_WRITE_MIDI_2_DAC_LUT, note, d[0], d[1]])
-    port.send(msg)
-    time.sleep(MIDO_WAIT_TIME)
-
-######## GATE ########
-
-# Sets the gate via sysex
-def set_gate(port, value):
-    if value:
-        value = SYSEX_CMD_SET_GATE_OPEN
-    else:
-        value = SYSEX_CMD_SET_GATE_CLOSE
-    msg = mido.Message("sysex", data=[SYSEX_MANUFACTURER_ID, SYSEX_CMD_SET_GATE, value])
-    port.send(msg)
-
-######## Tuning ########
-
-# Measures the frequency after a DAC value change.
-# Measurements begin after the attack time has passed
-# The duration determines how long the sample to be measured is
-def msr_after_dac_chng(ser, value, attack, duration):
-    set_dac(ser, value)
-    time.sleep(attack)
-    sample = record_sample(duration)
-    return get_freq(sample)
-
-# Attempts to find a DAC value that produces a frequency close to the target frequency
-# with the given step size.
-# Returns the DAC value afer execution, the overshoot (Hz), and the undershoot (Hz)
-def dac_target_freq(ser, start, step, target_freq):
-    dac_val = start
-    prev_f = 0
-
-    while True:
-        if dac_val == start:
-            prev_f = msr_after_dac_chng(ser, dac_val, ATTACK_TIME, RECORD_DURATION)
-        else:
-            f = msr_after_dac_chng(ser, dac_val, ATTACK_TIME, RECORD_DURATION)
-
-            if (step > 0 and f > target_freq) or (step < 0 and f < target_freq):
-                overshoot_error = error_in_cents(target_freq, f)
-                undershoot_error = error_in_cents(target_freq, prev_f)
-                return dac_val, overshoot_error, undershoot_error
-
-            prev_f = f
-        dac_val += step
-
-        if dac_val == MAX_DAC_VAL:
-            break
-
-    return None
-
-# Performs a coarse, then fine tune to find a DAC value that produces a frequency
-# close to the target frequency.
-# Returns the DAC value that yields the closest frequency to the target frequency
-# and the error in cents.
-def coarse_fine_tune(ser, start, coarse_step, fine_step, target_freq):
-    incr = True
-    start_f = msr_after_dac_chng(ser, start, ATTACK_TIME, RECORD_DURATION)    
-    
-    if start_f > target_freq:
-        incr = False
-        coarse_step = -coarse_step
-    
-    dac_val, overshoot, undershoot = dac_target_freq(
-        ser, start, coarse_step, target_freq
-    )
-
-    overshot = abs(overshoot) < abs(undershoot)
-
-    if (incr and overshot) or (not incr and not overshot):
-        fine_step = -fine_step
-
-    if not overshot:
-        dac_val -= coarse_step
-
-    dac_val, overshoot, undershoot = dac_target_freq(
-        ser, dac_val, fine_step, target_freq
-    )
-
-    if abs(overshoot) > abs(undershoot):
-        dac_val -= fine_step
-        error = undershoot
-    else:
-        error = overshoot
-    
-    return dac_val, error
-
-#####################################################
-# Argument Parsing
-#####################################################
-
-parser = argparse.ArgumentParser(
-    description="Automatically tunes the Dampflog"
-)
-
-# parser.add_argument(
-#     "-o", "--output", type=str, help="Output for lookup table header", required=True
-# )
-
-parser.add_argument(
-    "-m", "--manual", type=int, help="Manually tune a specific MIDI note", required=False
-)
-
-args = parser.parse_args()
-
-#####################################################
-# Intialization
-#####################################################
-
-manual_note = args.manual
-
-if manual_note is None:
+def print_banner():
     print("██████   █████  ███    ███ ██████  ███████ ██       ██████   ██████  ")
     print("██   ██ ██   ██ ████  ████ ██   ██ ██      ██      ██    ██ ██       ")
     print("██   ██ ███████ ██ ████ ██ ██████  █████   ██      ██    ██ ██   ███ ")
@@ -337,141 +69,570 @@ if manual_note is None:
     print("- Please ensure PORTAMENTO has been turned off before tuning")
     print("")
 
-# ser = serial.Serial("/dev/ttyUSB0", UART_MIDI_BAUDRATE)
-print("Available MIDI ports:")
-while True:
+# Selects the MIDI output port whose name equals or matches the pattern
+# (regular expression). Without a pattern, the port is selected interactively,
+# unless yes is set and there is only a single port. Serial devices
+# (see transport.SERIAL_PREFIX) are selected as given.
+# Returns the port name, or None if no port could be selected.
+def select_port(pattern, yes):
     outputs = mido.get_output_names()
-    n_outputs = len(outputs)
-    for i in range(n_outputs):
-        print("{}. {}".format(i, outputs[i]))
-    print("")
-    sel = int(input("Select MIDI output port: "))
-    if sel < n_outputs:
-        port = mido.open_output(outputs[sel])
-        break
-    print ("Invalid port number")
-    print("")
 
-if manual_note is not None:
-    if manual_note < 0 or manual_note > MAX_MIDI_NOTE:
-        print("Invalid MIDI note")
-        exit(1)
-    dac_val = int(input("Enter manual DAC value: "))
-    if dac_val < 0 or dac_val > MAX_DAC_VAL:
-        print("Invalid DAC value")
-        exit(1)
-    write_dac(manual_note, dac_val)
-    print("Assigned DAC value {} to MIDI note {}".format(dac_val, manual_note))
-    exit(0)
-
-print("Press enter to begin the tuning process: ")
-input()
+    if pattern is not None:
+        if pattern.startswith(transport.SERIAL_PREFIX) or pattern in outputs:
+            return pattern
+        matches = [o for o in outputs if re.search(pattern, o)]
+        if len(matches) == 1:
+            return matches[0]
+        if not matches:
+            print("No MIDI output port matches: {}".format(pattern))
+        else:
+            print("Multiple MIDI output ports match {}: {}".format(pattern, ", ".join(matches)))
+        return None
+
+    if yes:
+        if len(outputs) == 1:
+            return outputs[0]
+        print("Select a MIDI output port with --port, available: {}".format(", ".join(outputs)))
+        return None
+
+    print("Available MIDI ports:")
+    while True:
+        outputs = mido.get_output_names()
+        n_outputs = len(outputs)
+        for i in range(n_outputs):
+            print("{}. {}".format(i, outputs[i]))
+        print("")
+        sel = int(input("Select MIDI output port: "))
+        if sel < n_outputs:
+            return outputs[sel]
+        print ("Invalid port number")
+        print("")
+
+# Asks a yes/no question, answered with the default if yes is set
+def ask(question, default, yes):
+    if yes:
+        return default
+
+    while True:
+        answer = input("{} ({}): ".format(question, "Y/n" if default else "y/N"))
+        if answer == "":
+            return default
+        elif answer.lower() == "y":
+            return True
+        elif answer.lower() == "n":
+            return False
+        print("Invalid input")
+
+# Writes the per-note results (see tuning.Tuner.note_result) and a summary
+# of the run as JSON or CSV (summary as comment lines)
+def write_results(path, fmt, results, summary):
+    if fmt is None:
+        fmt = "csv" if path.lower().endswith(".csv") else "json"
+
+    with open(path, "w", newline="") as f:
+        if fmt == "json":
+            json.dump(dict(summary, notes=results), f, indent=2)
+            f.write("\n")
+            return
+
+        for key, value in summary.items():
+            f.write("# {}: {}\n".format(key, value))
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
 
 #####################################################
-# Tuning process
+# Argument Parsing
 #####################################################
 
-while True:
-    midi_2_dac = {}
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Automatically tunes the Dampflog"
+    )
 
-    # Open/Enable GATE
-    set_gate(port, True)
-    print("GATE opened")
+    # parser.add_argument(
+    #     "-o", "--output", type=str, help="Output for lookup table header", required=True
+    # )
 
-    print("Waiting for oscillator to settle...")
-    time.sleep(OSC_STARTUP_SETTLE_TIME)
+    parser.add_argument(
+        "-m", "--manual", type=int, help="Manually tune a specific MIDI note", required=False
+    )
 
-    print("Beginning tuning process...")
-    # Set DAC to 0 and give it a second to settle
-    freq = msr_after_dac_chng(port, 0, 1, RECORD_DURATION)
+    parser.add_argument(
+        "-e", "--estimator", type=str, choices=list(pitch.ESTIMATORS), default=pitch.DEFAULT_ESTIMATOR,
+        help="Pitch estimator used to measure the oscillator frequency"
+    )
 
-    #####################################################
-    # Determine first note
-    #####################################################
+    parser.add_argument(
+        "-s", "--strategy", type=str, choices=tuning.STRATEGIES, default=tuning.DEFAULT_STRATEGY,
+        help="Search strategy used to find the DAC value of each note"
+    )
 
-    # Determining the first note is treated as a special case because
-    # the DAC must first enter the transistors operating region, meaning
-    # the first few hundred DAC values are guaranteed to be useless.
-    # Additionally, the CV to frequency response around the first note (A#2)
-    # is very low, meaning we don't have to be very precise to tune the first note.
+    parser.add_argument(
+        "-t", "--tolerance", type=float, default=tuning.DEFAULT_TOLERANCE,
+        help="Accepted error in cents (secant strategy and fit verification only)"
+    )
 
-    dac_val = 0
+    parser.add_argument(
+        "--tolerance-profile", type=str, default=None,
+        help="Per-region tolerances overriding --tolerance, ex. \"0-59:5,60-72:2,73-127:4\" (first-last:cents)"
+    )
 
-    # Sometimes the min. Note is already slightly greater than A#2
-    if freq >= midi_note_to_freq(OSC_MIN_NOTE):
-        midi_2_dac[OSC_MIN_NOTE] = 0
-        print(
-            "MIDI note: {} ({})   \tDAC value: {} \t\tError (cents): {}".format(
-                midi_note_to_name_oct(OSC_MIN_NOTE), OSC_MIN_NOTE, dac_val, error_in_cents(midi_note_to_freq(OSC_MIN_NOTE), freq)
-            )
+    parser.add_argument(
+        "--discover-range", action="store_true",
+        help="Discover the range of the oscillator, tune the usable notes beyond {}-{} and solve all others from the fitted response".format(
+            OSC_MIN_NOTE, OSC_MAX_NOTE
         )
-        dac_val = STEP_TABLE[0] # Pretend first note succeeded as second note is not as flaky
-    else:
-        dac_val, error = coarse_fine_tune(
-            port, dac_val, STEP_TABLE[0], 10, midi_note_to_freq(OSC_MIN_NOTE)
+    )
+
+    parser.add_argument(
+        "--simulate", action="store_true", help="Tune a simulated Dampflog instead of real hardware"
+    )
+
+    parser.add_argument(
+        "--sim-noise", type=float, default=0.01, help="Noise level of the simulated audio"
+    )
+
+    parser.add_argument(
+        "--sim-drift", type=float, default=0.0, help="Warm-up drift of the simulated oscillator (cents)"
+    )
+
+    parser.add_argument(
+        "--sim-settle", type=float, default=0.0, help="Settling time constant of the simulated CV (seconds)"
+    )
+
+    parser.add_argument(
+        "--sim-lut", type=str, default=None, help="CSV file with the initial LUT of the simulated Dampflog"
+    )
+
+    parser.add_argument(
+        "--sim-pitch-offset", type=float, default=0.0,
+        help="Pitch offset (cents) of the simulated oscillator, moves its range"
+    )
+
+    parser.add_argument(
+        "--sim-seed", type=int, default=None, help="Seed of the simulator's random number generator"
+    )
+
+    parser.add_argument(
+        "--sim-clock-error", type=float, default=0.0,
+        help="Relative error of the simulated Dampflog's clock, stretches DAC staircases"
+    )
+
+    parser.add_argument(
+        "--sim-host-time", action="store_true",
+        help="Let the processing time of the host (ex. pitch analysis) pass in simulated time as well"
+    )
+
+    tuning.add_tuner_arguments(parser)
+
+    parser.add_argument(
+        "--archive", type=str, default=None,
+        help="Store the raw capture of every measurement in this archive directory (see archive.py)"
+    )
+
+    parser.add_argument(
+        "--replay", type=str, default=None,
+        help="Replay the captures of an archive directory instead of tuning real hardware"
+    )
+
+    parser.add_argument(
+        "-i", "--incremental", action="store_true",
+        help="Only retune notes of the LUT stored on the device that have drifted"
+    )
+
+    parser.add_argument(
+        "--retune-threshold", type=float, default=tuning.DEFAULT_RETUNE_THRESHOLD,
+        help="Drift in cents above which a note is retuned (incremental mode only)"
+    )
+
+    parser.add_argument(
+        "-d", "--device", type=str, default=None,
+        help="Device name or serial used for calibration profiles (default: MIDI port name)"
+    )
+
+    profiles.add_profile_arguments(parser)
+
+    parser.add_argument(
+        "-p", "--port", type=str, default=None,
+        help="MIDI output port, given by its name or a regular expression matching it, or a serial device wired to the MIDI UART (ex. serial:/dev/ttyUSB0)"
+    )
+
+    parser.add_argument(
+        "-a", "--audio-device", type=audio.parse_device, default=None,
+        help="Audio input device, given by its name or index (default input device if omitted)"
+    )
+
+    parser.add_argument(
+        "--min-note", type=int, default=OSC_MIN_NOTE, help="Lowest MIDI note to tune"
+    )
+
+    parser.add_argument(
+        "--max-note", type=int, default=OSC_MAX_NOTE, help="Highest MIDI note to tune"
+    )
+
+    parser.add_argument(
+        "-y", "--yes", action="store_true",
+        help="Run non-interactively, without any prompts (a single tuning pass)"
+    )
+
+    parser.add_argument(
+        "-o", "--output", type=str, default=None, help="Write per-note results to this file"
+    )
+
+    parser.add_argument(
+        "-f", "--format", type=str, choices=OUTPUT_FORMATS, default=None,
+        help="Format of the results (default: derived from the file extension, else json)"
+    )
+
+    parser.add_argument(
+        "--value", type=int, default=None, help="DAC value assigned in manual mode (instead of prompting)"
+    )
+
+    parser.add_argument(
+        "--fit", action="store_true",
+        help="Fit the response to a sparse sweep of DAC values instead of searching every note"
+    )
+
+    parser.add_argument(
+        "--fit-points", type=int, default=None,
+        help="Max. number of DAC values measured by the sweep (fit mode only, default {}, {} with --sweep, {} with --staircase)".format(
+            tuning.DEFAULT_FIT_POINTS, tuning.DEFAULT_SWEEP_FIT_POINTS, tuning.DEFAULT_STAIRCASE_FIT_POINTS
         )
+    )
 
-        midi_2_dac[OSC_MIN_NOTE] = dac_val
+    parser.add_argument(
+        "--sweep", action="store_true",
+        help="Capture several DAC values per recording instead of one (fit mode only)"
+    )
 
-        print(
-            "MIDI note: {} ({})\tDAC value: {} \tError (cents): {}".format(
-                midi_note_to_name_oct(OSC_MIN_NOTE), OSC_MIN_NOTE, dac_val, error
-            )
+    parser.add_argument(
+        "--staircase", action="store_true",
+        help="Let the Dampflog step the DAC through the first sweep on its own timer (fit mode only, implies --sweep)"
+    )
+
+    parser.add_argument(
+        "--sweep-dwell", type=float, default=tuning.SWEEP_DWELL,
+        help="Time (seconds) each DAC value is held within a sweep capture"
+    )
+
+    parser.add_argument(
+        "--no-verify", dest="verify", action="store_false",
+        help="Don't measure every fitted note once and search it if it is off by more than the tolerance (fit mode only)"
+    )
+
+    parser.add_argument(
+        "-r", "--refine", type=int, default=0,
+        help="Number of refinement passes, which only remeasure notes that aren't within the tolerance with confidence"
+    )
+
+    parser.add_argument(
+        "--check", action="store_true",
+        help="Play the tuned notes through the written look-up table afterwards and report the ones that need retuning"
+    )
+
+    parser.add_argument(
+        "--check-only", action="store_true",
+        help="Only play the notes through the look-up table stored on the device and report the ones that need retuning"
+    )
+
+    parser.add_argument(
+        "--trace", type=str, default=None,
+        help="Write a trace of every measurement to this CSV file and print a time breakdown"
+    )
+
+    parser.add_argument(
+        "--cprofile", type=str, default=None,
+        help="Run under cProfile and dump the statistics to this file"
+    )
+
+    return parser
+
+#####################################################
+# Main
+#####################################################
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+
+    if args.min_note < OSC_MIN_NOTE or args.max_note > OSC_MAX_NOTE or args.min_note > args.max_note:
+        parser.error("The note range must lie within {}-{}".format(OSC_MIN_NOTE, OSC_MAX_NOTE))
+
+    if args.sweep_dwell <= tuning.SWEEP_GUARD:
+        parser.error("The sweep dwell time must be longer than {}s".format(tuning.SWEEP_GUARD))
+
+    args.tolerances = None
+    if args.tolerance_profile is not None:
+        try:
+            args.tolerances = tuning.parse_tolerances(args.tolerance_profile)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.cprofile is not None:
+        return instrument.run_profiled(args.cprofile, run, args)
+    return run(args)
+
+# Runs a session with the parsed arguments, returns the exit code
+def run(args):
+    manual_note = args.manual
+
+    if manual_note is None and not args.yes:
+        print_banner()
+
+    #####################################################
+    # Intialization
+    #####################################################
+
+    if args.simulate:
+        sim = dampflog_sim.SimulatedDampflog(
+            sample_rate=RECORD_SAMPLE_RATE,
+            noise=args.sim_noise,
+            drift=args.sim_drift,
+            settle_time=args.sim_settle,
+            pitch_offset=args.sim_pitch_offset,
+            seed=args.sim_seed,
+            lut=dampflog_sim.load_lut_csv(args.sim_lut) if args.sim_lut else None,
+            clock_error=args.sim_clock_error,
+            host_time=args.sim_host_time,
         )
+        port = sim
+        port_in = sim
+        audio_in = sim
+        wait = sim.sleep
+        clock = sim.now
+        device = "simulated"
+        print("Using simulated Dampflog")
+        print("")
+    elif args.replay is not None:
+        replay = archive.ReplayDampflog(archive.CaptureArchive(args.replay))
+        port = replay
+        port_in = replay
+        audio_in = replay
+        wait = replay.sleep
+        clock = replay.now
+        device = "replay"
+        print("Replaying archive: {} ({} captures)".format(args.replay, len(replay.archive.captures)))
+        print("")
+    else:
+        device = select_port(args.port, args.yes)
+        if device is None:
+            return 1
+
+        port, port_in = transport.open_ports(device)
+        wait = time.sleep
+        clock = time.monotonic
+
+        audio_in = audio.SoundDeviceInput(RECORD_SAMPLE_RATE, args.audio_device)
+
+    trace = None
+    if args.trace is not None:
+        trace = instrument.Trace(clock)
+
+    capture_archive = None
+    if args.archive is not None:
+        capture_archive = archive.CaptureArchive(args.archive, "w", RECORD_SAMPLE_RATE)
+
+    tuner = tuning.Tuner(
+        port, audio_in, port_in, wait, clock,
+        estimator=args.estimator,
+        strategy=args.strategy,
+        tolerance=args.tolerance,
+        tolerances=args.tolerances,
+        adaptive_settle=args.adaptive_settle,
+        adaptive_capture=args.adaptive_capture,
+        sweep_dwell=args.sweep_dwell,
+        drift_interval=args.drift_interval,
+        cache_ttl=args.cache,
+        archive=capture_archive,
+        sync=args.sync,
+        pipeline=args.pipeline,
+        trace=trace,
+    )
+
+    if args.device is not None:
+        device = args.device
+
+    # Step table, learned from recent calibration profiles if available
+    step_table = tuning.STEP_TABLE
+    if not args.no_profile:
+        recent = profiles.recent_profiles(args.profile_store, device, args.profile_average)
+        if recent:
+            step_table = profiles.derive_step_table(recent, OSC_MIN_NOTE, OSC_MAX_NOTE, tuning.STEP_TABLE)
+            print("Derived step table from {} calibration profile(s) of {}".format(len(recent), device))
+            print("")
+
+    # Stores the calibration profile of the current tuning pass
+    def store_profile(lut):
+        if args.no_profile:
+            return
+        path = profiles.save_profile(args.profile_store, device, tuner.measured_points, lut, args.notes)
+        print("Stored calibration profile: {}".format(path))
+
+    # Writes the trace and prints its breakdown, if requested
+    def output_trace():
+        if trace is None:
+            return
+        trace.write(args.trace)
+        print("")
+        for line in trace.breakdown():
+            print(line)
+        print("Wrote trace: {}".format(args.trace))
+
+    # Plays the notes through the LUT of the device, which is expected to
+    # equal lut (if known). A cold oscillator is given the full startup settle.
+    # Returns whether all notes are within their tolerance.
+    def check_lut(lut, settle=tuning.CHECK_SETTLE_TIME):
+        print("Checking MIDI to DAC look-up table...")
+        checks = tuner.chromatic_check(args.min_note, args.max_note, lut, settle=settle)
+        return all(c["passed"] for c in checks)
+
+    # Writes the results of the run, if requested
+    def output_results(mode, t_start, n_measurements):
+        if args.output is None:
+            return
+        summary = {
+            "device": device,
+            "mode": mode,
+            "strategy": args.strategy,
+            "estimator": args.estimator,
+            "tolerance": args.tolerance,
+            "min_note": args.min_note,
+            "max_note": args.max_note,
+            "measurements": n_measurements,
+            "time": clock() - t_start,
+        }
+        write_results(args.output, args.format, tuner.results, summary)
+        print("Wrote results: {}".format(args.output))
+
+    if manual_note is not None:
+        if manual_note < 0 or manual_note > MAX_MIDI_NOTE:
+            print("Invalid MIDI note")
+            return 1
+        dac_val = args.value
+        if dac_val is None:
+            if args.yes:
+                print("No DAC value given, use --value")
+                return 1
+            dac_val = int(input("Enter manual DAC value: "))
+        if dac_val < 0 or dac_val > MAX_DAC_VAL:
+            print("Invalid DAC value")
+            return 1
+        tuner.write_dac(manual_note, dac_val)
+        print("Assigned DAC value {} to MIDI note {}".format(dac_val, manual_note))
+        tuner.close()
+        return 0
+
+    if not args.simulate and args.replay is None and not args.yes:
+        print("Press enter to begin the tuning process: ")
+        input()
 
     #####################################################
-    # Determine remaining notes
+    # Chromatic check
     #####################################################
 
-    second_note = OSC_MIN_NOTE + 1
-    fine_step = 1
+    if args.check_only:
+        passed = check_lut(tuner.read_lut(), settle=tuning.OSC_STARTUP_SETTLE_TIME)
+        output_trace()
+        tuner.close()
+        return 0 if passed else 1
 
-    for i in range(second_note, OSC_MAX_NOTE + 1):
-        dac_val, error = coarse_fine_tune(
-            port, dac_val, STEP_TABLE[i - OSC_MIN_NOTE], fine_step, midi_note_to_freq(i)
-        )
+    #####################################################
+    # Incremental retune
+    #####################################################
+
+    if args.incremental:
+        device_lut = tuner.read_lut()
+        if device_lut is None:
+            print("Failed to read the MIDI to DAC look-up table from the device")
+            tuner.close()
+            return 1
+
+        t_start = clock()
+
+        tuner.set_gate(True)
+        print("GATE opened")
+        tuner.settle_oscillator()
+
+        print("Verifying stored look-up table...")
+        results = tuner.incremental_retune(device_lut, args.retune_threshold, args.min_note, args.max_note)
 
-        midi_2_dac[i] = dac_val
+        tuner.set_gate(False)
+        print("GATE closed")
 
+        lut = tuning.build_lut(tuning.results_to_midi_2_dac(results), device_lut)
+
+        n_written = tuner.upload_lut(lut, device_lut)
+        print("Wrote {} LUT entries".format(n_written))
+        store_profile(lut)
         print(
-            "MIDI note: {} ({})   \tDAC value: {} \tError (cents): {}".format(
-                midi_note_to_name_oct(i), i, dac_val, error
-            )
+            "Total measurements: {}\tTime: {:.1f}s".format(tuner.n_measurements, clock() - t_start)
         )
+        output_results("incremental", t_start, tuner.n_measurements)
+        passed = check_lut(lut) if args.check else True
+        output_trace()
 
-    set_gate(port, False)
-    print("GATE closed")
+        tuner.close()
 
-    brk = True
+        print("Retune complete!")
+        return 0 if passed else 1
 
-    while True:
-        answer = input("Do you wish to tune the device again? (y/N): ")
-        if answer.lower() == "y":
-            brk = False
-            break
-        elif answer.lower() == "n" or answer == "":
-            break
-        else:
-            print("Invalid input")
-
-    if brk:
-        break
+    #####################################################
+    # Tuning process
+    #####################################################
 
-#####################################################
-# Write results into MIDI to DAC look-up table
-#####################################################
-print("Writing results into MIDI to DAC look-up table...")
-for i in range(0, MAX_MIDI_NOTE + 1):
-    if i < OSC_MIN_NOTE:
-        write_dac(i, 0)
-    elif i > OSC_MAX_NOTE:
-        write_dac(i, MAX_DAC_VAL)
+    t_start = clock()
+    if args.fit:
+        fit_points = args.fit_points
+        if fit_points is None and args.staircase:
+            fit_points = tuning.DEFAULT_STAIRCASE_FIT_POINTS
+        elif fit_points is None:
+            fit_points = tuning.DEFAULT_SWEEP_FIT_POINTS if args.sweep else tuning.DEFAULT_FIT_POINTS
+        results = tuner.fit_pass(
+            args.min_note, args.max_note, fit_points, args.verify, args.sweep, args.staircase, args.discover_range
+        )
     else:
-        write_dac(i, midi_2_dac[i])
+        results = tuner.tune_pass(step_table, args.min_note, args.max_note, args.discover_range)
+    n_measurements = tuner.n_measurements
+
+    # Further passes only remeasure notes that aren't within the tolerance with confidence
+    n_passes = 0
+    while n_passes < args.refine or ask("Do you wish to refine the tuning?", False, args.yes):
+        results = tuner.refine_pass(results)
+        n_measurements += tuner.n_measurements
+        n_passes += 1
 
-port.close()
+    #####################################################
+    # Write results into MIDI to DAC look-up table
+    #####################################################
+    print("Writing results into MIDI to DAC look-up table...")
+    midi_2_dac = tuning.results_to_midi_2_dac(results)
 
-print("Tuning complete!")
+    # With range discovery, untuned notes are solved from the fitted response
+    fitted_lut = tuner.fitted_lut() if args.discover_range else None
+
+    t_upload = clock()
+    if args.min_note == OSC_MIN_NOTE and args.max_note == OSC_MAX_NOTE:
+        lut = tuning.build_lut(midi_2_dac, fitted_lut)
+        n_written = tuner.upload_lut(lut)
+    else:
+        # Only the tuned notes are written. The other entries are kept
+        # from the device if it can be read back (for the profile).
+        device_lut = tuner.read_lut()
+        lut = tuning.build_lut(midi_2_dac, device_lut if device_lut is not None else fitted_lut)
+        if device_lut is None:
+            device_lut = [None if i in midi_2_dac else lut[i] for i in range(len(lut))]
+        n_written = tuner.upload_lut(lut, device_lut)
+    print("Wrote {} LUT entries in {:.2f}s".format(n_written, clock() - t_upload))
+    store_profile(lut)
+    output_results("fit" if args.fit else "tune", t_start, n_measurements)
+    passed = check_lut(lut) if args.check else True
+    output_trace()
+
+    tuner.close()
+
+    print("Tuning complete!")
+    return 0 if passed else 1
 
 #####################################################
 # Generate C header file
@@ -506,4 +667,7 @@ print("Tuning complete!")
 #     f.write("#endif\n")
 
 # print("Generated C header file: " + args.output)
-# print("Tuning complete!")
\ No newline at end of file
+# print("Tuning complete!")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# Benchmarks the pitch estimators in pitch.py on synthetic tones
+#
+# For every note in the Dampflog's range (A#2 - E5) a buffer of the same
+# length as an autotune.py recording is synthesized. Each estimator is then
+# timed on these buffers and its error in cents is reported.
+
+import argparse
+import time
+import numpy as np
+
+import pitch
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+SAMPLE_RATE = pitch.DEFAULT_SAMPLE_RATE
+BUFFER_LEN = 13230      # 0.3 s at 44.1 kHz, see RECORD_DURATION in tuning.py
+
+MIN_NOTE = 46           # A#2
+MAX_NOTE = 76           # E5
+
+DEFAULT_NOISE = 0.05    # Standard deviation of the additive noise, relative to a peak amplitude of 0.5
+
+#####################################################
+# Helper Functions
+#####################################################
+
+def midi_note_to_freq(note):
+    return 440 * 2 ** ((note - 69) / 12)
+
+def error_in_cents(target_freq, measured_freq):
+    return 1200 * np.log2(measured_freq / target_freq)
+
+# Synthesizes a band limited sawtooth-like tone with a random phase
+# and additive white noise
+def synth_tone(freq, noise, rng, n_harmonics=8):
+    t = np.arange(BUFFER_LEN) / SAMPLE_RATE
+    phase = rng.uniform(0, 2 * np.pi)
+    x = np.zeros(BUFFER_LEN)
+    for k in range(1, n_harmonics + 1):
+        if k * freq >= SAMPLE_RATE / 2:
+            break
+        x += np.sin(2 * np.pi * k * freq * t + k * phase) / k
+    x *= 0.5 / np.max(np.abs(x))
+    return x + rng.normal(0, noise, BUFFER_LEN)
+
+# The original estimator of autotune.py, kept as reference
+def legacy_get_freq(sample, rate=SAMPLE_RATE):
+    positive_zero_intercepts = []
+    for i in range(len(sample)):
+        if i == 0:
+            continue
+        if sample[i] > 0 and sample[i - 1] < 0:
+            positive_zero_intercepts.append(i)
+
+    diffs = []
+    for i in range(len(positive_zero_intercepts)):
+        if i == 0:
+            continue
+        diffs.append(positive_zero_intercepts[i] - positive_zero_intercepts[i - 1])
+
+    return rate / np.mean(diffs)
+
+#####################################################
+# Benchmark
+#####################################################
+
+parser = argparse.ArgumentParser(
+    description="Benchmarks the pitch estimators on synthetic tones"
+)
+
+parser.add_argument(
+    "-n", "--noise", type=float, default=DEFAULT_NOISE, help="Standard deviation of the additive noise (0 for clean tones)"
+)
+
+parser.add_argument(
+    "-r", "--repeat", type=int, default=3, help="Number of timed runs per buffer"
+)
+
+parser.add_argument(
+    "--seed", type=int, default=0, help="Seed of the random number generator"
+)
+
+args = parser.parse_args()
+
+rng = np.random.default_rng(args.seed)
+notes = range(MIN_NOTE, MAX_NOTE + 1)
+buffers = [synth_tone(midi_note_to_freq(n), args.noise, rng) for n in notes]
+
+estimators = {"legacy": legacy_get_freq}
+estimators.update(pitch.ESTIMATORS)
+
+print("Buffer length: {} samples, noise: {}".format(BUFFER_LEN, args.noise))
+print("")
+print("{:<20} {:>14} {:>16} {:>16}".format("Estimator", "Time (ms/buf)", "Mean |err| (ct)", "Max |err| (ct)"))
+
+for name, estimator in estimators.items():
+    errors = []
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for note, buf in zip(notes, buffers):
+            f = estimator(buf, SAMPLE_RATE)
+            errors.append(abs(error_in_cents(midi_note_to_freq(note), f)))
+    elapsed = (time.perf_counter() - start) / (args.repeat * len(buffers))
+
+    print("{:<20} {:>14.3f} {:>16.3f} {:>16.3f}".format(name, elapsed * 1000, np.mean(errors), np.max(errors)))
@@ -0,0 +1,123 @@
+# Benchmarks the round trip latency of commands to the Dampflog per transport
+#
+# Every transport (MIDI ports of USB-MIDI interfaces, serial devices wired to
+# the MIDI UART, see transport.py) is sent SYNC messages, on their own and
+# right after a SET DAC message, and the time until their acknowledgement
+# arrives is measured. The latter is what the tuner waits for after every
+# DAC change with --sync (see Tuner.synced).
+#
+# With --simulate, a simulated Dampflog is benchmarked as well, which only
+# accounts for the transmission time over the MIDI UART.
+#
+# Ex.: python bench_transport.py -p "USB MIDI" -p serial:/dev/ttyUSB0
+
+import argparse
+import time
+import numpy as np
+
+import dampflog_sim
+import transport
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+WARMUP = 5                  # Round trips discarded before measuring
+DAC_VALUES = (1024, 3072)   # Alternately sent by the SET DAC round trips
+
+#####################################################
+# Helper Functions
+#####################################################
+
+# Measures n round trips of a command. Every round trip sends the messages
+# returned by msgs(i) followed by a SYNC message.
+# Returns the latencies (seconds) and the number of timeouts.
+def measure(port, port_in, wait, clock, msgs, n):
+    latencies = []
+    timeouts = 0
+    for i in range(WARMUP + n):
+        t_start = clock()
+        for msg in msgs(i):
+            port.send(msg)
+        if not transport.sync(port, port_in, wait, clock):
+            timeouts += 1
+            continue
+        if i >= WARMUP:
+            latencies.append(clock() - t_start)
+    return latencies, timeouts
+
+# Benchmarks a transport, prints a line per command
+def run_transport(name, port, port_in, wait, clock, n):
+    if port_in is None:
+        print("{:<32} no MIDI input, acknowledgements can't be received".format(name))
+        return None
+    if not transport.sync(port, port_in, wait, clock):
+        print("{:<32} no acknowledgement of SYNC (firmware without SYNC?)".format(name))
+        return None
+
+    commands = [
+        ("SYNC", lambda i: []),
+        ("SET DAC + SYNC", lambda i: [transport.set_dac_msg(DAC_VALUES[i % len(DAC_VALUES)])]),
+    ]
+    medians = {}
+    for command, msgs in commands:
+        latencies, timeouts = measure(port, port_in, wait, clock, msgs, n)
+        if not latencies:
+            print("{:<32} {:<16} all {} round trips timed out".format(name, command, timeouts))
+            continue
+        ms = 1000 * np.array(latencies)
+        medians[command] = float(np.median(ms))
+        print("{:<32} {:<16} {:>10.2f} {:>12.2f} {:>10.2f} {:>10.2f} {:>10}".format(
+            name, command, np.min(ms), np.median(ms), np.percentile(ms, 95), np.max(ms), timeouts
+        ))
+    return medians
+
+#####################################################
+# Benchmark
+#####################################################
+
+parser = argparse.ArgumentParser(
+    description="Benchmarks the round trip latency of commands to the Dampflog per transport"
+)
+
+parser.add_argument(
+    "-p", "--port", type=str, action="append", default=[],
+    help="MIDI port or serial device wired to the MIDI UART (serial:DEVICE) to benchmark, may be repeated"
+)
+
+parser.add_argument(
+    "-n", "--count", type=int, default=200, help="Number of round trips per command"
+)
+
+parser.add_argument(
+    "--simulate", action="store_true", help="Also benchmark a simulated Dampflog"
+)
+
+args = parser.parse_args()
+
+if not args.port and not args.simulate:
+    parser.error("No transports given, use --port or --simulate")
+
+print("{:<32} {:<16} {:>10} {:>12} {:>10} {:>10} {:>10}".format(
+    "Transport", "Command", "Min (ms)", "Median (ms)", "P95 (ms)", "Max (ms)", "Timeouts"
+))
+
+results = {}
+if args.simulate:
+    sim = dampflog_sim.SimulatedDampflog()
+    results["simulated"] = run_transport("simulated", sim, sim, sim.sleep, sim.now, args.count)
+
+for name in args.port:
+    port, port_in = transport.open_ports(name)
+    try:
+        results[name] = run_transport(name, port, port_in, time.sleep, time.perf_counter, args.count)
+    finally:
+        port.close()
+        if port_in is not None and port_in is not port:
+            port_in.close()
+
+measured = {name: r["SET DAC + SYNC"] for name, r in results.items() if r and "SET DAC + SYNC" in r}
+if measured:
+    fastest = min(measured, key=measured.get)
+    print("")
+    print("Fastest transport: {} ({:.2f} ms median per DAC change)".format(fastest, measured[fastest]))
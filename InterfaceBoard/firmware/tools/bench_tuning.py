@@ -0,0 +1,295 @@
+# Benchmarks the tuning strategies of tuning.py on simulated Dampflogs
+#
+# Every combination of strategy and pitch estimator tunes the same set of
+# simulated boards (see dampflog_sim.py), whose response is derived from the
+# measured frequency vs. resistance curve of the oscillator and shifted by a
+# random DAC offset per board. The tuned DAC values are checked against the
+# simulators ground truth, so the reported errors are the actual errors of the
+# resulting LUT rather than the errors measured while tuning.
+#
+# With --pipeline, the tuners send the next likely DAC value of a search while
+# the current capture is analyzed (see Tuner.speculate). Use --host-time to let
+# the host's processing time pass in simulated time, otherwise analysis is
+# free and pipelining can't gain anything. The achieved measurements per
+# second are reported for comparison with the sequential loop.
+#
+# With --replay, archived sessions of real Dampflogs (see archive.py) are
+# replayed instead of simulated boards. The ground truth is then the
+# response interpolated between the archived captures.
+#
+# The results can be stored as a JSON baseline (--write-baseline) and later
+# runs compared against it (--baseline). Regressions in measurements,
+# simulated time or accuracy make the benchmark exit with status 1.
+#
+# Ex.: python bench_tuning.py --baseline bench_tuning_baseline.json
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+import numpy as np
+
+import archive
+import dampflog_sim
+import pitch
+import tuning
+from tuning import OSC_MIN_NOTE, OSC_MAX_NOTE, RECORD_SAMPLE_RATE
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+# Tolerances of the baseline comparison
+MEASUREMENT_TOLERANCE = 0.05    # Relative increase of the measurements
+TIME_TOLERANCE = 0.05           # Relative increase of the simulated time
+ERROR_TOLERANCE = 0.5           # cents, increase of the max./RMS error
+CPU_TOLERANCE = 2.0             # Factor, CPU time depends on the machine (--check-cpu only)
+
+#####################################################
+# Strategies
+#####################################################
+
+# Search strategy of the tuner (see tuning.STRATEGIES) and the tuning pass
+# of every benchmarked strategy. The passes return the per-note results.
+# The fit passes search the notes that fail verification with the secant strategy.
+STRATEGIES = {
+    "linear": ("linear", lambda tuner: tuner.tune_pass()),
+    "secant": ("secant", lambda tuner: tuner.tune_pass()),
+    "fit": ("secant", lambda tuner: tuner.fit_pass()),
+    "fit-sweep": ("secant", lambda tuner: tuner.fit_pass(
+        max_points=tuning.DEFAULT_SWEEP_FIT_POINTS, sweep=True
+    )),
+    "fit-staircase": ("secant", lambda tuner: tuner.fit_pass(
+        max_points=tuning.DEFAULT_STAIRCASE_FIT_POINTS, staircase=True
+    )),
+}
+
+#####################################################
+# Helper Functions
+#####################################################
+
+# Creates the simulated boards, every board is given by its simulator arguments
+def make_boards(n, noise, seed):
+    rng = np.random.default_rng(seed)
+    boards = []
+    for i in range(n):
+        offset = 0 if i == 0 else dampflog_sim.random_dac_offset(rng)
+        boards.append({
+            "sample_rate": RECORD_SAMPLE_RATE,
+            "noise": noise,
+            "dac_offset": offset,
+            "seed": seed + i,
+        })
+    return boards
+
+# Tunes a simulated board (or replays an archived one) with a strategy and estimator.
+# Returns the true errors (cents) of the tuned notes and the tuners counters.
+def run_board(board, strategy, estimator, adaptive_capture, pipeline, host_time, verbose):
+    if "replay" in board:
+        sim = archive.ReplayDampflog(archive.CaptureArchive(board["replay"]))
+    else:
+        sim = dampflog_sim.SimulatedDampflog(host_time=host_time, **board)
+    tuner = tuning.Tuner(
+        sim, sim, sim, sim.sleep, sim.now,
+        estimator=estimator,
+        strategy=STRATEGIES[strategy][0],
+        adaptive_capture=adaptive_capture,
+        pipeline=pipeline,
+    )
+
+    out = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    t_start = time.perf_counter()
+    with out:
+        results = STRATEGIES[strategy][1](tuner)
+    cpu_time = time.perf_counter() - t_start
+
+    errors = [
+        tuning.error_in_cents(tuning.midi_note_to_freq(r["note"]), sim.dac_to_freq(r["dac"]))
+        for r in results
+    ]
+    return {
+        "errors": errors,
+        "measurements": tuner.n_measurements,
+        "time": sim.now(),
+        "record_time": tuner.record_time,
+        "analyze_time": tuner.analyze_time,
+        "cpu_time": cpu_time,
+    }
+
+# Benchmarks a strategy and estimator on all boards
+def run_benchmark(boards, strategy, estimator, adaptive_capture, pipeline, host_time, verbose):
+    runs = [
+        run_board(board, strategy, estimator, adaptive_capture, pipeline, host_time, verbose)
+        for board in boards
+    ]
+    errors = np.abs(np.concatenate([r["errors"] for r in runs]))
+    n = len(runs)
+    return {
+        "strategy": strategy,
+        "estimator": estimator,
+        "measurements": sum(r["measurements"] for r in runs) / n,
+        "time": sum(r["time"] for r in runs) / n,
+        "record_time": sum(r["record_time"] for r in runs) / n,
+        "rate": sum(r["measurements"] for r in runs) / sum(r["time"] for r in runs),
+        "max_error": float(np.max(errors)),
+        "rms_error": float(np.sqrt(np.mean(errors ** 2))),
+        "analyze_time": sum(r["analyze_time"] for r in runs) / n,
+        "cpu_time": sum(r["cpu_time"] for r in runs) / n,
+    }
+
+# Compares a result against its baseline, returns the regressions found
+def regressions(result, base, check_cpu):
+    found = []
+    if result["measurements"] > base["measurements"] * (1 + MEASUREMENT_TOLERANCE):
+        found.append("measurements {:.1f} -> {:.1f}".format(base["measurements"], result["measurements"]))
+    if result["time"] > base["time"] * (1 + TIME_TOLERANCE):
+        found.append("time {:.1f}s -> {:.1f}s".format(base["time"], result["time"]))
+    for key in ["max_error", "rms_error"]:
+        if result[key] > base[key] + ERROR_TOLERANCE:
+            found.append("{} {:.2f} -> {:.2f}".format(key, base[key], result[key]))
+    if check_cpu and result["analyze_time"] > base["analyze_time"] * CPU_TOLERANCE:
+        found.append("analyze_time {:.3f}s -> {:.3f}s".format(base["analyze_time"], result["analyze_time"]))
+    return found
+
+#####################################################
+# Benchmark
+#####################################################
+
+parser = argparse.ArgumentParser(
+    description="Benchmarks the tuning strategies on simulated Dampflogs"
+)
+
+parser.add_argument(
+    "-s", "--strategy", type=str, action="append", choices=list(STRATEGIES),
+    help="Strategy to benchmark, may be repeated (all if omitted)"
+)
+
+parser.add_argument(
+    "-e", "--estimator", type=str, action="append", choices=list(pitch.ESTIMATORS),
+    help="Pitch estimator to benchmark, may be repeated (all if omitted)"
+)
+
+parser.add_argument(
+    "-b", "--boards", type=int, default=3, help="Number of simulated boards"
+)
+
+parser.add_argument(
+    "-n", "--noise", type=float, default=0.02, help="Noise level of the simulated audio"
+)
+
+parser.add_argument(
+    "--seed", type=int, default=0, help="Seed of the simulators' random number generators"
+)
+
+parser.add_argument(
+    "--adaptive-capture", action="store_true",
+    help="Record only as long as the precision of each measurement requires (see Tuner.record_adaptive)"
+)
+
+parser.add_argument(
+    "--pipeline", action="store_true",
+    help="Send the next likely DAC value of a search while the current capture is analyzed (see Tuner.speculate)"
+)
+
+parser.add_argument(
+    "--host-time", action="store_true",
+    help="Let the processing time of the host pass in simulated time (simulated boards only)"
+)
+
+parser.add_argument(
+    "--replay", type=str, action="append",
+    help="Replay an archived session instead of the simulated boards, may be repeated"
+)
+
+parser.add_argument(
+    "--baseline", type=str, default=None, help="Compare the results against a JSON baseline"
+)
+
+parser.add_argument(
+    "--write-baseline", type=str, default=None, help="Store the results as JSON baseline"
+)
+
+parser.add_argument(
+    "--check-cpu", action="store_true",
+    help="Also treat increased estimator CPU time as regression (only meaningful on the same machine)"
+)
+
+parser.add_argument(
+    "-v", "--verbose", action="store_true", help="Print the output of the tuning passes"
+)
+
+args = parser.parse_args()
+
+strategies = args.strategy or list(STRATEGIES)
+estimators = args.estimator or list(pitch.ESTIMATORS)
+if args.replay:
+    boards = [{"replay": path} for path in args.replay]
+    print("Replayed sessions: {}, notes: {}-{}".format(", ".join(args.replay), OSC_MIN_NOTE, OSC_MAX_NOTE))
+else:
+    boards = make_boards(args.boards, args.noise, args.seed)
+    print("Boards: {}, noise: {}, seed: {}, notes: {}-{}".format(
+        args.boards, args.noise, args.seed, OSC_MIN_NOTE, OSC_MAX_NOTE
+    ))
+print("")
+print("{:<16} {:<22} {:>14} {:>10} {:>14} {:>8} {:>16} {:>14} {:>14}".format(
+    "Strategy", "Estimator", "Measurements", "Time (s)", "Recorded (s)", "Msr/s", "Max |err| (ct)", "RMS err (ct)",
+    "Analyze (ms)"
+))
+
+results = []
+for strategy in strategies:
+    for estimator in estimators:
+        r = run_benchmark(
+            boards, strategy, estimator, args.adaptive_capture, args.pipeline, args.host_time, args.verbose
+        )
+        results.append(r)
+        print("{:<16} {:<22} {:>14.1f} {:>10.1f} {:>14.1f} {:>8.2f} {:>16.2f} {:>14.2f} {:>14.1f}".format(
+            strategy, estimator, r["measurements"], r["time"], r["record_time"], r["rate"],
+            r["max_error"], r["rms_error"], 1000 * r["analyze_time"]
+        ))
+
+if args.replay:
+    settings = {"replay": args.replay}
+else:
+    settings = {"boards": args.boards, "noise": args.noise, "seed": args.seed}
+if args.adaptive_capture:
+    settings["adaptive_capture"] = True
+if args.pipeline:
+    settings["pipeline"] = True
+if args.host_time:
+    settings["host_time"] = True
+
+if args.write_baseline is not None:
+    with open(args.write_baseline, "w") as f:
+        json.dump(dict(settings, results=results), f, indent=2)
+        f.write("\n")
+    print("")
+    print("Wrote baseline: {}".format(args.write_baseline))
+
+if args.baseline is not None:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    print("")
+    baseline_settings = {key: value for key, value in baseline.items() if key != "results"}
+    if baseline_settings != settings:
+        print("Baseline settings differ: {} (this run: {})".format(baseline_settings, settings))
+        sys.exit(1)
+
+    base = {(b["strategy"], b["estimator"]): b for b in baseline["results"]}
+    n_regressions = 0
+    for r in results:
+        key = (r["strategy"], r["estimator"])
+        if key not in base:
+            print("{} / {}: not in baseline".format(*key))
+            continue
+        for regression in regressions(r, base[key], args.check_cpu):
+            print("{} / {}: regression in {}".format(key[0], key[1], regression))
+            n_regressions += 1
+
+    if n_regressions > 0:
+        print("{} regressions found".format(n_regressions))
+        sys.exit(1)
+    print("No regressions against baseline: {}".format(args.baseline))
@@ -0,0 +1,351 @@
+# Simulated Dampflog for hardware-free tuning runs and benchmarks
+#
+# The simulator acts as both the MIDI output and input port (it accepts the
+# same mido messages as the Interface Board firmware and replies the same way)
+# and the audio input (it synthesizes the oscillator output). Time is simulated as well:
+# sleeping and recording only advance a virtual clock, so a full tuning
+# run completes in seconds.
+#
+# The pitch response is derived from the measured frequency vs. resistance
+# curve of the oscillator (data/P1_FreqVSRes). The DAC driven transistor is
+# modelled as a voltage controlled conductance.
+
+import functools
+import os
+import time
+import numpy as np
+
+from transport import (
+    MAX_DAC_VAL, MAX_MIDI_NOTE, UART_MIDI_BAUDRATE, SYSEX_MANUFACTURER_ID,
+    SYSEX_CMD_SET_DAC, SYSEX_CMD_SET_GATE, SYSEX_CMD_SET_GATE_CLOSE, SYSEX_CMD_SET_GATE_OPEN,
+    SYSEX_WRITE_MIDI_2_DAC_LUT, SYSEX_WRITE_MIDI_2_DAC_LUT_BLOCK, SYSEX_LUT_BLOCK_MAX_ENTRIES,
+    SYSEX_READ_MIDI_2_DAC_LUT, SYSEX_MIDI_2_DAC_LUT_DUMP, SYSEX_DAC_STAIRCASE, SYSEX_DAC_STAIRCASE_DONE,
+    SYSEX_SYNC, SYSEX_ACK, SYSEX_ACK_OK, SYSEX_ACK_BAD_CHECKSUM, SYSEX_ACK_BAD_MESSAGE,
+    midi_data_to_uint14, sysex_checksum, sysex_msg, uint14_to_midi_data,
+)
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+FLASH_WORD_PROGRAM_TIME = 0.006 # seconds, standard programming time of the STM8S
+
+DEFAULT_CURVE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..", "..", "..", "data", "P1_FreqVSRes", "dampflog_real_freq_vs_resistance.csv"
+)
+
+# Conductance model: g = g_max * (dac / DAC_AT_MAX_FREQ) ^ DAC_GAMMA
+# Roughly fitted to the STEP_TABLE in tuning.py
+DAC_AT_MAX_FREQ = 3800
+DAC_GAMMA = 7.0
+
+AMPLITUDE = 0.3
+DRIFT_TIME_CONSTANT = 60    # seconds
+
+DAC_OFFSET_SPREAD = 50      # Max. DAC offset of simulated boards, simulates unit variation
+
+#####################################################
+# Helper Functions
+#####################################################
+
+# Random DAC offset of a simulated board, drawn from rng
+def random_dac_offset(rng):
+    return int(rng.integers(-DAC_OFFSET_SPREAD, DAC_OFFSET_SPREAD + 1))
+
+# Loads a MIDI to DAC LUT from a CSV file with "note,dac value" rows
+# (ex. as generated by tune.py)
+def load_lut_csv(path):
+    lut = [0] * (MAX_MIDI_NOTE + 1)
+    data = np.genfromtxt(path, delimiter=",", dtype=int).reshape(-1, 2)
+    for note, value in data:
+        lut[note] = value
+    return lut
+
+# Makes the wall clock time that passed since the last call into the
+# simulator pass in simulated time as well, if the simulator counts the
+# host's processing time (see host_time). Only the outermost of nested
+# calls counts, the simulator's own processing time is excluded.
+def host_timed(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.host_time:
+            return method(self, *args, **kwargs)
+        if self.host_depth == 0 and self.t_host is not None:
+            self.time += time.perf_counter() - self.t_host
+        self.host_depth += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.host_depth -= 1
+            if self.host_depth == 0:
+                self.t_host = time.perf_counter()
+    return wrapper
+
+#####################################################
+# Simulator
+#####################################################
+
+class SimulatedDampflog:
+    # noise:        Standard deviation of the additive white noise
+    # drift:        Pitch drift (cents) the oscillator approaches while warming up
+    # settle_time:  Time constant (seconds) of the CV after a DAC change
+    # dac_offset:   Shifts the response curve, useful to simulate unit variation
+    # pitch_offset: Shifts the pitch of all DAC values (cents), moving the range of the oscillator
+    # seed:         Seed of the noise generator
+    # lut:          Initial content of the MIDI to DAC LUT
+    # clock_error:  Relative error of the MCU clock, stretches the dwell time of staircases
+    # host_time:    Also lets the host's processing time (ex. pitch analysis) pass
+    #               in simulated time, which otherwise only passes while sleeping and recording
+    def __init__(self, curve_file=DEFAULT_CURVE_FILE, sample_rate=44100, noise=0.0,
+                 drift=0.0, settle_time=0.0, dac_offset=0, pitch_offset=0.0, seed=None, lut=None,
+                 clock_error=0.0, host_time=False):
+        data = np.genfromtxt(curve_file, delimiter=",", skip_header=1)
+        order = np.argsort(1 / data[:, 0])
+        self.conductance = 1 / data[order, 0]
+        self.freq = data[order, 1]
+
+        self.sample_rate = sample_rate
+        self.noise = noise
+        self.drift = drift
+        self.settle_time = settle_time
+        self.dac_offset = dac_offset
+        self.pitch_offset = pitch_offset
+        self.clock_error = clock_error
+        self.host_time = host_time
+        self.rng = np.random.default_rng(seed)
+
+        self.time = 0.0
+        self.phase = 0.0
+        self.gate = False
+        self.dac_from = 0
+        self.dac_to = 0
+        self.t_change = 0.0
+        self.staircase = None   # Running staircase, see handle_staircase
+        self.lut = list(lut) if lut is not None else [0] * (MAX_MIDI_NOTE + 1)
+        self.flash = list(self.lut)
+        self.flash_writes = 0
+        self.replies = []
+        self.t_host = None      # Wall clock time of the last return to the host, see host_timed
+        self.host_depth = 0
+
+    ######## Clock ########
+
+    @host_timed
+    def now(self):
+        return self.time
+
+    @host_timed
+    def sleep(self, duration):
+        self.time += duration
+
+    ######## Oscillator Model ########
+
+    # Frequency produced by a (possibly fractional) DAC value
+    def dac_to_freq(self, dac_val):
+        x = np.clip((np.asarray(dac_val, dtype=np.float64) - self.dac_offset) / DAC_AT_MAX_FREQ, 0, None)
+        g = self.conductance[-1] * x ** DAC_GAMMA
+        return np.interp(g, self.conductance, self.freq) * 2 ** (self.pitch_offset / 1200)
+
+    # Effective DAC value at the given times, including the settling lag
+    def effective_dac(self, t):
+        if self.staircase is not None:
+            return self.staircase_dac(t)
+        if self.settle_time <= 0:
+            return np.full(len(t), float(self.dac_to))
+        decay = np.exp(-np.maximum(t - self.t_change, 0) / self.settle_time)
+        return self.dac_to + (self.dac_from - self.dac_to) * decay
+
+    # Effective DAC value at the given times while a staircase is running.
+    # Every step settles from the value of the previous one.
+    def staircase_dac(self, t):
+        sc = self.staircase
+        k = np.clip(np.floor((t - sc["t_start"]) / sc["dwell"]), 0, sc["steps"] - 1)
+        to = sc["start"] + k * sc["stride"]
+        if self.settle_time <= 0:
+            return to
+        prev = np.where(k > 0, to - sc["stride"], sc["dac_from"])
+        decay = np.exp(-np.maximum(t - sc["t_start"] - k * sc["dwell"], 0) / self.settle_time)
+        return to + (prev - to) * decay
+
+    def set_dac(self, value):
+        self.dac_from = self.effective_dac(np.array([self.time]))[0]
+        self.dac_to = value
+        self.t_change = self.time
+        self.staircase = None
+
+    ######## MIDI Port ########
+
+    # Handles a mido message the same way the Interface Board firmware does
+    @host_timed
+    def send(self, msg):
+        self.sleep(len(msg.bytes()) * 10 / UART_MIDI_BAUDRATE)
+
+        if msg.type == "note_on":
+            self.set_dac(self.lut[msg.note])
+            self.gate = True
+        elif msg.type == "note_off":
+            self.gate = False
+        elif msg.type == "sysex":
+            self.handle_sysex(list(msg.data))
+
+    def handle_sysex(self, data):
+        if len(data) < 2 or data[0] != SYSEX_MANUFACTURER_ID:
+            return
+
+        cmd = data[1]
+        if cmd == SYSEX_CMD_SET_DAC and len(data) == 4:
+            self.set_dac(min(midi_data_to_uint14(data[2], data[3]), MAX_DAC_VAL))
+        elif cmd == SYSEX_CMD_SET_GATE and len(data) == 3:
+            if data[2] == SYSEX_CMD_SET_GATE_OPEN:
+                self.gate = True
+            elif data[2] == SYSEX_CMD_SET_GATE_CLOSE:
+                self.gate = False
+        elif cmd == SYSEX_WRITE_MIDI_2_DAC_LUT and len(data) == 5:
+            value = midi_data_to_uint14(data[3], data[4])
+            if data[2] <= MAX_MIDI_NOTE and value <= MAX_DAC_VAL:
+                self.lut[data[2]] = value
+                self.write_flash(data[2], 1)
+        elif cmd == SYSEX_WRITE_MIDI_2_DAC_LUT_BLOCK:
+            self.reply([SYSEX_ACK, cmd, self.handle_lut_block(data)])
+        elif cmd == SYSEX_READ_MIDI_2_DAC_LUT:
+            self.handle_lut_read(data)
+        elif cmd == SYSEX_DAC_STAIRCASE:
+            self.reply([SYSEX_ACK, cmd, self.handle_staircase(data)])
+        elif cmd == SYSEX_SYNC and len(data) == 2:
+            self.reply([SYSEX_ACK, cmd, SYSEX_ACK_OK])
+
+    # See handle_lut_block() in src/main.c
+    def handle_lut_block(self, data):
+        if len(data) < 5:
+            return SYSEX_ACK_BAD_MESSAGE
+
+        first, count = data[2], data[3]
+        if (count == 0 or count > SYSEX_LUT_BLOCK_MAX_ENTRIES or
+                len(data) != 5 + 2 * count or first + count > MAX_MIDI_NOTE + 1):
+            return SYSEX_ACK_BAD_MESSAGE
+
+        if sysex_checksum(data[2:-1]) != data[-1]:
+            return SYSEX_ACK_BAD_CHECKSUM
+
+        values = [midi_data_to_uint14(data[4 + 2 * i], data[5 + 2 * i]) for i in range(count)]
+        if max(values) > MAX_DAC_VAL:
+            return SYSEX_ACK_BAD_MESSAGE
+
+        self.lut[first:first + count] = values
+        self.write_flash(first, count)
+        return SYSEX_ACK_OK
+
+    # See handle_lut_read() in src/main.c
+    def handle_lut_read(self, data):
+        if len(data) != 4 or data[3] == 0 or data[3] > SYSEX_LUT_BLOCK_MAX_ENTRIES or data[2] + data[3] > MAX_MIDI_NOTE + 1:
+            self.reply([SYSEX_ACK, SYSEX_READ_MIDI_2_DAC_LUT, SYSEX_ACK_BAD_MESSAGE])
+            return
+
+        first, count = data[2], data[3]
+        payload = [first, count]
+        for value in self.lut[first:first + count]:
+            payload += uint14_to_midi_data(value)
+        self.reply([SYSEX_MIDI_2_DAC_LUT_DUMP] + payload + [sysex_checksum(payload)])
+
+    # See handle_staircase() in src/main.c
+    def handle_staircase(self, data):
+        if len(data) != 11:
+            return SYSEX_ACK_BAD_MESSAGE
+
+        if sysex_checksum(data[2:-1]) != data[-1]:
+            return SYSEX_ACK_BAD_CHECKSUM
+
+        start, end, stride, dwell = [midi_data_to_uint14(data[i], data[i + 1]) for i in range(2, 10, 2)]
+        if start > MAX_DAC_VAL or end > MAX_DAC_VAL or stride == 0 or dwell == 0:
+            return SYSEX_ACK_BAD_MESSAGE
+
+        self.set_dac(start)
+        self.staircase = {
+            "t_start": self.time,
+            "dac_from": self.dac_from,
+            "start": start,
+            "stride": stride if end >= start else -stride,
+            "steps": abs(end - start) // stride + 1,
+            "dwell": dwell / 1000 * (1 + self.clock_error),
+            "reported": False,
+        }
+        return SYSEX_ACK_OK
+
+    # Burns LUT entries to the simulated flash, one word (two entries)
+    # at a time, skipping words that are unchanged
+    def write_flash(self, first, count):
+        for i in range(first & ~1, first + count, 2):
+            if self.flash[i:i + 2] != self.lut[i:i + 2]:
+                self.flash[i:i + 2] = self.lut[i:i + 2]
+                self.flash_writes += 1
+                self.sleep(FLASH_WORD_PROGRAM_TIME)
+
+    # Queues a sysex reply to the host
+    def reply(self, data):
+        self.replies.append(sysex_msg(data[0], data[1:]))
+
+    # Returns the next reply to the host, same as a mido input port
+    @host_timed
+    def poll(self):
+        sc = self.staircase
+        if sc is not None and not sc["reported"] and self.time >= sc["t_start"] + sc["steps"] * sc["dwell"]:
+            sc["reported"] = True
+            self.reply([SYSEX_DAC_STAIRCASE_DONE] + uint14_to_midi_data(sc["steps"]))
+        if self.replies:
+            return self.replies.pop(0)
+        return None
+
+    def close(self):
+        pass
+
+    ######## Audio Input ########
+
+    # Synthesizes n samples starting at the current time
+    def synthesize(self, n):
+        t = self.time + np.arange(n) / self.sample_rate
+        f = self.dac_to_freq(self.effective_dac(t))
+        f = f * 2 ** (self.drift * (1 - np.exp(-t / DRIFT_TIME_CONSTANT)) / 1200)
+
+        phase = self.phase + np.cumsum(f) / self.sample_rate
+        self.phase = phase[-1] % 1.0
+
+        x = np.zeros(n)
+        if self.gate:
+            # Soft square wave, similar to the output of the OP-AMP oscillator
+            x = AMPLITUDE * np.tanh(4 * np.sin(2 * np.pi * phase))
+        if self.noise > 0:
+            x += self.rng.normal(0, self.noise, n)
+
+        self.time += n / self.sample_rate
+        return x
+
+    # Absolute index of the next synthesized sample
+    @host_timed
+    def mark(self):
+        return int(round(self.time * self.sample_rate))
+
+    # Records a sample, same interface as audio.SoundDeviceInput.
+    # If start lies in the future, time passes until then. Past samples
+    # are not kept, so an earlier start records from now instead.
+    @host_timed
+    def record(self, duration, start=None):
+        if start is not None and start > self.mark():
+            self.sleep((start - self.mark()) / self.sample_rate)
+        return self.synthesize(int(duration * self.sample_rate)).reshape(-1, 1)
+
+    # The simulated stream is always continuous, see record()
+    @host_timed
+    def read(self, duration):
+        return self.record(duration)
+
+    # Nothing is buffered, as time only passes while reading or sleeping
+    def flush(self):
+        pass
+
+    def stats(self):
+        return {
+            "frames": self.mark(),
+            "overruns": 0,
+            "dropped": 0,
+        }
@@ -0,0 +1,58 @@
+# Drift model of the Dampflog
+#
+# The analog core of the oscillator drifts while it warms up, shifting the
+# pitch of all DAC values alike (see DRIFT_TIME_CONSTANT in dampflog_sim.py).
+# The drift is tracked by periodically remeasuring a fixed reference DAC
+# value during a tuning pass (see Tuner.track_drift). Its pitch relative to
+# the first reference measurement, in cents, over time is modelled as
+#
+#   drift(t) = d_inf - (d_inf - d_0) * exp(-(t - t_0) / tau)
+#
+# i.e. exponentially approaching the drift of the warmed up oscillator.
+# With too few measurements or if the fit fails, the drift is interpolated
+# linearly between the measurements instead.
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+MIN_EXP_FIT_POINTS = 4      # Measurements needed to fit the exponential model
+MIN_TIME_CONSTANT = 1       # seconds
+MAX_TIME_CONSTANT = 3600    # seconds
+
+#####################################################
+# Drift Model
+#####################################################
+
+def exp_drift(t, d_inf, d_0, tau):
+    return d_inf - (d_inf - d_0) * np.exp(-t / tau)
+
+# Fits the drift model to reference measurements taken at times t (seconds)
+# with the given drift (cents, relative to the first measurement).
+# Returns the model, mapping times to the drift (cents).
+def fit_drift(t, cents):
+    t = np.asarray(t, dtype=np.float64)
+    cents = np.asarray(cents, dtype=np.float64)
+    valid = np.isfinite(cents)
+    t, cents = t[valid], cents[valid]
+    if len(t) == 0:
+        raise ValueError("At least one valid measurement is needed to fit the drift")
+
+    t_0 = t[0]
+    if len(t) >= MIN_EXP_FIT_POINTS:
+        try:
+            span = max(t[-1] - t_0, MIN_TIME_CONSTANT)
+            params, _ = curve_fit(
+                exp_drift, t - t_0, cents,
+                p0=[cents[-1], cents[0], span / 2],
+                bounds=([-np.inf, -np.inf, MIN_TIME_CONSTANT], [np.inf, np.inf, MAX_TIME_CONSTANT]),
+            )
+            return lambda x: exp_drift(np.asarray(x, dtype=np.float64) - t_0, *params)
+        except (RuntimeError, ValueError):
+            pass
+
+    # Held constant beyond the first and last measurement
+    return lambda x: np.interp(x, t, cents)
@@ -0,0 +1,240 @@
+# Tunes several Dampflogs concurrently
+#
+# Every board is given by its MIDI output port (or serial device, see
+# transport.py) and the channel of a multichannel audio input (ex. an audio interface) its output is
+# connected to. A single capture stream is shared by all boards and
+# demultiplexed per channel (see audio.py). Each board is tuned by its own
+# worker thread, so the time of a batch is determined by the slowest board
+# instead of the sum of all boards.
+#
+# Ex.: python farm.py -b "Dampflog 1=0" -b "Dampflog 2=1" -s secant
+
+import argparse
+import sys
+import threading
+import time
+import mido
+import numpy as np
+
+import audio
+import dampflog_sim
+import pitch
+import profiles
+import transport
+import tuning
+from tuning import OSC_MIN_NOTE, OSC_MAX_NOTE, RECORD_SAMPLE_RATE
+
+#####################################################
+# Helper Functions
+#####################################################
+
+# Parses a "PORT=CHANNEL" board mapping
+def parse_board(value):
+    port, sep, channel = value.rpartition("=")
+    if not sep or not port:
+        raise argparse.ArgumentTypeError("Expected PORT=CHANNEL, got: {}".format(value))
+    try:
+        return port, int(channel)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid channel: {}".format(channel))
+
+# Returns the step table of a device, learned from its calibration
+# profiles if available (see profiles.py)
+def device_step_table(device):
+    if args.no_profile:
+        return tuning.STEP_TABLE
+    recent = profiles.recent_profiles(args.profile_store, device, args.profile_average)
+    if not recent:
+        return tuning.STEP_TABLE
+    return profiles.derive_step_table(recent, OSC_MIN_NOTE, OSC_MAX_NOTE, tuning.STEP_TABLE)
+
+# Tunes a single board and uploads the resulting LUT.
+# Runs in its own thread, the result is stored in board["result"].
+def tune_board(board):
+    tuner = board["tuner"]
+    device = board["device"]
+    result = {"device": device, "status": "failed"}
+    board["result"] = result
+    t_start = tuner.clock()
+
+    try:
+        results = tuner.tune_pass(device_step_table(device))
+        lut = tuning.build_lut(tuning.results_to_midi_2_dac(results))
+        tuner.upload_lut(lut)
+
+        if not args.no_profile:
+            profiles.save_profile(args.profile_store, device, tuner.measured_points, lut, args.notes)
+
+        errors = np.abs([r["error"] for r in results])
+        result.update({
+            "status": "ok",
+            "max_error": np.max(errors),
+            "rms_error": np.sqrt(np.mean(errors ** 2)),
+        })
+    except Exception as e:
+        tuner.log("Tuning failed: {}".format(e))
+        result["error"] = str(e)
+    finally:
+        result["measurements"] = tuner.n_measurements
+        result["time"] = tuner.clock() - t_start
+
+#####################################################
+# Argument Parsing
+#####################################################
+
+parser = argparse.ArgumentParser(
+    description="Tunes several Dampflogs concurrently"
+)
+
+parser.add_argument(
+    "-b", "--board", type=parse_board, action="append", default=[],
+    help="Board to tune, given as MIDI output port (or serial:DEVICE) and audio input channel (PORT=CHANNEL)"
+)
+
+parser.add_argument(
+    "-a", "--audio-device", type=audio.parse_device, default=None,
+    help="Multichannel audio input device, given by its name or index (default input device if omitted)"
+)
+
+parser.add_argument(
+    "-e", "--estimator", type=str, choices=list(pitch.ESTIMATORS), default=pitch.DEFAULT_ESTIMATOR,
+    help="Pitch estimator used to measure the oscillator frequency"
+)
+
+parser.add_argument(
+    "-s", "--strategy", type=str, choices=tuning.STRATEGIES, default=tuning.DEFAULT_STRATEGY,
+    help="Search strategy used to find the DAC value of each note"
+)
+
+parser.add_argument(
+    "-t", "--tolerance", type=float, default=tuning.DEFAULT_TOLERANCE,
+    help="Accepted error in cents (secant strategy only)"
+)
+
+tuning.add_tuner_arguments(parser)
+
+parser.add_argument(
+    "--simulate", type=int, default=0, help="Tune the given number of simulated Dampflogs instead of real hardware"
+)
+
+parser.add_argument(
+    "--sim-noise", type=float, default=0.01, help="Noise level of the simulated audio"
+)
+
+parser.add_argument(
+    "--sim-seed", type=int, default=None, help="Seed of the simulators' random number generators"
+)
+
+profiles.add_profile_arguments(parser)
+
+args = parser.parse_args()
+
+if not args.board and args.simulate <= 0:
+    parser.error("No boards given, use --board or --simulate")
+
+#####################################################
+# Intialization
+#####################################################
+
+boards = []
+capture = None
+
+def tuner_args():
+    return {
+        "estimator": args.estimator,
+        "strategy": args.strategy,
+        "tolerance": args.tolerance,
+        "adaptive_settle": args.adaptive_settle,
+        "adaptive_capture": args.adaptive_capture,
+        "drift_interval": args.drift_interval,
+        "cache_ttl": args.cache,
+        "sync": args.sync,
+        "pipeline": args.pipeline,
+    }
+
+if args.simulate > 0:
+    # Every simulated board runs on its own virtual clock
+    rng = np.random.default_rng(args.sim_seed)
+    for i in range(args.simulate):
+        device = "simulated-{}".format(i)
+        sim = dampflog_sim.SimulatedDampflog(
+            sample_rate=RECORD_SAMPLE_RATE,
+            noise=args.sim_noise,
+            dac_offset=dampflog_sim.random_dac_offset(rng),
+            seed=None if args.sim_seed is None else args.sim_seed + i,
+        )
+        tuner = tuning.Tuner(sim, sim, sim, sim.sleep, sim.now, name=device, **tuner_args())
+        boards.append({"device": device, "tuner": tuner})
+    print("Using {} simulated Dampflogs".format(args.simulate))
+else:
+    outputs = mido.get_output_names()
+    for port_name, _ in args.board:
+        if not port_name.startswith(transport.SERIAL_PREFIX) and port_name not in outputs:
+            print("Unknown MIDI output port: {}".format(port_name))
+            print("Available MIDI ports: {}".format(", ".join(outputs)))
+            sys.exit(1)
+
+    channels = max(channel for _, channel in args.board) + 1
+    capture = audio.SoundDeviceInput(RECORD_SAMPLE_RATE, args.audio_device, channels=channels)
+
+    for port_name, channel in args.board:
+        port, port_in = transport.open_ports(port_name)
+        tuner = tuning.Tuner(port, capture.channel(channel), port_in, name=port_name, **tuner_args())
+        boards.append({"device": port_name, "tuner": tuner})
+        print("{} -> audio channel {}".format(port_name, channel))
+
+    print("")
+    print("Press enter to begin the tuning process: ")
+    input()
+
+#####################################################
+# Tuning process
+#####################################################
+
+t_start = time.monotonic()
+
+threads = []
+for board in boards:
+    thread = threading.Thread(target=tune_board, args=(board,), name=board["device"])
+    thread.start()
+    threads.append(thread)
+
+for thread in threads:
+    thread.join()
+
+wall_time = time.monotonic() - t_start
+
+for board in boards:
+    board["tuner"].close()
+if capture is not None:
+    capture.close()
+
+#####################################################
+# Summary
+#####################################################
+
+results = [board["result"] for board in boards]
+
+print("")
+print("{:<24} {:>8} {:>14} {:>16} {:>16} {:>10}".format(
+    "Device", "Status", "Measurements", "Max |err| (ct)", "RMS err (ct)", "Time (s)"
+))
+for r in results:
+    if r["status"] == "ok":
+        print("{:<24} {:>8} {:>14} {:>16.2f} {:>16.2f} {:>10.1f}".format(
+            r["device"], r["status"], r["measurements"], r["max_error"], r["rms_error"], r["time"]
+        ))
+    else:
+        print("{:<24} {:>8} {:>14} {:>16} {:>16} {:>10.1f}  {}".format(
+            r["device"], r["status"], r["measurements"], "-", "-", r["time"], r["error"]
+        ))
+
+# Simulated boards don't share a clock, they would have run in parallel
+batch_time = max(r["time"] for r in results) if args.simulate > 0 else wall_time
+print("")
+print("Boards: {}\tFailed: {}\tBatch time: {:.1f}s\tSequential time: {:.1f}s".format(
+    len(results), sum(r["status"] != "ok" for r in results), batch_time, sum(r["time"] for r in results)
+))
+
+if any(r["status"] != "ok" for r in results):
+    sys.exit(1)
@@ -0,0 +1,126 @@
+# Instrumentation of tuning sessions
+#
+# A Trace records every measurement of a tuning session (see tuning.Tuner)
+# along with the time spent sending the DAC command, waiting for the
+# oscillator to settle, capturing and analyzing the sample. Larger steps
+# (ex. the startup settle time or the LUT upload) are recorded as spans.
+#
+# Durations are taken from the tuners clock, which is the simulators virtual
+# clock when simulating. The analysis time is CPU time and is always
+# measured with time.perf_counter.
+
+import csv
+import cProfile
+import pstats
+import time
+from contextlib import contextmanager
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+TRACE_FIELDS = [
+    "t", "note", "phase", "dac", "freq", "error",
+    "send", "settle", "capture", "analyze",
+]
+
+DURATIONS = ["send", "settle", "capture", "analyze"]
+
+PROFILE_TOP_N = 20  # Number of functions printed of a cProfile run
+
+#####################################################
+# Trace
+#####################################################
+
+class Trace:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.t_start = clock()
+        self.measurements = []
+        self.spans = {}     # Name -> [count, total duration]
+
+    # Records a single measurement. Durations are given in seconds.
+    def add(self, note, phase, dac, freq, error, send, settle, capture, analyze):
+        self.measurements.append({
+            "t": self.clock() - self.t_start,
+            "note": note,
+            "phase": phase,
+            "dac": dac,
+            "freq": freq,
+            "error": error,
+            "send": send,
+            "settle": settle,
+            "capture": capture,
+            "analyze": analyze,
+        })
+
+    # Times the enclosed block as the given span
+    @contextmanager
+    def span(self, name):
+        t = self.clock()
+        try:
+            yield
+        finally:
+            count, total = self.spans.get(name, [0, 0.0])
+            self.spans[name] = [count + 1, total + self.clock() - t]
+
+    # Writes the measurements as CSV, one row per measurement
+    def write(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(TRACE_FIELDS)
+            for m in self.measurements:
+                writer.writerow([
+                    "{:.4f}".format(m["t"]),
+                    "" if m["note"] is None else m["note"],
+                    m["phase"],
+                    m["dac"],
+                    "{:.3f}".format(m["freq"]),
+                    "" if m["error"] is None else "{:.2f}".format(m["error"]),
+                ] + ["{:.5f}".format(m[d]) for d in DURATIONS])
+
+    # Returns the time breakdown of the session as printable lines
+    def breakdown(self):
+        lines = []
+        total = self.clock() - self.t_start
+        lines.append("Session time: {:.2f}s\tMeasurements: {}".format(total, len(self.measurements)))
+
+        lines.append("{:<16} {:>10} {:>8} {:>12}".format("Step", "Total (s)", "Share", "Avg (ms)"))
+        n = max(len(self.measurements), 1)
+        for d in DURATIONS:
+            t = sum(m[d] for m in self.measurements)
+            lines.append("{:<16} {:>10.2f} {:>7.1f}% {:>12.2f}".format(
+                d, t, 100 * t / total if total > 0 else 0, 1000 * t / n
+            ))
+        for name, (count, t) in self.spans.items():
+            lines.append("{:<16} {:>10.2f} {:>7.1f}% {:>12.2f}".format(
+                name, t, 100 * t / total if total > 0 else 0, 1000 * t / count
+            ))
+
+        phases = {}
+        for m in self.measurements:
+            count, t = phases.get(m["phase"], [0, 0.0])
+            phases[m["phase"]] = [count + 1, t + sum(m[d] for d in DURATIONS)]
+
+        lines.append("{:<16} {:>10} {:>12}".format("Search phase", "Total (s)", "Measurements"))
+        for phase, (count, t) in phases.items():
+            lines.append("{:<16} {:>10.2f} {:>12}".format(phase, t, count))
+
+        return lines
+
+#####################################################
+# Profiling
+#####################################################
+
+# Runs func(*args) under cProfile. The statistics are dumped to path
+# (see pstats) and the top functions by cumulative time are printed.
+# Returns the result of func.
+def run_profiled(path, func, *args):
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        profiler.dump_stats(path)
+        print("")
+        print("Wrote profile: {}".format(path))
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
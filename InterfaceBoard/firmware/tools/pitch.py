@@ -0,0 +1,290 @@
+# Pitch estimators used by the Dampflog tuning tools
+#
+# All estimators take a recorded sample (any shape, it is flattened)
+# and the sample rate, and return the fundamental frequency in Hz.
+# If no pitch can be determined, NaN is returned.
+
+import numpy as np
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+DEFAULT_SAMPLE_RATE = 44100 # Hz
+
+# Search range of the estimators. The Dampflog covers roughly
+# A#2 (116 Hz) to E5 (659 Hz), so this leaves plenty of headroom.
+MIN_FREQ = 40               # Hz
+MAX_FREQ = 2000             # Hz
+
+ZERO_CROSSING_HYSTERESIS = 0.5 # Relative to the RMS of the sample
+OUTLIER_THRESHOLD = 3.5     # Periods further off the median (in MADs) are rejected
+MAD_TO_STD = 1.4826         # Scales the MAD to the standard deviation of normal data
+STEP_WINDOW = 4             # Number of periods compared before and after a pitch step
+ALIGN_BIN = 16              # samples, resolution of the folded step boundaries
+ALIGN_ITERATIONS = 3        # Number of least squares fits of the step boundaries
+YIN_THRESHOLD = 0.1
+FFT_OVERSAMPLING = 4        # Zero padding factor for the FFT estimator
+
+#####################################################
+# Helper Functions
+#####################################################
+
+# Refines the position of an extremum at index i of y by fitting a parabola
+# through y[i - 1], y[i] and y[i + 1]. Returns the fractional index.
+def parabolic_interpolation(y, i):
+    if i <= 0 or i >= len(y) - 1:
+        return float(i)
+    a, b, c = y[i - 1], y[i], y[i + 1]
+    denom = a - 2 * b + c
+    if denom == 0:
+        return float(i)
+    return i + 0.5 * (a - c) / denom
+
+######## Zero Crossings ########
+
+# Returns the sub-sample positions of all positive zero crossings.
+# The exact crossing is found by linear interpolation between the
+# last negative and the first positive sample.
+# To reject crossings caused by noise, a crossing is only counted once
+# the signal has dropped below -hysteresis and then risen above +hysteresis
+# (i.e. like a Schmitt trigger).
+def positive_zero_crossings(sample, hysteresis=0):
+    x = np.ravel(sample)
+    i = np.flatnonzero((x[:-1] <= 0) & (x[1:] > 0))
+    crossings = i + x[i] / (x[i] - x[i + 1])
+
+    if hysteresis <= 0 or len(i) == 0:
+        return crossings
+
+    # Trigger state: +1 above the upper, -1 below the lower threshold,
+    # held in between
+    state = np.zeros(len(x), dtype=np.int8)
+    state[x > hysteresis] = 1
+    state[x < -hysteresis] = -1
+    idx = np.where(state != 0, np.arange(len(x)), 0)
+    np.maximum.accumulate(idx, out=idx)
+    state = state[idx]
+
+    # Every rising edge of the trigger belongs to the last zero crossing before it
+    edges = np.flatnonzero((state[:-1] == -1) & (state[1:] == 1)) + 1
+    k = np.searchsorted(i, edges, side="right") - 1
+    return crossings[np.unique(k[k >= 0])]
+
+# Determines the frequency of a sample via positive zero crossings
+def freq_zero_crossing(sample, rate=DEFAULT_SAMPLE_RATE, hysteresis=ZERO_CROSSING_HYSTERESIS):
+    x = np.ravel(sample).astype(np.float64)
+    x = x - np.mean(x)
+    crossings = positive_zero_crossings(x, hysteresis * np.sqrt(np.mean(x * x)))
+    if len(crossings) < 2:
+        return np.nan
+    # Mean period over all crossings, equal to averaging the individual gaps
+    return rate * (len(crossings) - 1) / (crossings[-1] - crossings[0])
+
+# Returns the periods (in samples) between the positive zero crossings of a
+# sample, after removing its DC offset
+def zero_crossing_periods(sample, hysteresis=ZERO_CROSSING_HYSTERESIS):
+    x = np.ravel(sample).astype(np.float64)
+    x = x - np.mean(x)
+    return np.diff(positive_zero_crossings(x, hysteresis * np.sqrt(np.mean(x * x))))
+
+# Determines the frequency of a sample and its uncertainty from the periods
+# between zero crossings. Periods further than OUTLIER_THRESHOLD median
+# absolute deviations off the median (ex. caused by glitches or a missed
+# crossing) are rejected, the frequency is derived from the mean of the rest.
+# Returns the frequency and its standard error in cents (NaN, inf on failure).
+def period_stats(sample, rate=DEFAULT_SAMPLE_RATE, hysteresis=ZERO_CROSSING_HYSTERESIS):
+    periods = zero_crossing_periods(sample, hysteresis)
+    if len(periods) < 2:
+        return np.nan, np.inf
+
+    median = np.median(periods)
+    mad = MAD_TO_STD * np.median(np.abs(periods - median))
+    if mad > 0:
+        periods = periods[np.abs(periods - median) <= OUTLIER_THRESHOLD * mad]
+
+    period = np.mean(periods)
+    if len(periods) < 2:
+        return rate / period, np.inf
+    # The periods scatter due to the jitter of the crossings, which cancels
+    # out between neighbouring periods. The mean period is only affected by the
+    # jitter of the first and last crossing, i.e. sqrt(2) * std / n.
+    stderr = np.sqrt(2) * np.std(periods, ddof=1) / len(periods)
+    return rate / period, 1200 / np.log(2) * stderr / period
+
+# Determines the frequency of a sample via zero crossings, rejecting
+# outlying periods (see period_stats)
+def freq_zero_crossing_robust(sample, rate=DEFAULT_SAMPLE_RATE):
+    return period_stats(sample, rate)[0]
+
+######## Pitch Tracking ########
+
+# Tracks the frequency of a long sample in which the pitch changes in steps
+# (ex. a sweep of DAC values, see Tuner.sweep_capture), without splitting it
+# into separate buffers. The zero crossings are determined once for the whole
+# sample, every segment is then evaluated from the crossings it contains.
+#
+# bounds are the indices at which the segments begin, plus the end of the last
+# one. The first guard samples of every segment are skipped (ex. to let the
+# oscillator settle after a DAC change).
+# Returns the frequency of every segment and its standard error in cents
+# (NaN, inf if a segment contains less than two/three crossings).
+def segment_freqs(sample, bounds, rate=DEFAULT_SAMPLE_RATE, guard=0, hysteresis=ZERO_CROSSING_HYSTERESIS):
+    x = np.ravel(sample).astype(np.float64)
+    x = x - np.mean(x)
+    crossings = positive_zero_crossings(x, hysteresis * np.sqrt(np.mean(x * x)))
+    bounds = np.asarray(bounds)
+
+    # Index range [first, last) of the crossings within each segment
+    first = np.searchsorted(crossings, bounds[:-1] + guard)
+    last = np.searchsorted(crossings, bounds[1:])
+    n = last - first
+    valid = n >= 2
+
+    # Mean period of every segment, see freq_zero_crossing
+    c = np.append(crossings, 0)
+    span = c[np.maximum(last - 1, 0)] - c[first]
+    period = np.where(valid, span, 1) / np.maximum(n - 1, 1)
+    freqs = np.where(valid, rate / period, np.nan)
+
+    # Standard deviation of the periods of every segment from cumulative
+    # sums, see period_stats for the standard error of the mean period
+    periods = np.diff(crossings)
+    s1 = np.concatenate(([0.0], np.cumsum(periods)))
+    s2 = np.concatenate(([0.0], np.cumsum(periods * periods)))
+    k = np.maximum(n - 1, 0)
+    end = np.maximum(last - 1, first)
+    ddof = np.maximum(k - 1, 1)
+    var = (s2[end] - s2[first] - (s1[end] - s1[first]) ** 2 / np.maximum(k, 1)) / ddof
+    stderr = np.sqrt(2 * np.maximum(var, 0)) / np.maximum(k, 1)
+    stderrs = np.where(k >= 2, 1200 / np.log(2) * stderr / period, np.inf)
+
+    return freqs, stderrs
+
+# Returns the positions and sizes of the pitch steps within a sample.
+# The (log) period is compared between the window periods before and after
+# every zero crossing, steps larger than OUTLIER_THRESHOLD times the typical
+# (jitter caused) difference are kept.
+def pitch_steps(sample, window=STEP_WINDOW, hysteresis=ZERO_CROSSING_HYSTERESIS):
+    x = np.ravel(sample).astype(np.float64)
+    x = x - np.mean(x)
+    crossings = positive_zero_crossings(x, hysteresis * np.sqrt(np.mean(x * x)))
+    if len(crossings) < 2 * window + 1:
+        return np.array([]), np.array([])
+
+    cs = np.concatenate(([0.0], np.cumsum(np.log2(np.diff(crossings)))))
+    i = np.arange(window, len(cs) - window)
+    diff = np.abs((cs[i + window] - 2 * cs[i] + cs[i - window]) / window)
+    diff = np.abs(diff - np.median(diff))
+    steps = diff > OUTLIER_THRESHOLD * MAD_TO_STD * np.median(diff)
+    return crossings[i[steps]], diff[steps]
+
+# Aligns a sample to a schedule of n_steps pitch steps of equal length
+# (ex. a DAC staircase, see Tuner.staircase_capture). The first step is
+# expected to begin around start and every step to last about length samples,
+# both only known roughly (ex. from the timing of MIDI replies).
+#
+# The detected pitch steps (see pitch_steps) are folded over the step
+# length to find the boundaries within a step, then start and length are
+# fitted to the boundaries by weighted least squares.
+# Returns the index at which the first step begins and the step length (samples).
+def align_steps(sample, n_steps, start, length, hysteresis=ZERO_CROSSING_HYSTERESIS):
+    t, w = pitch_steps(sample, hysteresis=hysteresis)
+    if len(t) == 0:
+        return float(start), float(length)
+
+    # Position of the boundaries within a step, closest to start
+    n_bins = max(int(length / ALIGN_BIN), 8)
+    bins = (np.mod(t, length) / length * n_bins).astype(int) % n_bins
+    hist = np.bincount(bins, weights=w, minlength=n_bins)
+    hist = hist + np.roll(hist, 1) + np.roll(hist, -1)
+    phase = (np.argmax(hist) + 0.5) / n_bins * length
+    start = phase + np.round((start - phase) / length) * length
+
+    for _ in range(ALIGN_ITERATIONS):
+        k = np.round((t - start) / length)
+        near = (k >= 0) & (k < n_steps) & (np.abs(t - start - k * length) < length / 4)
+        if np.count_nonzero(np.unique(k[near])) < 2:
+            break
+        length, start = np.polyfit(k[near], t[near], 1, w=np.sqrt(w[near]))
+
+    return float(start), float(length)
+
+######## YIN ########
+
+# Computes the YIN difference function d(tau) for tau < max_tau
+# using an FFT based autocorrelation.
+def yin_difference(x, max_tau):
+    w = len(x) - max_tau
+    n = 1 << int(np.ceil(np.log2(len(x) + w)))
+    corr = np.fft.irfft(np.fft.rfft(x, n) * np.conj(np.fft.rfft(x[:w], n)), n)[:max_tau]
+    energy = np.concatenate(([0.0], np.cumsum(x * x)))
+    tau = np.arange(max_tau)
+    return energy[w] + energy[tau + w] - energy[tau] - 2 * corr
+
+# Determines the frequency of a sample using the YIN algorithm
+# (de Cheveigné & Kawahara, 2002)
+def freq_yin(sample, rate=DEFAULT_SAMPLE_RATE, threshold=YIN_THRESHOLD):
+    x = np.ravel(sample).astype(np.float64)
+    min_tau = int(rate / MAX_FREQ)
+    max_tau = min(int(rate / MIN_FREQ) + 2, len(x) // 2)
+    if max_tau <= min_tau + 2:
+        return np.nan
+
+    d = yin_difference(x - np.mean(x), max_tau)
+
+    # Cumulative mean normalized difference
+    cmnd = np.ones(max_tau)
+    cumsum = np.cumsum(d[1:])
+    cmnd[1:] = d[1:] * np.arange(1, max_tau) / np.where(cumsum == 0, 1, cumsum)
+
+    # First dip below the threshold, else the global minimum
+    below = np.flatnonzero(cmnd[min_tau:] < threshold)
+    if len(below):
+        tau = below[0] + min_tau
+        while tau + 1 < max_tau and cmnd[tau + 1] < cmnd[tau]:
+            tau += 1
+    else:
+        tau = np.argmin(cmnd[min_tau:]) + min_tau
+
+    return rate / parabolic_interpolation(cmnd, tau)
+
+######## FFT ########
+
+# Determines the frequency of a sample by locating the largest peak of
+# its (zero padded, Hann windowed) spectrum. The peak is refined by
+# parabolic interpolation on the log magnitude.
+def freq_fft(sample, rate=DEFAULT_SAMPLE_RATE):
+    x = np.ravel(sample).astype(np.float64)
+    if len(x) < 2:
+        return np.nan
+    x = (x - np.mean(x)) * np.hanning(len(x))
+    n = 1 << int(np.ceil(np.log2(len(x) * FFT_OVERSAMPLING)))
+    spectrum = np.log(np.abs(np.fft.rfft(x, n)) + 1e-12)
+
+    lo = max(int(MIN_FREQ * n / rate), 1)
+    hi = min(int(MAX_FREQ * n / rate) + 1, len(spectrum) - 1)
+    peak = np.argmax(spectrum[lo:hi]) + lo
+
+    return parabolic_interpolation(spectrum, peak) * rate / n
+
+#####################################################
+# Estimator Registry
+#####################################################
+
+ESTIMATORS = {
+    "zero-crossing": freq_zero_crossing,
+    "zero-crossing-robust": freq_zero_crossing_robust,
+    "yin": freq_yin,
+    "fft": freq_fft,
+}
+
+# The plain zero crossing estimator is off by tens of cents as soon as noise
+# adds spurious crossings, the robust one rejects the resulting periods
+DEFAULT_ESTIMATOR = "zero-crossing-robust"
+
+# Returns the estimator function registered under the given name
+def get_estimator(name):
+    if name not in ESTIMATORS:
+        raise ValueError("Unknown pitch estimator: {}".format(name))
+    return ESTIMATORS[name]
@@ -0,0 +1,212 @@
+# Calibration profile store of the Dampflog tuning tools
+#
+# Every tuning run can store a calibration profile of the tuned device,
+# holding all measured (DAC value, frequency) points, the resulting MIDI to
+# DAC LUT, a timestamp and free-form notes (ex. ambient temperature).
+# Profiles are stored as compressed NPZ files, one directory per device:
+#
+#   <store>/<device>/<YYYYmmdd-HHMMSS>.npz
+#
+# The step table used by autotune.py can be derived from the latest profile
+# or the average of several recent ones (see derive_step_table).
+#
+# When run as a script, profiles can be listed, compared and pruned.
+
+import argparse
+import os
+import re
+import time
+import numpy as np
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+DEFAULT_STORE = os.path.join(os.path.expanduser("~"), ".dampflog", "profiles")
+TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S"
+
+#####################################################
+# Profile Store
+#####################################################
+
+# Turns a device name (ex. a MIDI port name) into a directory name
+def device_dir(store, device):
+    return os.path.join(store, re.sub(r"[^A-Za-z0-9_.-]+", "_", device).strip("_") or "unnamed")
+
+# Adds the command line options of the profile store shared by autotune.py
+# and farm.py
+def add_profile_arguments(parser):
+    parser.add_argument(
+        "--profile-store", type=str, default=DEFAULT_STORE, help="Calibration profile directory"
+    )
+
+    parser.add_argument(
+        "--profile-average", type=int, default=3,
+        help="Number of recent profiles the step table is averaged from"
+    )
+
+    parser.add_argument(
+        "--no-profile", action="store_true", help="Neither use nor store calibration profiles"
+    )
+
+    parser.add_argument(
+        "--notes", type=str, default="", help="Notes stored with the calibration profiles (ex. ambient temperature)"
+    )
+
+# Saves a calibration profile and returns its path.
+# points is a list of (DAC value, frequency) measurements and lut the
+# 128 entry MIDI to DAC LUT.
+def save_profile(store, device, points, lut, notes=""):
+    directory = device_dir(store, device)
+    os.makedirs(directory, exist_ok=True)
+
+    timestamp = time.time()
+    name = time.strftime(TIMESTAMP_FORMAT, time.localtime(timestamp))
+    path = os.path.join(directory, name + ".npz")
+    suffix = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, "{}-{}.npz".format(name, suffix))
+        suffix += 1
+
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    np.savez_compressed(
+        path,
+        device=device,
+        timestamp=timestamp,
+        notes=notes,
+        dac=points[:, 0].astype(np.uint16),
+        freq=points[:, 1],
+        lut=np.asarray(lut, dtype=np.uint16),
+    )
+    return path
+
+# Loads a calibration profile as a dictionary
+def load_profile(path):
+    with np.load(path) as data:
+        return {
+            "path": path,
+            "device": str(data["device"]),
+            "timestamp": float(data["timestamp"]),
+            "notes": str(data["notes"]),
+            "dac": data["dac"],
+            "freq": data["freq"],
+            "lut": data["lut"],
+        }
+
+# Lists the profile paths of a device (or all devices), oldest first
+def list_profiles(store, device=None):
+    if device is not None:
+        directories = [device_dir(store, device)]
+    elif os.path.isdir(store):
+        directories = [os.path.join(store, d) for d in sorted(os.listdir(store))]
+    else:
+        directories = []
+
+    paths = []
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        paths += [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith(".npz")]
+    return paths
+
+# Loads the n most recent profiles of a device, newest first
+def recent_profiles(store, device, n=1):
+    paths = list_profiles(store, device)
+    return [load_profile(p) for p in reversed(paths[-n:])]
+
+# Deletes all but the keep most recent profiles of a device.
+# Returns the deleted paths.
+def prune_profiles(store, device, keep):
+    paths = list_profiles(store, device)
+    deleted = paths[:max(len(paths) - keep, 0)]
+    for path in deleted:
+        os.remove(path)
+    return deleted
+
+#####################################################
+# Step Table
+#####################################################
+
+# Derives a step table (see STEP_TABLE in tuning.py) for the notes
+# min_note to max_note from the LUTs of the given profiles.
+# The LUT entries are averaged over all profiles. The first step is the
+# DAC value of the first note, every following one the difference to the
+# previous note. Entries pinned at the DAC floor say nothing about the
+# response, so steps from or to them are taken from fallback (usually
+# STEP_TABLE) instead. Steps are at least half of the fallback step.
+def derive_step_table(profiles, min_note, max_note, fallback):
+    luts = np.array([p["lut"][min_note:max_note + 1] for p in profiles], dtype=np.float64)
+    dac_vals = np.round(np.mean(luts, axis=0)).astype(int)
+    fallback = np.asarray(fallback[:len(dac_vals)], dtype=int)
+
+    steps = np.diff(dac_vals, prepend=0)
+    floor = dac_vals <= 0
+    floor[1:] |= floor[:-1].copy()
+    steps[floor] = fallback[floor]
+    return [int(s) for s in np.maximum(steps, np.maximum(fallback // 2, 1))]
+
+#####################################################
+# Command Line Interface
+#####################################################
+
+def format_timestamp(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+def cmd_list(args):
+    paths = list_profiles(args.store, args.device)
+    if not paths:
+        print("No profiles found")
+        return
+
+    for path in paths:
+        p = load_profile(path)
+        print("{}\t{}\t{}\t{} points\t{}".format(
+            path, p["device"], format_timestamp(p["timestamp"]), len(p["dac"]), p["notes"]
+        ))
+
+def cmd_compare(args):
+    a = load_profile(args.a)
+    b = load_profile(args.b)
+
+    print("Note\tA\tB\tDelta")
+    for note in range(len(a["lut"])):
+        va, vb = int(a["lut"][note]), int(b["lut"][note])
+        if va != vb or args.all:
+            print("{}\t{}\t{}\t{:+d}".format(note, va, vb, vb - va))
+
+    delta = b["lut"].astype(int) - a["lut"].astype(int)
+    print("")
+    print("Changed entries: {}\tMax. delta: {}".format(np.count_nonzero(delta), np.max(np.abs(delta))))
+
+def cmd_prune(args):
+    for path in prune_profiles(args.store, args.device, args.keep):
+        print("Deleted {}".format(path))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Manages the calibration profiles of the Dampflog tuning tools"
+    )
+
+    parser.add_argument(
+        "--store", type=str, default=DEFAULT_STORE, help="Profile store directory"
+    )
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("list", help="Lists stored profiles")
+    p.add_argument("device", type=str, nargs="?", default=None, help="Only list profiles of this device")
+    p.set_defaults(func=cmd_list)
+
+    p = subparsers.add_parser("compare", help="Compares the LUTs of two profiles")
+    p.add_argument("a", type=str, help="Path of the first profile")
+    p.add_argument("b", type=str, help="Path of the second profile")
+    p.add_argument("--all", action="store_true", help="Also print unchanged entries")
+    p.set_defaults(func=cmd_compare)
+
+    p = subparsers.add_parser("prune", help="Deletes all but the most recent profiles of a device")
+    p.add_argument("device", type=str, help="Device whose profiles are pruned")
+    p.add_argument("-k", "--keep", type=int, default=5, help="Number of profiles to keep")
+    p.set_defaults(func=cmd_prune)
+
+    args = parser.parse_args()
+    args.func(args)
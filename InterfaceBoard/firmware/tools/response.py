@@ -0,0 +1,113 @@
+# Frequency response model of the Dampflog
+#
+# The frequency vs. DAC value response of the oscillator is smooth and
+# monotonically increasing (see data/P1_FreqVSRes and plot_midi_2_dac.py).
+# Below the transistors operating region it is flat.
+#
+# The response is modelled by a monotone cubic (PCHIP) interpolation of
+# measured (DAC value, frequency) points in log-frequency, i.e. cents,
+# where the response is close to linear. Once fitted, the DAC values of
+# any number of notes are solved at once by evaluating the model for every
+# DAC value and searching the targets in the result.
+
+import numpy as np
+from scipy.interpolate import PchipInterpolator
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+MAX_DAC_VAL = 0x0FFF
+WELL_TEMPERED_A = 440
+
+#####################################################
+# Helper Functions
+#####################################################
+
+def freq_to_cents(freq):
+    return 1200 * np.log2(np.asarray(freq, dtype=np.float64) / WELL_TEMPERED_A)
+
+def midi_note_to_cents(note):
+    return 100 * (np.asarray(note, dtype=np.float64) - 69)
+
+#####################################################
+# Response Model
+#####################################################
+
+# Fits the response model to measured (DAC value, frequency) points.
+# Invalid measurements (NaN) are dropped and repeated DAC values averaged.
+# Measurement noise that would make the response decrease is removed by
+# enforcing a monotonically increasing curve.
+# Returns the model, mapping DAC values to cents (see freq_to_cents).
+def fit_response(dac, freq):
+    dac = np.asarray(dac, dtype=np.float64)
+    cents = freq_to_cents(freq)
+    valid = np.isfinite(cents)
+    dac, cents = dac[valid], cents[valid]
+    if len(dac) < 2:
+        raise ValueError("At least two valid points are needed to fit the response")
+
+    x, inverse = np.unique(dac, return_inverse=True)
+    y = np.bincount(inverse, weights=cents) / np.bincount(inverse)
+    y = np.maximum.accumulate(y)
+    return PchipInterpolator(x, y, extrapolate=False)
+
+# Evaluates the model for every DAC value. Values beyond the measured
+# points are clamped to the first/last measured point.
+def response_curve(model):
+    x = np.clip(np.arange(MAX_DAC_VAL + 1), model.x[0], model.x[-1])
+    return model(x)
+
+# Solves the DAC values of the given MIDI notes.
+# Every note is mapped to the DAC value whose modelled frequency is closest
+# to it. Notes outside the modelled range are clamped to the DAC value at
+# which the response reaches its lowest/highest frequency.
+# Returns the DAC values and the predicted errors in cents.
+def solve_notes(model, notes, curve=None):
+    if curve is None:
+        curve = response_curve(model)
+    targets = midi_note_to_cents(notes)
+
+    # The flat part below the operating region maps to the DAC value
+    # at which the response leaves it
+    hi = np.clip(np.searchsorted(curve, targets), 1, MAX_DAC_VAL)
+    lo = hi - 1
+    dac = np.where(np.abs(curve[lo] - targets) <= np.abs(curve[hi] - targets), lo, hi)
+    dac = np.where(targets <= curve[0], np.searchsorted(curve, curve[0], side="right") - 1, dac)
+    return dac, curve[dac] - targets
+
+# Estimates how badly each interval between the fitted points is resolved:
+# the difference (cents) between the model and a straight line through the
+# interval's end points at its center. The response bends the most where
+# this is large, so further points are placed there.
+def interval_errors(model):
+    x = model.x
+    mid = (x[:-1] + x[1:]) / 2
+    y = model(x)
+    return np.abs(model(mid) - (y[:-1] + y[1:]) / 2)
+
+# Picks the next DAC values to measure: the centers of the (up to n) intervals
+# with the largest errors (see interval_errors), considering only intervals that
+# overlap the range of cents between lo and hi and are wider than one DAC value.
+# Intervals whose error is below the tolerance (cents) are skipped.
+# Returns the DAC values in ascending order (empty if the model is resolved).
+def next_sweep_points(model, lo, hi, tolerance, n):
+    x = model.x
+    y = model(x)
+    errors = interval_errors(model)
+
+    relevant = (y[1:] >= lo) & (y[:-1] <= hi) & (np.diff(x) > 1)
+    errors = np.where(relevant, errors, 0)
+
+    # Intervals spanning more than one semitone are never linear enough
+    errors = np.where(relevant & (y[1:] - y[:-1] > 100), np.maximum(errors, tolerance), errors)
+
+    worst = np.argsort(errors)[::-1][:n]
+    worst = np.sort(worst[errors[worst] >= tolerance])
+    return [int((x[i] + x[i + 1]) // 2) for i in worst]
+
+# Picks the next DAC value to measure, see next_sweep_points.
+# Returns None if the model is resolved within the tolerance (cents).
+def next_sweep_point(model, lo, hi, tolerance):
+    points = next_sweep_points(model, lo, hi, tolerance, 1)
+    return points[0] if points else None
@@ -0,0 +1,224 @@
+# MIDI transports of the Dampflog tuning tools
+#
+# The Interface Board is reached either through a USB-MIDI interface (mido
+# ports) or directly through a USB-serial adapter wired to its MIDI UART
+# (SerialPort), which bypasses the MIDI interface and its driver. Both are
+# used the same way: send() of mido messages, poll() for replies and close().
+#
+# Messages to the Dampflog are built by the encoders below and its replies
+# parsed by the decoders, shared by all tools (and the simulator). Sysex data
+# bytes only carry 7 bits, so 14-bit values (ex. DAC values) are sent as two
+# bytes, MSB first (see handle_sysex_msg() in src/main.c).
+#
+# As the Dampflog handles messages in order, the acknowledgement of a SYNC
+# message tells that all messages sent before it have been handled (see
+# sync()), which replaces fixed waits whenever the replies of the Dampflog
+# can be received.
+
+import time
+import mido
+import serial
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+MAX_DAC_VAL = 0x0FFF
+MAX_MIDI_NOTE = 127
+UART_MIDI_BAUDRATE = 31250
+
+SYSEX_MANUFACTURER_ID = 0x7D
+SYSEX_CMD_SET_DAC = 0x01
+SYSEX_CMD_SET_GATE = 0x02
+SYSEX_CMD_SET_GATE_CLOSE = 0x00
+SYSEX_CMD_SET_GATE_OPEN = 0x01
+SYSEX_WRITE_MIDI_2_DAC_LUT = 0x03
+SYSEX_WRITE_MIDI_2_DAC_LUT_BLOCK = 0x04
+SYSEX_LUT_BLOCK_MAX_ENTRIES = 16
+SYSEX_READ_MIDI_2_DAC_LUT = 0x05
+SYSEX_MIDI_2_DAC_LUT_DUMP = 0x11
+SYSEX_DAC_STAIRCASE = 0x06
+SYSEX_DAC_STAIRCASE_DONE = 0x12
+SYSEX_SYNC = 0x07
+
+SYSEX_ACK = 0x10
+SYSEX_ACK_OK = 0x00
+SYSEX_ACK_BAD_CHECKSUM = 0x01
+SYSEX_ACK_BAD_MESSAGE = 0x02
+
+SYSEX_ACK_TIMEOUT = 0.5     # seconds
+ACK_POLL_INTERVAL = 0.001   # seconds between polling the MIDI input for an acknowledgement
+
+SERIAL_PREFIX = "serial:"   # Ports named with this prefix are serial devices, ex. serial:/dev/ttyUSB0
+
+#####################################################
+# Encoders
+#####################################################
+
+def uint14_to_midi_data(val):
+    return [val >> 7, val & 0x7F]
+
+def midi_data_to_uint14(msb, lsb):
+    return msb << 7 | lsb
+
+# Checksum of sysex data (see sysex_checksum() in src/main.c)
+def sysex_checksum(data):
+    checksum = 0
+    for b in data:
+        checksum ^= b
+    return checksum & 0x7F
+
+# Sysex message of a command to the Dampflog
+def sysex_msg(cmd, data=()):
+    return mido.Message("sysex", data=[SYSEX_MANUFACTURER_ID, cmd] + list(data))
+
+def set_dac_msg(value):
+    if value < 0 or value > MAX_DAC_VAL:
+        raise ValueError("DAC value out of range")
+    return sysex_msg(SYSEX_CMD_SET_DAC, uint14_to_midi_data(value))
+
+def set_gate_msg(value):
+    return sysex_msg(SYSEX_CMD_SET_GATE, [SYSEX_CMD_SET_GATE_OPEN if value else SYSEX_CMD_SET_GATE_CLOSE])
+
+# Writes a single LUT entry, not acknowledged
+def write_lut_entry_msg(note, value):
+    if value < 0 or value > MAX_DAC_VAL:
+        raise ValueError("DAC value out of range")
+    return sysex_msg(SYSEX_WRITE_MIDI_2_DAC_LUT, [note] + uint14_to_midi_data(value))
+
+# Writes up to SYSEX_LUT_BLOCK_MAX_ENTRIES consecutive LUT entries
+def write_lut_block_msg(first, values):
+    if len(values) == 0 or len(values) > SYSEX_LUT_BLOCK_MAX_ENTRIES or first + len(values) > MAX_MIDI_NOTE + 1:
+        raise ValueError("Invalid LUT block")
+
+    data = [first, len(values)]
+    for value in values:
+        if value < 0 or value > MAX_DAC_VAL:
+            raise ValueError("DAC value out of range")
+        data += uint14_to_midi_data(value)
+    return sysex_msg(SYSEX_WRITE_MIDI_2_DAC_LUT_BLOCK, data + [sysex_checksum(data)])
+
+# Requests up to SYSEX_LUT_BLOCK_MAX_ENTRIES consecutive LUT entries (see parse_lut_dump)
+def read_lut_msg(first, count):
+    return sysex_msg(SYSEX_READ_MIDI_2_DAC_LUT, [first, count])
+
+# Steps the DAC from start towards end by stride every dwell_ms milliseconds
+def staircase_msg(start, end, stride, dwell_ms):
+    data = (uint14_to_midi_data(start) + uint14_to_midi_data(end) +
+            uint14_to_midi_data(stride) + uint14_to_midi_data(dwell_ms))
+    return sysex_msg(SYSEX_DAC_STAIRCASE, data + [sysex_checksum(data)])
+
+def sync_msg():
+    return sysex_msg(SYSEX_SYNC)
+
+# Plays a note through the LUT of the Dampflog, opens the GATE
+def note_on_msg(note):
+    if note < 0 or note > MAX_MIDI_NOTE:
+        raise ValueError("MIDI note out of range")
+    return mido.Message("note_on", note=note)
+
+# Closes the GATE regardless of the note
+def note_off_msg(note):
+    if note < 0 or note > MAX_MIDI_NOTE:
+        raise ValueError("MIDI note out of range")
+    return mido.Message("note_off", note=note)
+
+#####################################################
+# Decoders
+#####################################################
+
+# Data following the command byte of a sysex reply of the Dampflog, None
+# if the message isn't a reply of the given command
+def reply_data(msg, cmd):
+    if msg.type != "sysex" or len(msg.data) < 2:
+        return None
+    if msg.data[0] != SYSEX_MANUFACTURER_ID or msg.data[1] != cmd:
+        return None
+    return list(msg.data[2:])
+
+# Status of an acknowledgement of the given command, None if the message isn't one
+def ack_status(msg, cmd):
+    data = reply_data(msg, SYSEX_ACK)
+    if data is None or len(data) != 2 or data[0] != cmd:
+        return None
+    return data[1]
+
+# Values of a LUT dump of count entries beginning at first (see read_lut_msg).
+# Returns None if the message isn't that dump, raises ValueError on a bad checksum.
+def parse_lut_dump(msg, first, count):
+    data = reply_data(msg, SYSEX_MIDI_2_DAC_LUT_DUMP)
+    if data is None or len(data) != 3 + 2 * count or data[0] != first or data[1] != count:
+        return None
+    if sysex_checksum(data[:-1]) != data[-1]:
+        raise ValueError("Bad checksum of LUT dump")
+    return [midi_data_to_uint14(data[2 + 2 * i], data[3 + 2 * i]) for i in range(count)]
+
+# Whether the message reports the completion of a DAC staircase
+def is_staircase_done(msg):
+    data = reply_data(msg, SYSEX_DAC_STAIRCASE_DONE)
+    return data is not None and len(data) == 2
+
+#####################################################
+# Serial Port
+#####################################################
+
+# Direct connection to the MIDI UART of the Interface Board through a
+# USB-serial adapter. Acts as MIDI output and input port at once, like
+# mido ports.
+class SerialPort:
+    def __init__(self, device, baudrate=UART_MIDI_BAUDRATE):
+        self.name = SERIAL_PREFIX + device
+        self.serial = serial.Serial(device, baudrate, timeout=0)
+        self.parser = mido.Parser()
+
+    # Writes a message, returns once it has been passed to the adapter
+    def send(self, msg):
+        self.serial.write(bytes(msg.bytes()))
+        self.serial.flush()
+
+    # Returns the next message received, or None
+    def poll(self):
+        n = self.serial.in_waiting
+        if n > 0:
+            self.parser.feed(self.serial.read(n))
+        return self.parser.get_message()
+
+    def close(self):
+        self.serial.close()
+
+#####################################################
+# Ports
+#####################################################
+
+# Opens the output and input port of a Dampflog given by name, a serial
+# device with SERIAL_PREFIX or else a MIDI port.
+# Returns both ports, the input port is None if unavailable.
+def open_ports(name):
+    if name.startswith(SERIAL_PREFIX):
+        port = SerialPort(name[len(SERIAL_PREFIX):])
+        return port, port
+
+    port = mido.open_output(name)
+    # Interfaces usually name their input and output the same
+    port_in = mido.open_input(name) if name in mido.get_input_names() else None
+    return port, port_in
+
+# Waits for the Dampflog to acknowledge a sysex command, other messages are discarded.
+# Returns the status of the acknowledgement, or None on timeout.
+def wait_for_ack(port_in, cmd, wait=time.sleep, clock=time.monotonic, timeout=SYSEX_ACK_TIMEOUT):
+    deadline = clock() + timeout
+    while clock() < deadline:
+        msg = port_in.poll()
+        if msg is None:
+            wait(ACK_POLL_INTERVAL)
+            continue
+        status = ack_status(msg, cmd)
+        if status is not None:
+            return status
+    return None
+
+# Sends a SYNC message and waits for its acknowledgement.
+# Returns whether it has been received, i.e. all messages sent before have been handled.
+def sync(port, port_in, wait=time.sleep, clock=time.monotonic, timeout=SYSEX_ACK_TIMEOUT):
+    port.send(sync_msg())
+    return wait_for_ack(port_in, SYSEX_SYNC, wait, clock, timeout) == SYSEX_ACK_OK
@@ -1,21 +1,44 @@
 # Steps DAC using key up and down
+#
+# Key events are queued by the keyboard hook and handled by a blocking event
+# loop, which sleeps while idle. Holding a key accelerates the stepping (see
+# ACCEL_STRIDES), key repeats are coalesced: the DAC value is sent at most
+# SEND_RATE times per second, always the latest one.
+#
+# The pitch of the Dampflog is read from the audio input and shown along
+# with the DAC value every READOUT_INTERVAL seconds, so no external tuner is
+# needed. With --auto-assign, the next note is assigned as soon as the
+# readout has been stable within the tolerance of it.
+#
+# The Dampflog is driven through a serial device wired to the MIDI UART of
+# the Interface Board, or through a MIDI port with --midi-port (see transport.py).
 
 import argparse
+import collections
 import keyboard
-import serial
+import queue
 import sys
 import csv
+import time
+import numpy as np
 from termios import tcflush, TCIFLUSH
 
-MAX_DAC_VAL = 0x0FFF
+import transport
+import tuning
+from transport import MAX_DAC_VAL
+from tuning import RECORD_SAMPLE_RATE, error_in_cents, midi_note_to_freq, midi_note_to_name_oct
 
-UART_MIDI_BAUDRATE = 115200
+SEND_RATE = 30  # Max. DAC values sent per second
 
-SYSEX_MANUFACTURER_ID = 0x7D
-SYSEX_START = 0xF0
-SYSEX_END = 0xF7
+# Stride of the DAC steps after holding a key for the given time (seconds)
+ACCEL_STRIDES = [(0, 1), (0.5, 4), (1.0, 16), (1.5, 64)]
 
-SYSEX_CMD_SET_DAC = 0x01
+INPUT_SETTLE_TIME = 0.05  # seconds, until keys typed into input() have been queued
+
+READOUT_INTERVAL = 0.02  # seconds between pitch readouts
+READOUT_WINDOW = 0.1  # seconds of audio every readout is determined from
+STABLE_READINGS = 10  # Consecutive readouts that have to agree for auto-assignment
+STABLE_TOLERANCE = 3  # cents
 
 parser = argparse.ArgumentParser(
     description="Steps DAC of Dampflog using key up and down"
@@ -25,119 +48,217 @@ parser.add_argument(
     "-p", "--port", type=str, default="/dev/ttyUSB0", help="Serial port"
 )
 
+parser.add_argument(
+    "-m", "--midi-port", type=str, default=None, help="MIDI output port to use instead of the serial port"
+)
+
 parser.add_argument("-o", "--output", type=str, default="midi_2_dac.h", help="Output")
 
-args = parser.parse_args()
+parser.add_argument(
+    "-a",
+    "--audio-device",
+    type=str,
+    default=None,
+    help="Audio input device, given by its name or index (default input device if omitted)",
+)
 
+parser.add_argument(
+    "--no-readout", action="store_true", help="Don't read the pitch from the audio input"
+)
 
-def clear_terminal():
-    print("\033[H\033[J", end="")
+parser.add_argument(
+    "--auto-assign",
+    action="store_true",
+    help="Assign the next note as soon as the readout is stable within the tolerance of it",
+)
 
+parser.add_argument(
+    "-t",
+    "--tolerance",
+    type=float,
+    default=tuning.DEFAULT_TOLERANCE,
+    help="Accepted error in cents for auto-assignment",
+)
 
-def set_dac(ser, value):
-    if value < 0 or value > MAX_DAC_VAL:
-        raise ValueError("DAC value out of range")
-    msg = bytes(
-        [
-            SYSEX_START,
-            SYSEX_MANUFACTURER_ID,
-            SYSEX_CMD_SET_DAC,
-            value >> 8,
-            value & 0xFF,
-            SYSEX_END,
-        ]
-    )
-    ser.write(msg)
+args = parser.parse_args()
 
 
-ser = serial.Serial(args.port, UART_MIDI_BAUDRATE)
-dac_val = 0
-first_note_provided = False
-note = 0
-ignore_next_enter = False
+# Prints a message above the status line
+def show(msg):
+    print("\r\033[K" + msg)
 
 
-def handle_key(key):
-    global dac_val
-    global first_note_provided
+# Rewrites the status line with the DAC value and the latest readout
+def show_status():
+    status = "DAC value: {}".format(dac_val)
+    if reading is not None:
+        freq, _ = reading
+        if np.isfinite(freq):
+            closest, _ = tuning.closest_midi_note_to_freq(freq)
+            status += "\t{} ({})\t{:.2f} Hz\t{:+.1f} cents".format(
+                midi_note_to_name_oct(closest),
+                closest,
+                freq,
+                error_in_cents(midi_note_to_freq(closest), freq),
+            )
+        else:
+            status += "\tNo signal"
+    print("\r\033[K" + status, end="", flush=True)
+
+
+def set_dac(port, value):
+    port.send(transport.set_dac_msg(value))
+
+
+# Stride of a key held for the given time (seconds)
+def stride(held):
+    s = 1
+    for t, step in ACCEL_STRIDES:
+        if held >= t:
+            s = step
+    return s
+
+
+# Prompts for a number. Keys typed meanwhile are also queued by the keyboard
+# hook, so they are dropped afterwards.
+def prompt_int(msg):
+    show(msg)
+    tcflush(sys.stdin, TCIFLUSH)
+    try:
+        value = int(input())
+    except ValueError:
+        value = None
+    time.sleep(INPUT_SETTLE_TIME)
+    while not events.empty():
+        events.get_nowait()
+    held.clear()
+    return value
+
+
+# Determines the pitch of the latest READOUT_WINDOW seconds of the audio input.
+# Returns the frequency and its standard error in cents (see pitch.period_stats).
+def read_pitch():
+    n = int(READOUT_WINDOW * RECORD_SAMPLE_RATE)
+    sample = audio_in.record(READOUT_WINDOW, audio_in.mark() - n)
+    return pitch.period_stats(sample, RECORD_SAMPLE_RATE)
+
+
+# Whether the recent readouts agree within STABLE_TOLERANCE cents
+def readout_stable():
+    if len(readings) < STABLE_READINGS:
+        return False
+    freqs = [f for f, _ in readings]
+    if not np.all(np.isfinite(freqs)):
+        return False
+    return error_in_cents(min(freqs), max(freqs)) <= STABLE_TOLERANCE
+
+
+def assign(n, value):
     global note
-    global mutex
-    global ignore_next_enter
 
-    if key.name == "up":
-        dac_val += 1
-        clear_terminal()
-
-    elif key.name == "down":
-        dac_val -= 1
-        clear_terminal()
+    note = n
+    midi_2_dac[note] = value
+    show("Assigned midi note {} to DAC value {}".format(note, value))
+
+
+def write_output():
+    for i in range(note + 1, 128):
+        midi_2_dac[i] = MAX_DAC_VAL
+
+    csv_file = args.output.replace(".h", ".csv")
+    show("Generating CSV file at: {}".format(csv_file))
+    with open(csv_file, "w") as f:
+        writer = csv.writer(f)
+        for i in range(128):
+            writer.writerow([i, midi_2_dac[i]])
+
+    show("Generating C header with lookup table at: {}".format(args.output))
+    with open(args.output, "w") as f:
+        guard = args.output.upper().replace(".", "_") + "_INCLUDED"
+        f.write("#ifndef " + guard + "\n")
+        f.write("#define " + guard + "\n")
+        f.write("// This file is autogenerated by tune.py\n")
+        f.write("// MIDI to DAC lookup table\n")
+        f.write("#include <stdint.h>\n")
+        f.write("#include <midirx_msg.h>\n")
+        f.write("const uint16_t midi_2_dac[MIDI_DATA_MAX_VAL + 1] = {")
+        for i in range(128):
+            f.write(str(midi_2_dac[i]))
+            if i < 127:
+                f.write(", ")
+            f.write("\n")
+        f.write("};\n")
+        f.write("#endif\n")
+
+
+port_name = args.midi_port if args.midi_port is not None else transport.SERIAL_PREFIX + args.port
+port, port_in = transport.open_ports(port_name)
+dac_val = 0
+sent_val = None
+next_send = 0
+first_note_provided = False
+note = -1
+held = {}  # Key name -> time the key has been pressed down
+events = queue.Queue()
+
+# The audio input (and sounddevice) is only needed for the readout
+audio_in = None
+if not args.no_readout:
+    import audio
+    import pitch
+
+    audio_device = args.audio_device
+    if audio_device is not None and audio_device.isdigit():
+        audio_device = int(audio_device)
+    audio_in = audio.SoundDeviceInput(RECORD_SAMPLE_RATE, audio_device)
+reading = None  # Latest (frequency, standard error) of the readout
+readings = collections.deque(maxlen=STABLE_READINGS)  # Readouts since the last DAC change
+next_readout = 0
+
+
+# Handles a key event, returns False to end the tuning
+def handle_key(event):
+    global dac_val
+    global first_note_provided
 
-    elif key.name == "enter":
-        # Workaround for keyboard lib queuing enter key from input()
-        if ignore_next_enter:
-            ignore_next_enter = False
-            return
+    if event.event_type == keyboard.KEY_UP:
+        held.pop(event.name, None)
+        return True
+
+    if event.name in ["up", "down"]:
+        now = time.monotonic()
+        held.setdefault(event.name, now)
+        step = stride(now - held[event.name])
+        dac_val += step if event.name == "up" else -step
+        dac_val = min(max(dac_val, 0), MAX_DAC_VAL)
+
+    elif event.name == "j":
+        value = prompt_int("Enter the DAC value to jump to:")
+        if value is None or value < 0 or value > MAX_DAC_VAL:
+            show("Invalid DAC value")
+        else:
+            dac_val = value
 
+    elif event.name == "enter":
+        n = note + 1
         if not first_note_provided:
-            print("Please specify the midi note number for the first note:")
-            tcflush(sys.stdin, TCIFLUSH)
-            note = int(input())
+            n = prompt_int("Please specify the midi note number for the first note:")
+            if n is None or n < 0:
+                show("Invalid midi note")
+                return True
             first_note_provided = True
-            ignore_next_enter = True
-        else:
-            note += 1
 
-        if note > 127:
-            print(
-                "All notes already assigned, please press esc to generate header file"
-            )
-            return
-
-        midi_2_dac[note] = dac_val
-        print("Assigned midi note {} to DAC value {}".format(note, dac_val))
-        return
-
-    elif key.name == "esc":
-        for i in range(note, 128):
-            midi_2_dac[i] = MAX_DAC_VAL
-
-        csv_file = args.output.replace(".h", ".csv")
-        print("Generating CSV file at: {}".format(csv_file))
-        with open(csv_file, "w") as f:
-            writer = csv.writer(f)
-            for i in range(128):
-                writer.writerow([i, midi_2_dac[i]])
-
-        print("Generating C header with lookup table at: {}".format(args.output))
-        with open(args.output, "w") as f:
-            guard = args.output.upper().replace(".", "_") + "_INCLUDED"
-            f.write("#ifndef " + guard + "\n")
-            f.write("#define " + guard + "\n")
-            f.write("// This file is autogenerated by tune.py\n")
-            f.write("// MIDI to DAC lookup table\n")
-            f.write("#include <stdint.h>\n")
-            f.write("#include <midirx_msg.h>\n")
-            f.write("const uint16_t midi_2_dac[MIDI_DATA_MAX_VAL + 1] = {")
-            for i in range(128):
-                f.write(str(midi_2_dac[i]))
-                if i < 127:
-                    f.write(", ")
-                f.write("\n")
-            f.write("};\n")
-            f.write("#endif\n")
-        exit(0)
-        raise KeyboardInterrupt
-
-    else:
-        return
-
-    if dac_val < 0:
-        dac_val = 0
-    elif dac_val > MAX_DAC_VAL:
-        dac_val = MAX_DAC_VAL
-
-    set_dac(ser, dac_val)
-    print("DAC value: {}\n".format(dac_val))
+        if n > 127:
+            show("All notes already assigned, please press esc to generate header file")
+            return True
+
+        assign(n, dac_val)
+
+    elif event.name == "esc":
+        write_output()
+        return False
+
+    return True
 
 
 midi_2_dac = [0] * 128
@@ -145,15 +266,69 @@ midi_2_dac = [0] * 128
 print()
 print("Dampflog: Tuning of MIDI to DAC values")
 print("==========================================")
-print("Please connect the Dampflog to a Tuner")
+if audio_in is None:
+    print("Please connect the Dampflog to a Tuner")
+else:
+    print("Please connect the Dampflog to the audio input, its pitch is shown below")
 print("To increase the DAC value press the up key")
 print("To decrease the DAC value press the down key")
+print("Hold the keys to step faster, press j to jump to a DAC value")
 print("To end the tuning press the esc key, a c header file will be generated")
 print()
 print("Press enter to assign midi notes to the current DAC value")
+if args.auto_assign:
+    print(
+        "After the first note, the next note is assigned once it is stable within {} cents".format(
+            args.tolerance
+        )
+    )
+print()
 
+keyboard.hook(events.put)
+
+running = True
+while running:
+    # Sleeps until the next key event, until a pending DAC value may be sent
+    # or until the next readout
+    deadlines = []
+    if dac_val != sent_val:
+        deadlines.append(next_send)
+    if audio_in is not None:
+        deadlines.append(next_readout)
+    timeout = None
+    if deadlines:
+        timeout = max(min(deadlines) - time.monotonic(), 0)
+    try:
+        running = handle_key(events.get(timeout=timeout))
+    except queue.Empty:
+        pass
+    if not running:
+        break
+
+    now = time.monotonic()
+    if dac_val != sent_val and now >= next_send:
+        set_dac(port, dac_val)
+        sent_val = dac_val
+        next_send = now + 1 / SEND_RATE
+        readings.clear()
+        show_status()
+
+    if audio_in is not None and now >= next_readout:
+        reading = read_pitch()
+        readings.append(reading)
+        next_readout = now + READOUT_INTERVAL
+        show_status()
+
+        if args.auto_assign and first_note_provided and note < 127 and dac_val == sent_val and readout_stable():
+            freq = np.median([f for f, _ in readings])
+            if abs(error_in_cents(midi_note_to_freq(note + 1), freq)) <= args.tolerance:
+                assign(note + 1, dac_val)
+                readings.clear()
 
-keyboard.on_press(handle_key)
-
-while True:
-    pass
+print()
+keyboard.unhook_all()
+port.close()
+if port_in is not None and port_in is not port:
+    port_in.close()
+if audio_in is not None:
+    audio_in.close()
@@ -0,0 +1,1884 @@
+# Tuning engine of the Dampflog tuning tools
+#
+# A Tuner holds everything needed to tune a single Dampflog: its MIDI
+# output (and optionally input) port, its audio input, the clock used for
+# waiting and all measurement counters. As nothing is shared between
+# tuners, several Dampflogs can be tuned concurrently (see farm.py).
+#
+# The audio input may be any backend described in audio.py, or the
+# simulator (see dampflog_sim.py), which is also port and clock at once.
+
+import contextlib
+import threading
+import time
+import numpy as np
+
+import drift
+import pitch
+import response
+import transport
+from transport import (
+    MAX_DAC_VAL, MAX_MIDI_NOTE, SYSEX_ACK_BAD_CHECKSUM, SYSEX_ACK_OK, SYSEX_ACK_TIMEOUT,
+    SYSEX_DAC_STAIRCASE, SYSEX_LUT_BLOCK_MAX_ENTRIES, SYSEX_SYNC, SYSEX_WRITE_MIDI_2_DAC_LUT_BLOCK,
+)
+
+#####################################################
+# Constants/Parameters
+#####################################################
+
+# Sysex (the commands and their encoding are defined in transport.py)
+
+LUT_BLOCK_WAIT_TIME = 0.15  # seconds, used if no acknowledgements are received (up to 8 flash word programs)
+
+# Recording
+
+MIDO_WAIT_TIME = 0.1        # seconds, waited after a message unless it is acknowledged (see Tuner.synced)
+SYNC_SETTLE_TIME = 0.02     # seconds the oscillator settles after an acknowledged DAC change
+# ATTACK_TIME = 0.01          # seconds
+ATTACK_TIME = 0             # MIDO_WAIT_TIME aleardy does the job
+RECORD_DURATION = 0.3       # seconds
+RECORD_SAMPLE_RATE = 44100  # Hz
+RECORD_CHANNELS = 1         # mono
+
+# Adaptive Settle Detection
+
+SETTLE_WINDOW = 0.05        # seconds
+SETTLE_WINDOWS = 3          # Number of consecutive windows that have to agree
+SETTLE_TOLERANCE = 1        # cents
+SETTLE_TIMEOUT = 1          # seconds
+
+# Oscillator Parameters
+
+OSC_MIN_NOTE = 46 # A#2
+OSC_MAX_NOTE = 76 # E5
+OSC_STARTUP_SETTLE_TIME = 3 # seconds
+
+# Incremental Retune
+
+DEFAULT_RETUNE_THRESHOLD = 3 # cents
+RETUNE_STEP = 10            # Initial step (DAC) when searching a drifted note
+
+# Tuning Strategies
+
+STRATEGIES = ["linear", "secant"]
+DEFAULT_STRATEGY = "linear"
+DEFAULT_TOLERANCE = 2       # cents, see Tuner (tolerance)
+SECANT_MAX_MEASUREMENTS = 16
+SECANT_MAX_EXPANSION = 4    # Max. growth of the step per iteration before the target is bracketed
+
+# Sweep and Fit
+
+FIT_INITIAL_POINTS = 9      # Evenly spaced DAC values measured first
+DEFAULT_FIT_POINTS = 32     # Max. number of measured DAC values
+FIT_INTERVAL_TOLERANCE = 1  # cents, see response.next_sweep_point
+FIT_MARGIN = 50             # cents, the sweep covers the tuned notes plus this margin
+
+# Sweep Capture
+
+SWEEP_DWELL = 0.05          # seconds each DAC value is held within a sweep capture
+SWEEP_GUARD = 0.02          # seconds skipped after every DAC change (MIDI latency, settling)
+SWEEP_INITIAL_POINTS = 64   # Evenly spaced DAC values of the first sweep (swept fit only)
+SWEEP_BATCH = 8             # Max. number of DAC values added per further sweep
+DEFAULT_SWEEP_FIT_POINTS = 128
+
+# DAC Staircase (stepped by the Dampflog, see staircase_capture)
+
+STAIRCASE_STRIDE = 32       # DAC values between the steps of the first sweep
+STAIRCASE_MIN_PERIODS = 10  # Periods of the lowest note in the usable part of every step (see staircase_dwell)
+STAIRCASE_GUARD = 0.01      # seconds skipped after every step (settling, alignment error)
+STAIRCASE_POLL = 0.005      # seconds of audio read between polling the MIDI input
+DEFAULT_STAIRCASE_FIT_POINTS = 192
+
+# Drift Tracking
+
+DRIFT_REFERENCE_NOTE = 69   # A4, the reference DAC value is the one the step table expects for it
+DEFAULT_DRIFT_INTERVAL = 10 # seconds between reference measurements
+
+# Range Discovery
+
+RANGE_PROBES = 5            # Evenly spaced DAC values measured to discover the range
+
+# Chromatic Check (played through the LUT of the Dampflog, see Tuner.chromatic_check)
+
+CHECK_DWELL = 0.1           # seconds each note is held
+CHECK_GUARD = 0.03          # seconds skipped after every note on (MIDI latency, settling)
+CHECK_SETTLE_TIME = 0.2     # seconds the first note is held before recording, if the oscillator is warm from tuning
+
+# Refinement
+
+CONFIDENCE_Z = 1.96         # Confidence intervals are given at 95 %
+REFINE_MAX_REPEATS = 4      # Max. number of measurements per note and refinement pass
+
+# Measurement cache
+
+DEFAULT_CACHE_TTL = 5       # seconds a measurement of a DAC value may be reused
+
+# Adaptive capture duration, see Tuner.record_adaptive
+
+CAPTURE_MIN_PERIODS = 16        # Periods of the target note in the first window
+CAPTURE_MIN_DURATION = 0.01     # seconds
+CAPTURE_MAX_DURATION = 0.6      # seconds
+CAPTURE_PRECISION = 0.15        # Required standard error close to the target, relative to the tolerance
+CAPTURE_COARSE_PRECISION = 5    # cents, required standard error far from the target
+CAPTURE_DISTANCE_RATIO = 8      # Standard errors a measurement has to be away from the target
+CAPTURE_MAX_GROWTH = 4          # Max. growth of the capture per extension
+
+#####################################################
+# Step Table
+#####################################################
+
+# The step table stores the "expected" differences in DAC
+# values (based on previous tuning) between each MIDI note.
+# It allows the tuning algorithm to make an educated guess
+# for the DAC value of the next note and then proceeds to
+# fine tune from there. This saves a lot of time as the algorithm
+# doesn't have to increment through every single DAC value.
+# The step table has been generated from prior tuning.
+# If calibration profiles of the device exist (see profiles.py), the
+# step table is derived from them instead.
+
+STEP_TABLE = [
+    1600,
+    245,
+    101,
+    91,
+    86,
+    81,
+    75,
+    69,
+    65,
+    62,
+    58,
+    55,
+    51,
+    50,
+    45,
+    44,
+    42,
+    40,
+    38,
+    38,
+    38,
+    38,
+    39,
+    40,
+    44,
+    49,
+    54,
+    69,
+    56,
+    96,
+    50
+]
+
+#####################################################
+# Helper Functions
+#####################################################
+
+######## Frequency Analysis ########
+
+# Determines the error in cents between a target frequency and a measured frequency
+def error_in_cents(target_freq, measured_freq):
+    return 1200 * np.log2(measured_freq / target_freq)
+
+######## MIDI ########
+
+WELL_TEMPERED_A = 440
+
+# Converts a MIDI note number to a frequency
+def midi_note_to_freq(note):
+    return WELL_TEMPERED_A * 2 ** ((note - 69) / 12)
+
+# Determines the closest MIDI note number to a frequency
+def closest_midi_note_to_freq(freq):
+    closest_note = int(round(12 * np.log2(freq / WELL_TEMPERED_A) + 69))
+    error = freq - midi_note_to_freq(closest_note)
+    return closest_note, error
+
+# Converts a MIDI note number to a note name and octave (ex. 46 becomes A#2)
+def midi_note_to_name_oct(midinote):
+    notes = [
+        "C",
+        "C#",
+        "D",
+        "D#",
+        "E",
+        "F",
+        "F#",
+        "G",
+        "G#",
+        "A",
+        "A#",
+        "B",
+    ]
+    return notes[midinote % 12] + str(midinote // 12 - 1)
+
+######## MIDI to DAC Look-up Table ########
+
+# Returns the (first, last) note ranges in which lut differs from current.
+# Ranges separated by less than gap unchanged entries are merged, as
+# resending a few entries is cheaper than another message.
+def lut_diff_ranges(lut, current, gap=3):
+    ranges = []
+    for i in range(len(lut)):
+        if current is not None and lut[i] == current[i]:
+            continue
+        if ranges and i - ranges[-1][1] <= gap:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+    return ranges
+
+# Builds the complete 128 entry MIDI to DAC LUT from the tuned notes.
+# Untuned notes are taken from base (ex. the LUT read from the device). Without
+# base, notes below the oscillators range are mapped to 0, notes above it to MAX_DAC_VAL.
+def build_lut(midi_2_dac, base=None):
+    lut = []
+    for i in range(0, MAX_MIDI_NOTE + 1):
+        if i in midi_2_dac:
+            lut.append(midi_2_dac[i])
+        elif base is not None:
+            lut.append(base[i])
+        elif i < OSC_MIN_NOTE:
+            lut.append(0)
+        else:
+            lut.append(MAX_DAC_VAL)
+    return lut
+
+# Time (seconds) each step of a DAC staircase is held, so that the part of
+# every step after the guard time covers STAIRCASE_MIN_PERIODS periods of
+# the given (lowest) note. Shorter steps scatter by several cents at the low
+# end of the range. Rounded up to ms, the resolution of the Dampflog's timer.
+def staircase_dwell(note, guard=STAIRCASE_GUARD):
+    return np.ceil(1000 * (guard + STAIRCASE_MIN_PERIODS / midi_note_to_freq(note))) / 1000
+
+# Whether a note with the given DAC value and error (cents) is at an end
+# of the DAC range and can't be moved any further
+def at_range_end(dac_val, error):
+    return (dac_val == 0 and error > 0) or (dac_val == MAX_DAC_VAL and error < 0)
+
+# Returns the MIDI to DAC mapping of per-note results (see Tuner.note_result)
+def results_to_midi_2_dac(results):
+    return {r["note"]: r["dac"] for r in results}
+
+# Parses per-region tolerances given as comma separated "first-last:cents"
+# (or "note:cents") entries, ex. "0-59:5,60-72:2,73-127:4".
+# Returns the mapping of MIDI notes to their tolerance (cents).
+def parse_tolerances(spec):
+    tolerances = {}
+    for entry in spec.split(","):
+        try:
+            notes, cents = entry.split(":")
+            first, _, last = notes.partition("-")
+            first = int(first)
+            last = int(last) if last else first
+            cents = float(cents)
+        except ValueError:
+            raise ValueError("Invalid tolerance entry: {}".format(entry))
+        if first < 0 or last > MAX_MIDI_NOTE or first > last or cents <= 0:
+            raise ValueError("Invalid tolerance entry: {}".format(entry))
+        for note in range(first, last + 1):
+            tolerances[note] = cents
+    return tolerances
+
+# Adds the command line options of the Tuner shared by autotune.py and
+# farm.py (the Tuner arguments of the same names, see Tuner)
+def add_tuner_arguments(parser):
+    parser.add_argument(
+        "--drift-interval", type=float, nargs="?", const=DEFAULT_DRIFT_INTERVAL, default=None,
+        help="Remeasure a reference DAC value every given seconds (default {}) while tuning and correct the tuned notes for the drift".format(
+            DEFAULT_DRIFT_INTERVAL
+        )
+    )
+
+    parser.add_argument(
+        "--cache", type=float, nargs="?", const=DEFAULT_CACHE_TTL, default=None, metavar="TTL",
+        help="Reuse measurements of a DAC value taken within the given seconds (default {}) instead of remeasuring it".format(
+            DEFAULT_CACHE_TTL
+        )
+    )
+
+    parser.add_argument(
+        "--adaptive-capture", action="store_true",
+        help="Record only as long as the precision of each measurement requires instead of a fixed duration"
+    )
+
+    parser.add_argument(
+        "--sync", action="store_true",
+        help="Wait for the Dampflog to acknowledge DAC changes instead of fixed waits (requires a MIDI input)"
+    )
+
+    parser.add_argument(
+        "--pipeline", action="store_true",
+        help="Send the next likely DAC value of a search while the current capture is analyzed"
+    )
+
+    parser.add_argument(
+        "--adaptive-settle", action="store_true",
+        help="Measure as soon as the oscillator has settled instead of waiting a fixed time"
+    )
+
+######## Secant Search ########
+
+# Records the error (cents) measured at dac_val in the state of a secant
+# search (see Tuner.secant_tune) and returns the DAC value to measure next,
+# or None if the search ends (bracket one DAC step wide, or target out of range).
+def secant_step(search, dac_val, err):
+    errors = search["errors"]
+    errors[dac_val] = err
+    lo, hi = search["lo"], search["hi"]
+
+    if err < 0 and (lo is None or dac_val > lo):
+        lo = search["lo"] = dac_val
+    elif err > 0 and (hi is None or dac_val < hi):
+        hi = search["hi"] = dac_val
+
+    if lo is not None and hi is not None:
+        # Target is bracketed: regula falsi with bisection fallback
+        width = hi - lo
+        if width <= 1:
+            return None
+
+        prev_width = search["prev_width"]
+        if prev_width is not None and width > prev_width / 2:
+            nxt = (lo + hi) // 2
+        else:
+            nxt = lo + width * -errors[lo] / (errors[hi] - errors[lo])
+            nxt = min(max(int(round(nxt)), lo + 1), hi - 1)
+
+        search["prev_width"] = width
+    else:
+        # Target not bracketed yet: secant step, limited in size
+        direction = 1 if err < 0 else -1
+        prev = search["prev"]
+        nxt = None
+
+        if prev is not None and prev != dac_val:
+            slope = (err - errors[prev]) / (dac_val - prev)
+            if slope > 0:
+                max_step = SECANT_MAX_EXPANSION * abs(dac_val - prev)
+                delta = min(max(-err / slope * direction, 1), max_step)
+                nxt = dac_val + direction * int(round(delta))
+                search["step"] = abs(nxt - dac_val)
+
+        # No usable slope (ex. below the transistors operating region)
+        if nxt is None:
+            nxt = dac_val + direction * search["step"]
+            if prev is not None:
+                search["step"] *= 2
+
+        nxt = min(max(nxt, 0), MAX_DAC_VAL)
+        if nxt == dac_val:
+            return None # Target is out of range
+
+    search["prev"] = dac_val
+    return nxt
+
+# Predicts the error (cents) at dac_val from the points a secant search has
+# measured so far: linearly from the two most recent ones, or the bracket.
+# Before the first measurement, the target is assumed to lie above, as in
+# tune_pass, where every note starts from the DAC value of the one below it.
+# Returns None if there is no prediction (only one point measured).
+def secant_prediction(search, dac_val):
+    errors = search["errors"]
+    if search["lo"] is not None and search["hi"] is not None:
+        a, b = search["lo"], search["hi"]
+    elif len(errors) >= 2:
+        a, b = list(errors)[-2:]
+    elif len(errors) == 0:
+        return -np.inf
+    else:
+        return None
+    slope = (errors[b] - errors[a]) / (b - a)
+    return errors[a] + slope * (dac_val - a)
+
+#####################################################
+# Tuner
+#####################################################
+
+# Serializes the output of concurrently running tuners
+log_lock = threading.Lock()
+
+class Tuner:
+    # port:           MIDI output port (or simulator)
+    # audio_in:       Audio input the Dampflog is recorded from
+    # port_in:        MIDI input port on which the Dampflog replies (None if unavailable)
+    # wait, clock:    Used for waiting and timing, replaced by the simulator's clock
+    # estimator:      Name of the pitch estimator (see pitch.py)
+    # strategy:       Tuning strategy (see STRATEGIES)
+    # tolerance:      Accepted error in cents (secant strategy, fit verification
+    #                 and adaptive capture only)
+    # tolerances:     Tolerance (cents) of single notes, overrides tolerance (see
+    #                 parse_tolerances)
+    # adaptive_settle: Measure as soon as the oscillator has settled instead of
+    #                 using fixed sleeps (see measure_settled)
+    # adaptive_capture: Record only as long as the precision of a measurement
+    #                 requires instead of a fixed duration (see record_adaptive),
+    #                 ignored with adaptive_settle
+    # sweep_dwell:    Time (seconds) each DAC value is held within a sweep capture
+    # drift_interval: Remeasures a reference DAC value every drift_interval seconds
+    #                 during a tuning pass and corrects the tuned notes for the
+    #                 drift (see track_drift), disabled if None
+    # cache_ttl:      Reuses measurements of a DAC value taken within the last
+    #                 cache_ttl seconds instead of remeasuring it (see
+    #                 msr_after_dac_chng), disabled if None
+    # archive:        Stores the raw capture of every measurement if given (see archive.py)
+    # sync:           Waits for the Dampflog to acknowledge DAC changes and LUT
+    #                 writes instead of fixed waits (see synced)
+    # pipeline:       Sends the next likely DAC value of a search before
+    #                 analyzing the current capture, so the analysis overlaps
+    #                 with the settling of the next one (see msr_after_dac_chng)
+    # name:           Prefixed to all output, used to tell devices apart
+    # trace:          Records every measurement if given (see instrument.py)
+    def __init__(self, port, audio_in, port_in=None, wait=time.sleep, clock=time.monotonic,
+                 estimator=pitch.DEFAULT_ESTIMATOR, strategy=DEFAULT_STRATEGY,
+                 tolerance=DEFAULT_TOLERANCE, tolerances=None, adaptive_settle=False, adaptive_capture=False,
+                 sweep_dwell=SWEEP_DWELL,
+                 drift_interval=None, cache_ttl=None, archive=None, sync=False, pipeline=False, name=None, trace=None):
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown tuning strategy: {}".format(strategy))
+
+        self.port = port
+        self.audio_in = audio_in
+        self.port_in = port_in
+        self.wait = wait
+        self.clock = clock
+        self.freq_estimator = pitch.get_estimator(estimator)
+        self.strategy = strategy
+        self.tolerance = tolerance
+        self.tolerances = tolerances if tolerances is not None else {}
+        self.adaptive_settle = adaptive_settle
+        self.adaptive_capture = adaptive_capture
+        self.sweep_dwell = sweep_dwell
+        self.drift_interval = drift_interval
+        self.cache_ttl = cache_ttl
+        self.archive = archive
+        self.sync = sync
+        self.pipeline = pipeline
+        self.name = name
+        self.trace = trace
+
+        # Note and search phase the current measurements belong to, see trace
+        self.note = None
+        self.target_freq = None
+        self.phase = None
+        # CPU time (seconds) spent in get_freq
+        self.analyze_time = 0.0
+        # Standard error (cents) of the last measurement, see pitch.period_stats
+        self.last_uncertainty = np.inf
+        # Note -> DAC value -> [(error, standard error)] of every measurement
+        # taken for a note, kept across refinement passes (see capture_stats)
+        self.captures = {}
+        # DAC value -> (time, frequency, standard error) of its last
+        # measurement, cleared whenever the GATE is opened
+        self.cache = {}
+        # (DAC value, time, sample index, settle time) of a speculatively
+        # sent DAC value that hasn't been measured yet, see speculate
+        self.speculative = None
+        # Longest round trip (seconds) of a SYNC, see synced
+        self.sync_latency = 0.0
+        # Set once a LUT block isn't acknowledged (ex. firmware without block
+        # writes), the LUT is then written entry by entry (see upload_lut)
+        self.no_block_ack = False
+
+        self.reset_counters()
+
+    # Resets the counters of a tuning pass
+    def reset_counters(self):
+        # Total number of measurements taken, used to compare tuning strategies
+        self.n_measurements = 0
+        # Number of measurements answered from the cache
+        self.cache_hits = 0
+        # Speculatively sent DAC values that were measured / discarded, and
+        # the time (seconds) their settling overlapped with the analysis of
+        # the previous measurement, see speculate
+        self.speculative_hits = 0
+        self.speculative_misses = 0
+        self.overlap_time = 0.0
+        # Total duration (seconds) of the captures measured
+        self.record_time = 0.0
+        # All (DAC value, frequency) measurements, stored in the calibration profile
+        self.measured_points = []
+        # Settle times (seconds) observed with adaptive settling
+        self.settle_times = []
+        # Per-note results, see note_result
+        self.results = []
+        # (time, drift in cents) of the reference measurements, see track_drift
+        self.drift_points = []
+        self.drift_ref_dac = None
+        self.drift_ref_freq = None
+
+    def log(self, msg):
+        if self.name is not None:
+            msg = "[{}] {}".format(self.name, msg)
+        with log_lock:
+            print(msg)
+
+    # Times the enclosed block as a span of the trace (see instrument.py)
+    def span(self, name):
+        if self.trace is None:
+            return contextlib.nullcontext()
+        return self.trace.span(name)
+
+    # Closes the ports and the audio input
+    def close(self):
+        self.port.close()
+        if self.port_in is not None and self.port_in is not self.port:
+            self.port_in.close()
+        self.audio_in.close()
+        if self.archive is not None:
+            self.archive.close()
+
+    ######## Recording ########
+
+    # Records a sample from the audio input
+    def record_sample(self, duration):
+        return self.audio_in.record(duration)
+
+    # Required standard error (cents) of a measurement that has so far yielded
+    # the frequency f. Close to the target, where the measurement decides the
+    # tuned DAC value, a fraction of the tolerance is required. Further away,
+    # the measurement only has to tell on which side of the target it lies,
+    # up to CAPTURE_COARSE_PRECISION. Measurements without a target (ex. drift
+    # references) are always taken at the precision close to the target.
+    def capture_precision(self, f):
+        fine = self.tolerance_for(self.note) * CAPTURE_PRECISION
+        if self.target_freq is None or not np.isfinite(f):
+            return fine
+        distance = abs(error_in_cents(self.target_freq, f))
+        return min(max(fine, distance / CAPTURE_DISTANCE_RATIO), max(fine, CAPTURE_COARSE_PRECISION))
+
+    # Records a sample beginning at the absolute sample index start that is
+    # just long enough for the required precision (see capture_precision).
+    # The first window covers CAPTURE_MIN_PERIODS periods of the target note.
+    # As long as the standard error of the sample (see pitch.period_stats) is
+    # too large, the sample is extended by the part of the input stream that
+    # directly follows it, to the length at which the standard error (falling
+    # with the number of periods) is expected to suffice. Captures are limited
+    # to CAPTURE_MAX_DURATION.
+    def record_adaptive(self, start):
+        freq = self.target_freq if self.target_freq is not None else midi_note_to_freq(OSC_MIN_NOTE)
+        n = int(max(CAPTURE_MIN_PERIODS / freq, CAPTURE_MIN_DURATION) * RECORD_SAMPLE_RATE)
+        n_max = int(CAPTURE_MAX_DURATION * RECORD_SAMPLE_RATE)
+        sample = self.audio_in.record(n / RECORD_SAMPLE_RATE, start)
+
+        while len(sample) < n_max:
+            f, stderr = pitch.period_stats(sample, RECORD_SAMPLE_RATE)
+            precision = self.capture_precision(f)
+            if stderr <= precision:
+                break
+            growth = min(stderr / precision, CAPTURE_MAX_GROWTH)
+            n = int(len(sample) * growth) + int(CAPTURE_MIN_DURATION * RECORD_SAMPLE_RATE)
+            n = min(n, n_max) - len(sample)
+            more = self.audio_in.record(n / RECORD_SAMPLE_RATE, start + len(sample))
+            sample = np.concatenate([sample, more])
+
+        return sample
+
+    # Formats the capture counters of the audio input
+    def capture_info(self):
+        stats = self.audio_in.stats()
+        return "Captured frames: {}\tOverruns: {}\tDropped frames: {}\tMeasured: {:.1f}s".format(
+            stats["frames"], stats["overruns"], stats["dropped"], self.record_time
+        )
+
+    ######## Frequency Analysis ########
+
+    # Determines the frequency of a sample
+    def get_freq(self, sample):
+        t = time.perf_counter()
+        f = self.freq_estimator(sample, RECORD_SAMPLE_RATE)
+        self.analyze_time += time.perf_counter() - t
+        return f
+
+    ######## DAC ########
+
+    # Sets the DAC value via sysex.
+    # Unless settle is False, waits for the DAC and oscillator to settle.
+    def set_dac(self, value, settle=True):
+        self.discard_speculative()
+        if not settle:
+            self.port.send(transport.set_dac_msg(value))
+            return
+        _, settle_time = self.send_dac(value)
+        self.wait(settle_time)
+
+    # Sends a DAC value without waiting for the oscillator to settle.
+    # Returns the sample index of the audio input from which on the value
+    # has been set and the time (seconds) the oscillator takes to settle
+    # after it, which is shorter if the Dampflog acknowledged it (see synced).
+    # With deferred, a SYNC is sent along but its acknowledgement isn't
+    # waited for, the settle time is then None (see deferred_settle_time).
+    def send_dac(self, value, deferred=False):
+        self.port.send(transport.set_dac_msg(value))
+        if deferred and self.sync and self.port_in is not None:
+            self.port.send(transport.sync_msg())
+            return self.audio_in.mark(), None
+        if self.synced():
+            return self.audio_in.mark(), SYNC_SETTLE_TIME
+        return self.audio_in.mark(), MIDO_WAIT_TIME
+
+    # With sync, waits until the Dampflog has handled all messages sent so
+    # far (see transport.sync). Returns whether it has, False if sync is
+    # disabled or unavailable. Sync is disabled if the Dampflog doesn't
+    # acknowledge (ex. older firmware).
+    # The longest round trip observed is kept in sync_latency.
+    def synced(self):
+        if not self.sync or self.port_in is None:
+            return False
+        t_start = self.clock()
+        if transport.sync(self.port, self.port_in, self.wait, self.clock):
+            self.sync_latency = max(self.sync_latency, self.clock() - t_start)
+            return True
+        self.log("No acknowledgement of SYNC received, falling back to fixed waits")
+        self.sync = False
+        return False
+
+    # Waits for the acknowledgement of the SYNC sent along with a deferred DAC
+    # value (see send_dac). Returns the time (seconds) the oscillator takes to
+    # settle, counted from when the value was sent: the DAC has been set at
+    # most one round trip (sync_latency) after it if acknowledged.
+    def deferred_settle_time(self):
+        if self.wait_for_ack(SYSEX_SYNC) == SYSEX_ACK_OK:
+            return self.sync_latency + SYNC_SETTLE_TIME
+        self.log("No acknowledgement of SYNC received, falling back to fixed waits")
+        self.sync = False
+        return MIDO_WAIT_TIME
+
+    ######## MIDI to DAC Look-up Table ########
+
+    def write_dac(self, note, value):
+        self.port.send(transport.write_lut_entry_msg(note, value))
+        if not self.synced():
+            self.wait(MIDO_WAIT_TIME)
+
+    # Waits for the Dampflog to acknowledge a sysex command.
+    # Returns the status of the acknowledgement, or None on timeout.
+    def wait_for_ack(self, cmd, timeout=SYSEX_ACK_TIMEOUT):
+        return transport.wait_for_ack(self.port_in, cmd, self.wait, self.clock, timeout)
+
+    # Writes up to SYSEX_LUT_BLOCK_MAX_ENTRIES consecutive LUT entries with a single sysex message.
+    # Returns the status of the acknowledgement, or None if none was received.
+    def write_dac_block(self, first, values):
+        self.port.send(transport.write_lut_block_msg(first, values))
+
+        if self.port_in is None:
+            self.wait(LUT_BLOCK_WAIT_TIME)
+            return None
+
+        return self.wait_for_ack(SYSEX_WRITE_MIDI_2_DAC_LUT_BLOCK)
+
+    # Reads up to SYSEX_LUT_BLOCK_MAX_ENTRIES consecutive LUT entries from the device.
+    # Returns the values, or None if the device didn't reply.
+    def read_dac_block(self, first, count, timeout=SYSEX_ACK_TIMEOUT):
+        self.port.send(transport.read_lut_msg(first, count))
+
+        deadline = self.clock() + timeout
+        while self.clock() < deadline:
+            msg = self.port_in.poll()
+            if msg is None:
+                self.wait(0.001)
+                continue
+
+            try:
+                values = transport.parse_lut_dump(msg, first, count)
+            except ValueError:
+                return None
+            if values is not None:
+                return values
+        return None
+
+    # Reads the complete MIDI to DAC LUT from the device.
+    # Returns None if the device can't be read back.
+    def read_lut(self):
+        with self.span("readback"):
+            if self.port_in is None:
+                return None
+
+            lut = []
+            for first in range(0, MAX_MIDI_NOTE + 1, SYSEX_LUT_BLOCK_MAX_ENTRIES):
+                count = min(SYSEX_LUT_BLOCK_MAX_ENTRIES, MAX_MIDI_NOTE + 1 - first)
+                values = self.read_dac_block(first, count)
+                if values is None:
+                    return None
+                lut += values
+            return lut
+
+    # Uploads a complete MIDI to DAC LUT in blocks. If the LUT currently stored
+    # on the device is known, only entries that differ from it are written.
+    # Blocks are only written while the device acknowledges them, as it's
+    # otherwise unknown whether the firmware supports them. Without
+    # acknowledgements, the entries are written one by one instead.
+    # Returns the number of entries written.
+    def upload_lut(self, lut, current=None):
+        with self.span("upload"):
+            n_written = 0
+            for first, last in lut_diff_ranges(lut, current):
+                for start in range(first, last + 1, SYSEX_LUT_BLOCK_MAX_ENTRIES):
+                    values = lut[start:min(start + SYSEX_LUT_BLOCK_MAX_ENTRIES, last + 1)]
+
+                    if self.port_in is not None and not self.no_block_ack:
+                        for attempt in range(3):
+                            status = self.write_dac_block(start, values)
+                            if status != SYSEX_ACK_BAD_CHECKSUM:
+                                break
+
+                        if status is None:
+                            self.log("No acknowledgement of LUT block received, writing single entries")
+                            self.no_block_ack = True
+                        elif status != SYSEX_ACK_OK:
+                            raise RuntimeError("Failed to write LUT entries {}-{} (status {})".format(start, start + len(values) - 1, status))
+
+                    if self.port_in is None or self.no_block_ack:
+                        for i, value in enumerate(values):
+                            self.write_dac(start + i, value)
+
+                    n_written += len(values)
+
+            return n_written
+
+    ######## GATE ########
+
+    # Sets the gate via sysex
+    def set_gate(self, value):
+        self.port.send(transport.set_gate_msg(value))
+        if value:
+            self.cache.clear()
+            self.discard_speculative()
+
+    ######## Settle Detection ########
+
+    # Streams windows of SETTLE_WINDOW seconds from the audio input until the
+    # frequencies of SETTLE_WINDOWS consecutive windows agree within
+    # SETTLE_TOLERANCE cents, or the timeout (seconds) has passed.
+    # Returns the frequency of the agreeing windows, the settle time, i.e.
+    # the time that passed before the first of these windows began, and the
+    # agreeing windows themselves.
+    def measure_settled(self, timeout):
+        windows = []
+        freqs = []
+        max_windows = max(int(round(timeout / SETTLE_WINDOW)), SETTLE_WINDOWS)
+
+        while len(windows) < max_windows:
+            windows.append(self.audio_in.read(SETTLE_WINDOW))
+            freqs.append(self.get_freq(windows[-1]))
+
+            if len(freqs) >= SETTLE_WINDOWS:
+                recent = freqs[-SETTLE_WINDOWS:]
+                if error_in_cents(min(recent), max(recent)) <= SETTLE_TOLERANCE:
+                    break
+
+        sample = np.concatenate(windows[-SETTLE_WINDOWS:])
+        settle_time = (len(windows) - SETTLE_WINDOWS) * SETTLE_WINDOW
+        _, self.last_uncertainty = pitch.period_stats(sample, RECORD_SAMPLE_RATE)
+        return self.get_freq(sample), settle_time, sample
+
+    # Formats the settle times observed since the given index of settle_times
+    def settle_info(self, start):
+        if not self.adaptive_settle or len(self.settle_times) <= start:
+            return ""
+        recent = self.settle_times[start:]
+        return "\tSettle (ms): {:.0f} avg, {:.0f} max".format(1000 * np.mean(recent), 1000 * np.max(recent))
+
+    # Formats the cache hits of the current pass
+    def cache_info(self):
+        if self.cache_ttl is None:
+            return ""
+        return "\tCache hits: {}".format(self.cache_hits)
+
+    # Formats the measurements per second of the current pass, which took
+    # elapsed seconds. With pipelining, the rate of the sequential loop is
+    # given for comparison, i.e. as if every speculatively sent DAC value had
+    # only been sent after the analysis of the previous measurement.
+    def rate_info(self, elapsed):
+        info = "\tMeasurements/s: {:.2f}".format(self.n_measurements / max(elapsed, 1e-9))
+        if not self.pipeline:
+            return info
+        return info + " (sequential: {:.2f})\tSpeculative probes: {} used, {} discarded".format(
+            self.n_measurements / max(elapsed + self.overlap_time, 1e-9),
+            self.speculative_hits, self.speculative_misses
+        )
+
+    ######## Pipelining ########
+
+    # Sends the DAC value the search will most likely measure next, before
+    # the current capture is analyzed. The DAC and oscillator settle while the
+    # host analyzes the capture and decides, instead of only afterwards. If
+    # the search measures the value next, its settling time is already
+    # partially over (see msr_after_dac_chng), otherwise the value is
+    # discarded by the next DAC command.
+    # With sync, the acknowledgement isn't waited for here, which would
+    # delay the analysis, but only before the value is measured.
+    def speculate(self, value):
+        if value < 0 or value > MAX_DAC_VAL:
+            return
+        self.discard_speculative()
+        sent, settle_time = self.send_dac(value, deferred=True)
+        self.speculative = (value, self.clock(), sent, settle_time)
+
+    # Discards a speculatively sent DAC value that hasn't been measured.
+    # Its acknowledgement is consumed, so it isn't taken for the one of a
+    # later SYNC.
+    def discard_speculative(self):
+        if self.speculative is not None:
+            self.speculative_misses += 1
+            if self.speculative[3] is None:
+                self.deferred_settle_time()
+            self.speculative = None
+
+    ######## Tuning ########
+
+    # Waits for the oscillator to settle after the GATE has been opened.
+    # Returns the time it took.
+    def settle_oscillator(self):
+        with self.span("startup settle"):
+            self.log("Waiting for oscillator to settle...")
+            if not self.adaptive_settle:
+                self.wait(OSC_STARTUP_SETTLE_TIME)
+                return OSC_STARTUP_SETTLE_TIME
+
+            _, settle_time, _ = self.measure_settled(OSC_STARTUP_SETTLE_TIME)
+            self.log("Oscillator settled after {:.2f}s".format(settle_time))
+            return settle_time
+
+    # Measures the frequency after a DAC value change.
+    # Measurements begin after the attack time has passed
+    # The duration determines how long the sample to be measured is.
+    # With adaptive settling, the measurement is taken as soon as the
+    # oscillator has settled instead (see measure_settled).
+    # With a cache_ttl, a measurement of the same DAC value taken within the
+    # last cache_ttl seconds is returned without touching the DAC, unless
+    # fresh is set. Cache hits aren't counted as measurements.
+    # With pipelining, the DAC value the caller expects to measure next
+    # (next_value) is sent right after the capture, before it is analyzed
+    # (see speculate). If value has been sent that way by the previous
+    # measurement, it isn't sent again and the capture begins relative to
+    # when it was sent. This overlaps only the analysis of the capture with
+    # the DAC settling, which takes about 0.5 ms with the default estimator
+    # against ~0.4 s of settling and recording, so the measurement rate
+    # hardly changes, while a discarded value costs a MIDI message.
+    def msr_after_dac_chng(self, value, attack, duration, fresh=False, next_value=None):
+        if self.cache_ttl is not None and not fresh:
+            cached = self.cache.get(value)
+            if cached is not None and self.clock() - cached[0] <= self.cache_ttl:
+                self.cache_hits += 1
+                _, f, self.last_uncertainty = cached
+                # Counted once for a note, repeated hits aren't new measurements
+                if self.note is not None:
+                    captures = self.captures.setdefault(self.note, {}).setdefault(value, [])
+                    if not captures:
+                        captures.append((error_in_cents(self.target_freq, f), self.last_uncertainty))
+                return f
+
+        self.n_measurements += 1
+        t_start = self.clock()
+        analyze_start = self.analyze_time
+
+        if self.adaptive_settle:
+            self.audio_in.flush()
+            self.set_dac(value, settle=False)
+            t_sent = self.clock()
+            f, settle_time, sample = self.measure_settled(SETTLE_TIMEOUT)
+            self.settle_times.append(settle_time)
+            capture_time = SETTLE_WINDOWS * SETTLE_WINDOW
+        else:
+            # The sample is taken relative to when the DAC command was sent,
+            # instead of sleeping on the host
+            if self.speculative is not None and self.speculative[0] == value:
+                _, t_sent, sent, dac_settle = self.speculative
+                self.speculative = None
+                self.speculative_hits += 1
+                if dac_settle is None:
+                    dac_settle = self.deferred_settle_time()
+                self.overlap_time += t_start - t_sent
+            else:
+                self.discard_speculative()
+                sent, dac_settle = self.send_dac(value)
+                t_sent = self.clock()
+            start = sent + int((dac_settle + attack) * RECORD_SAMPLE_RATE)
+            if self.adaptive_capture:
+                sample = self.record_adaptive(start)
+            else:
+                sample = self.audio_in.record(duration, start)
+            capture_time = len(sample) / RECORD_SAMPLE_RATE
+            settle_time = max(self.clock() - t_sent - capture_time, 0)
+            if self.pipeline and next_value is not None:
+                self.speculate(next_value)
+            f = self.get_freq(sample)
+            _, self.last_uncertainty = pitch.period_stats(sample, RECORD_SAMPLE_RATE)
+
+        self.record_time += capture_time
+        self.measured_points.append((value, f))
+        self.cache[value] = (self.clock(), f, self.last_uncertainty)
+        if self.archive is not None:
+            self.archive.add(sample, value, f, self.note, self.phase, t_sent)
+        if self.note is not None:
+            captures = self.captures.setdefault(self.note, {}).setdefault(value, [])
+            captures.append((error_in_cents(self.target_freq, f), self.last_uncertainty))
+
+        if self.trace is not None:
+            error = None
+            if self.target_freq is not None:
+                error = error_in_cents(self.target_freq, f)
+            self.trace.add(
+                self.note, self.phase, value, f, error,
+                t_sent - t_start, settle_time, capture_time, self.analyze_time - analyze_start
+            )
+
+        return f
+
+    # Measures the frequencies of several DAC values within one continuous
+    # recording. Every value is sent right before its part of the input stream
+    # is read and held for sweep_dwell seconds, so the recording is segmented by the
+    # sample counts read per value. The first guard seconds of every segment are
+    # skipped, the rest is evaluated at once by pitch.segment_freqs.
+    # This avoids the fixed wait and recording of every single measurement (see
+    # msr_after_dac_chng), at the cost of shorter, less precise captures.
+    # Returns the frequencies of the values.
+    def sweep_capture(self, values, guard=SWEEP_GUARD):
+        dwell = self.sweep_dwell
+        if guard >= dwell:
+            raise ValueError("Sweep guard time must be shorter than the dwell time")
+
+        self.n_measurements += len(values)
+        analyze_start = self.analyze_time
+        send_time = 0.0
+
+        self.audio_in.flush()
+        chunks = []
+        bounds = [0]
+        for value in values:
+            t = self.clock()
+            self.set_dac(value, settle=False)
+            send_time += self.clock() - t
+            chunks.append(np.ravel(self.audio_in.read(dwell)))
+            bounds.append(bounds[-1] + len(chunks[-1]))
+
+        t = time.perf_counter()
+        freqs, stderrs = pitch.segment_freqs(
+            np.concatenate(chunks), bounds, RECORD_SAMPLE_RATE, int(guard * RECORD_SAMPLE_RATE)
+        )
+        self.analyze_time += time.perf_counter() - t
+
+        self.add_sweep_points(values, freqs, stderrs, send_time, guard, dwell, analyze_start)
+        return freqs
+
+    # Sends a DAC staircase command (see handle_staircase() in src/main.c),
+    # which makes the Dampflog step the DAC from start towards end by stride
+    # every dwell seconds on its own timer. The audio is read in chunks of
+    # STAIRCASE_POLL seconds while waiting for the acknowledgement and the
+    # completion of the staircase, whose positions in the recording give a
+    # first estimate of the step schedule. The schedule is then aligned to the
+    # pitch steps in the recording (see pitch.align_steps), as both the MIDI
+    # latency and the clock of the Dampflog are only known roughly.
+    # Unlike sweep_capture, the timing of the steps doesn't depend on the host.
+    # Returns the DAC values and their frequencies, or None if the Dampflog
+    # didn't acknowledge the command (ex. older firmware or no MIDI input).
+    # Without dwell, every step is held long enough for STAIRCASE_MIN_PERIODS
+    # periods of the lowest note (see staircase_dwell).
+    def staircase_capture(self, start, end, stride, dwell=None, guard=STAIRCASE_GUARD):
+        if dwell is None:
+            dwell = staircase_dwell(OSC_MIN_NOTE, guard)
+        if guard >= dwell:
+            raise ValueError("Staircase guard time must be shorter than the dwell time")
+        if self.port_in is None:
+            return None
+
+        direction = 1 if end >= start else -1
+        values = list(range(start, end + direction, direction * stride))
+        n = len(values)
+        msg = transport.staircase_msg(start, end, stride, int(round(dwell * 1000)))
+
+        t_start = self.clock()
+        analyze_start = self.analyze_time
+
+        self.discard_speculative()
+        self.audio_in.flush()
+        self.port.send(msg)
+        send_time = self.clock() - t_start
+
+        # Positions (samples) in the recording at which the replies arrived
+        acked = None
+        done = None
+        chunks = []
+        n_read = 0
+        max_read = (n * dwell + SYSEX_ACK_TIMEOUT) * RECORD_SAMPLE_RATE
+        while done is None and n_read < max_read:
+            chunks.append(np.ravel(self.audio_in.read(STAIRCASE_POLL)))
+            n_read += len(chunks[-1])
+
+            while True:
+                reply = self.port_in.poll()
+                if reply is None:
+                    break
+                status = transport.ack_status(reply, SYSEX_DAC_STAIRCASE)
+                if status is not None:
+                    if status != SYSEX_ACK_OK:
+                        raise RuntimeError("Failed to start DAC staircase (status {})".format(status))
+                    acked = n_read
+                elif transport.is_staircase_done(reply):
+                    done = n_read
+
+            if acked is None and n_read >= SYSEX_ACK_TIMEOUT * RECORD_SAMPLE_RATE:
+                self.log("DAC staircase not acknowledged")
+                return None
+
+        if done is None:
+            raise RuntimeError("DAC staircase didn't complete")
+
+        self.n_measurements += n
+        capture_time = self.clock() - t_start - send_time
+        sample = np.concatenate(chunks)
+
+        t = time.perf_counter()
+        # The staircase began before the acknowledgement was read
+        poll = STAIRCASE_POLL * RECORD_SAMPLE_RATE
+        offset, length = pitch.align_steps(sample, n, max(acked - poll, 0), (done - acked) / n)
+        bounds = offset + length * np.arange(n + 1)
+        freqs, stderrs = pitch.segment_freqs(sample, bounds, RECORD_SAMPLE_RATE, int(guard * RECORD_SAMPLE_RATE))
+        self.analyze_time += time.perf_counter() - t
+
+        self.log("DAC staircase: {} steps in {:.2f}s, step length {:.2f}ms".format(
+            n, capture_time, 1000 * length / RECORD_SAMPLE_RATE
+        ))
+
+        self.add_sweep_points(values, freqs, stderrs, send_time, guard, dwell, analyze_start)
+        return values, freqs
+
+    # Records the points measured by a sweep (see sweep_capture and
+    # staircase_capture), same as msr_after_dac_chng does for single ones.
+    # The send and analysis time are split evenly among the points.
+    def add_sweep_points(self, values, freqs, stderrs, send_time, guard, dwell, analyze_start):
+        n = max(len(values), 1)
+        analyze_time = (self.analyze_time - analyze_start) / n
+        self.record_time += len(values) * (dwell - guard)
+        for value, f, stderr in zip(values, freqs, stderrs):
+            self.measured_points.append((value, f))
+            error = None
+            if self.target_freq is not None:
+                error = error_in_cents(self.target_freq, f)
+                self.captures.setdefault(self.note, {}).setdefault(value, []).append((error, stderr))
+            if self.trace is not None:
+                self.trace.add(
+                    self.note, self.phase, value, f, error,
+                    send_time / n, guard, dwell - guard, analyze_time
+                )
+
+    # Attempts to find a DAC value that produces a frequency close to the target frequency
+    # with the given step size.
+    # Returns the DAC value afer execution, the overshoot (Hz), and the undershoot (Hz)
+    def dac_target_freq(self, start, step, target_freq):
+        dac_val = start
+        prev_f = 0
+
+        while True:
+            # The walk most likely continues, see speculate
+            next_value = dac_val + step if dac_val + step < MAX_DAC_VAL else None
+            if dac_val == start:
+                prev_f = self.msr_after_dac_chng(dac_val, ATTACK_TIME, RECORD_DURATION, next_value=next_value)
+            else:
+                f = self.msr_after_dac_chng(dac_val, ATTACK_TIME, RECORD_DURATION, next_value=next_value)
+
+                if (step > 0 and f > target_freq) or (step < 0 and f < target_freq):
+                    overshoot_error = error_in_cents(target_freq, f)
+                    undershoot_error = error_in_cents(target_freq, prev_f)
+                    return dac_val, overshoot_error, undershoot_error
+
+                prev_f = f
+            dac_val += step
+
+            if dac_val == MAX_DAC_VAL:
+                break
+
+        return None
+
+    # Performs a coarse, then fine tune to find a DAC value that produces a frequency
+    # close to the target frequency.
+    # Returns the DAC value that yields the closest frequency to the target frequency
+    # and the error in cents.
+    def coarse_fine_tune(self, start, coarse_step, fine_step, target_freq):
+        incr = True
+        self.phase = "coarse"
+        start_f = self.msr_after_dac_chng(start, ATTACK_TIME, RECORD_DURATION)
+
+        if start_f > target_freq:
+            incr = False
+            coarse_step = -coarse_step
+
+        dac_val, overshoot, undershoot = self.dac_target_freq(
+            start, coarse_step, target_freq
+        )
+
+        overshot = abs(overshoot) < abs(undershoot)
+
+        if (incr and overshot) or (not incr and not overshot):
+            fine_step = -fine_step
+
+        if not overshot:
+            dac_val -= coarse_step
+
+        self.phase = "fine"
+        dac_val, overshoot, undershoot = self.dac_target_freq(
+            dac_val, fine_step, target_freq
+        )
+
+        if abs(overshoot) > abs(undershoot):
+            dac_val -= fine_step
+            error = undershoot
+        else:
+            error = overshoot
+
+        return dac_val, error
+
+    # Finds the DAC value that produces a frequency close to the target frequency
+    # by treating frequency vs. DAC value as monotonically increasing.
+    #
+    # All errors are handled in cents (i.e. log-frequency), where the response
+    # is close to linear. Starting from the start value and an initial step guess,
+    # secant steps are taken until the target is bracketed. The bracket is then
+    # narrowed using regula falsi, falling back to bisection whenever an iteration
+    # fails to halve the bracket. The search ends as soon as the error is within
+    # the tolerance (cents) or the bracket is only one DAC step wide.
+    #
+    # With pipelining, the value the search would take next if the current
+    # measurement matched the prediction of the points measured so far (see
+    # secant_prediction) is sent before the measurement is analyzed.
+    #
+    # Returns the DAC value that yields the closest frequency to the target frequency
+    # and the error in cents.
+    def secant_tune(self, start, step, target_freq, tolerance):
+        search = {
+            "errors": {},       # DAC value -> error in cents
+            "lo": None,         # Largest DAC value known to be below the target
+            "hi": None,         # Smallest DAC value known to be above the target
+            "prev": None,
+            "prev_width": None,
+            "step": max(abs(step), 1),
+        }
+        errors = search["errors"]
+        dac_val = start
+
+        while len(errors) < SECANT_MAX_MEASUREMENTS:
+            self.phase = "bracket" if search["lo"] is None or search["hi"] is None else "refine"
+            next_value = None
+            if self.pipeline and len(errors) + 1 < SECANT_MAX_MEASUREMENTS:
+                predicted = secant_prediction(search, dac_val)
+                if predicted is not None and abs(predicted) > tolerance:
+                    next_value = secant_step(dict(search, errors=dict(errors)), dac_val, predicted)
+            f = self.msr_after_dac_chng(dac_val, ATTACK_TIME, RECORD_DURATION, next_value=next_value)
+            err = error_in_cents(target_freq, f)
+
+            if abs(err) <= tolerance:
+                errors[dac_val] = err
+                break
+
+            nxt = secant_step(search, dac_val, err)
+            if nxt is None or nxt in errors:
+                break
+            dac_val = nxt
+
+        dac_val = min(errors, key=lambda v: abs(errors[v]))
+        return dac_val, errors[dac_val]
+
+    # Tunes a single note using the selected tuning strategy.
+    # The coarse step is used as initial guess for the distance from start
+    # to the target DAC value.
+    # Returns the DAC value and the error in cents.
+    def tune_note(self, start, coarse_step, fine_step, target_freq):
+        if self.strategy == "secant":
+            return self.secant_tune(start, coarse_step, target_freq, self.tolerance_for(self.note))
+        return self.coarse_fine_tune(start, coarse_step, fine_step, target_freq)
+
+    # Tolerance (cents) of a note
+    def tolerance_for(self, note):
+        return self.tolerances.get(note, self.tolerance)
+
+    # Sets the note the following measurements belong to (see trace)
+    def select_note(self, note):
+        self.note = note
+        self.target_freq = None if note is None else midi_note_to_freq(note)
+
+    # Records the result of a tuned note in results and prints it.
+    # n_start, s_start and t_start are the measurement count, settle time
+    # count and time at which tuning the note began.
+    def note_result(self, note, dac_val, error, n_start, s_start, t_start, **extra):
+        _, ci, n_captures = self.capture_stats(note, dac_val)
+        result = {
+            "note": note,
+            "name": midi_note_to_name_oct(note),
+            "dac": int(dac_val),
+            "error": float(error),
+            "ci": float(ci) if np.isfinite(ci) else None,
+            "captures": n_captures,
+            "measurements": self.n_measurements - n_start,
+            "time": self.clock() - t_start,
+        }
+        result.update(extra)
+        self.results.append(result)
+
+        dac_info = "{}".format(dac_val)
+        if "stored_dac" in extra:
+            dac_info = "{} -> {}".format(extra["stored_dac"], dac_val)
+
+        ci_info = ""
+        if result["ci"] is not None:
+            ci_info = " ± {:.2f}".format(ci)
+
+        self.log(
+            "MIDI note: {} ({})   \tDAC value: {} \tError (cents): {}{}\tMeasurements: {}{}".format(
+                result["name"], note, dac_info, error, ci_info, result["measurements"], self.settle_info(s_start)
+            )
+        )
+        return result
+
+    # Combines all measurements of a note at a DAC value.
+    # With three or more measurements, outliers further than
+    # pitch.OUTLIER_THRESHOLD median absolute deviations off the median are
+    # rejected. The confidence interval accounts for both the uncertainty of
+    # the individual measurements and the scatter between them.
+    # Returns the mean error (cents), the half width of its confidence interval
+    # (cents) and the number of measurements used (NaN, inf, 0 if unmeasured).
+    def capture_stats(self, note, dac_val):
+        captures = self.captures.get(note, {}).get(dac_val, [])
+        captures = [c for c in captures if np.isfinite(c[0])]
+        if not captures:
+            return np.nan, np.inf, 0
+
+        errors = np.array([c[0] for c in captures])
+        stderrs = np.array([c[1] for c in captures])
+
+        if len(errors) >= 3:
+            median = np.median(errors)
+            mad = pitch.MAD_TO_STD * np.median(np.abs(errors - median))
+            if mad > 0:
+                inliers = np.abs(errors - median) <= pitch.OUTLIER_THRESHOLD * mad
+                errors, stderrs = errors[inliers], stderrs[inliers]
+
+        n = len(errors)
+        stderr = np.sqrt(np.mean(stderrs ** 2) / n)
+        if n >= 2:
+            stderr = max(stderr, np.std(errors, ddof=1) / np.sqrt(n))
+        return np.mean(errors), CONFIDENCE_Z * stderr, n
+
+    ######## Drift Tracking ########
+
+    # Remeasures the reference DAC value if drift_interval seconds have passed
+    # since the last reference measurement (or if force is set). The drift is
+    # the pitch of the reference relative to its first measurement, in cents.
+    def track_drift(self, force=False):
+        if self.drift_interval is None or self.drift_ref_dac is None:
+            return
+        if not force and self.drift_points and self.clock() - self.drift_points[-1][0] < self.drift_interval:
+            return
+
+        note, phase = self.note, self.phase
+        self.select_note(None)
+        self.phase = "drift"
+        f = self.msr_after_dac_chng(self.drift_ref_dac, ATTACK_TIME, RECORD_DURATION, fresh=True)
+        self.select_note(note)
+        self.phase = phase
+
+        if self.drift_ref_freq is None:
+            self.drift_ref_freq = f
+        self.drift_points.append((self.clock(), error_in_cents(self.drift_ref_freq, f)))
+
+    # Corrects the results of a tuning pass for the drift tracked during it.
+    # The drift model (see drift.py) is fitted to the reference measurements,
+    # every note is then shifted by the drift between the time it was tuned
+    # (tuned_at, note -> time) and the end of the pass, using the slope (cents
+    # per DAC value) to its neighbouring notes. The applied drift is stored as
+    # "drift" in the results.
+    def correct_drift(self, tuned_at):
+        self.track_drift(force=True)
+        if len(self.drift_points) < 2:
+            return
+
+        t, cents = zip(*self.drift_points)
+        model = drift.fit_drift(t, cents)
+        t_end = t[-1]
+        d_end = model(t_end)
+
+        results = sorted(self.results, key=lambda r: r["note"])
+
+        # Slope to the next note. Notes at DAC value 0 lie below the transistors
+        # operating region, where the slope is unknown.
+        slopes = []
+        for a, b in zip(results[:-1], results[1:]):
+            if a["dac"] > 0 and b["dac"] > a["dac"]:
+                slopes.append(100 * (b["note"] - a["note"]) / (b["dac"] - a["dac"]))
+            else:
+                slopes.append(np.nan)
+
+        n_corrected = 0
+        for i, r in enumerate(results):
+            # The steeper slope of both neighbours, as the slope between
+            # distant DAC values is too flat
+            candidates = [v for v in slopes[max(i - 1, 0):i + 1] if np.isfinite(v)]
+            if not candidates:
+                continue
+            slope = max(candidates)
+
+            shift = float(d_end - model(tuned_at[r["note"]]))
+            r["drift"] = shift
+            dac_val = int(min(max(round(r["dac"] - shift / slope), 0), MAX_DAC_VAL))
+            if dac_val == r["dac"]:
+                continue
+
+            r["error"] = float(r["error"] + shift + slope * (dac_val - r["dac"]))
+            self.log("Drift corrected {}: DAC value {} -> {}\tDrift (cents): {:+.2f}".format(
+                r["name"], r["dac"], dac_val, shift
+            ))
+            r["dac"] = dac_val
+            n_corrected += 1
+
+        self.log("Drift: {:+.2f} cents over {:.0f}s ({} reference measurements), corrected {} notes".format(
+            d_end - model(t[0]), t_end - t[0], len(t), n_corrected
+        ))
+
+    # Returns the DAC value the step table predicts for a note
+    def expected_dac(self, step_table, note):
+        return min(sum(step_table[:note - OSC_MIN_NOTE + 1]), MAX_DAC_VAL)
+
+    ######## Range Discovery ########
+
+    # Returns the lowest and highest note that the modelled response (see
+    # response.py) reaches within the tolerance of the note, or None if it
+    # reaches none. As the response is flat below the transistors operating
+    # region and saturates above it, the range is given by its ends.
+    def usable_range(self, model):
+        curve = response.response_curve(model)
+        usable = [
+            note for note in range(MAX_MIDI_NOTE + 1)
+            if curve[0] - self.tolerance_for(note) <= response.midi_note_to_cents(note) <= curve[-1] + self.tolerance_for(note)
+        ]
+        if not usable:
+            self.log("No note lies within the range of the oscillator")
+            return None
+
+        self.log("Usable range: {} ({}) - {} ({})".format(
+            midi_note_to_name_oct(usable[0]), usable[0], midi_note_to_name_oct(usable[-1]), usable[-1]
+        ))
+        return usable[0], usable[-1]
+
+    # Discovers the range of the oscillator from RANGE_PROBES evenly spaced
+    # DAC values, including both ends of the DAC range, instead of walking up
+    # to MAX_DAC_VAL. Expects the GATE to be open.
+    # Returns the usable range, see usable_range.
+    def discover_range(self):
+        self.log("Discovering range...")
+        self.select_note(None)
+        self.phase = "discover"
+        dac = [int(v) for v in np.linspace(0, MAX_DAC_VAL, RANGE_PROBES)]
+        freq = [self.msr_after_dac_chng(v, ATTACK_TIME, RECORD_DURATION) for v in dac]
+        return self.usable_range(response.fit_response(dac, freq))
+
+    # Fits the response model to all points measured since the last tuning pass began
+    def fit_measured(self):
+        dac, freq = zip(*self.measured_points)
+        return response.fit_response(dac, freq)
+
+    # Tunes notes beyond OSC_MIN_NOTE to OSC_MAX_NOTE (see discover_range),
+    # for which the step table has no entries. Every note is searched with
+    # the secant strategy, starting from the DAC value solved from the response
+    # fitted to all points measured so far.
+    def tune_extended(self, notes, tuned_at):
+        solved, _ = response.solve_notes(self.fit_measured(), notes)
+
+        for note, dac_val in zip(notes, solved):
+            self.track_drift()
+            self.select_note(note)
+            t_note = self.clock()
+            n_start = self.n_measurements
+            s_start = len(self.settle_times)
+            dac_val, error = self.secant_tune(int(dac_val), RETUNE_STEP, self.target_freq, self.tolerance_for(note))
+            self.note_result(note, dac_val, error, n_start, s_start, t_note, extended=True)
+            tuned_at[note] = self.clock()
+
+        self.results.sort(key=lambda r: r["note"])
+
+    # Solves notes the oscillator can't reach (see discover_range) from the
+    # response fitted to all points measured so far, instead of searching
+    # them up to the end of the DAC range
+    def extrapolate(self, notes):
+        solved, predicted = response.solve_notes(self.fit_measured(), notes)
+
+        for note, dac_val, error in zip(notes, solved, predicted):
+            self.select_note(note)
+            self.note_result(note, dac_val, error, self.n_measurements, len(self.settle_times), self.clock(), extrapolated=True)
+
+        self.results.sort(key=lambda r: r["note"])
+
+    # Solves all notes of the LUT from the response fitted to the points
+    # measured since the last tuning pass began. Notes beyond the range of the
+    # oscillator are extrapolated to the DAC value at which it reaches its
+    # lowest/highest frequency (see response.solve_notes).
+    def fitted_lut(self):
+        solved, _ = response.solve_notes(self.fit_measured(), np.arange(MAX_MIDI_NOTE + 1))
+        return [int(v) for v in solved]
+
+    ######## Tuning Passes ########
+
+    # Performs a complete tuning pass over min_note to max_note (within
+    # OSC_MIN_NOTE to OSC_MAX_NOTE), using the given step table as initial guesses.
+    # With discover, the range of the oscillator is discovered first (see
+    # discover_range). Notes outside of it are extrapolated instead of searched
+    # (see extrapolate). If the pass covers OSC_MIN_NOTE/OSC_MAX_NOTE, the
+    # usable notes beyond them are tuned as well (see tune_extended).
+    # Opens the GATE before and closes it after the pass.
+    # Returns the per-note results (see note_result), also kept in results.
+    def tune_pass(self, step_table=STEP_TABLE, min_note=OSC_MIN_NOTE, max_note=OSC_MAX_NOTE, discover=False):
+        if min_note < OSC_MIN_NOTE or max_note > OSC_MAX_NOTE or min_note > max_note:
+            raise ValueError("Note range {}-{} outside of {}-{}".format(min_note, max_note, OSC_MIN_NOTE, OSC_MAX_NOTE))
+
+        self.reset_counters()
+        self.captures = {}
+        t_start = self.clock()
+
+        # Open/Enable GATE
+        self.set_gate(True)
+        self.log("GATE opened")
+
+        startup_settle_time = self.settle_oscillator()
+
+        # Usable notes beyond OSC_MIN_NOTE to OSC_MAX_NOTE, and notes within
+        # min_note to max_note the oscillator can't reach
+        extended = []
+        unreachable = []
+        if discover:
+            usable = self.discover_range()
+            if usable is not None and usable[0] <= max_note and usable[1] >= min_note:
+                if min_note == OSC_MIN_NOTE:
+                    extended += list(range(usable[0], OSC_MIN_NOTE))
+                if max_note == OSC_MAX_NOTE:
+                    extended += list(range(OSC_MAX_NOTE + 1, usable[1] + 1))
+                unreachable = [i for i in range(min_note, max_note + 1) if i < usable[0] or i > usable[1]]
+                min_note = max(min_note, usable[0])
+                max_note = min(max_note, usable[1])
+
+        # Time at which every note has been tuned, see correct_drift
+        tuned_at = {}
+        if self.drift_interval is not None:
+            self.drift_ref_dac = self.expected_dac(step_table, min(max(DRIFT_REFERENCE_NOTE, OSC_MIN_NOTE), OSC_MAX_NOTE))
+            self.track_drift()
+
+        self.log("Beginning tuning process...")
+
+        #####################################################
+        # Determine first note
+        #####################################################
+
+        # Determining the first note is treated as a special case because
+        # the DAC must first enter the transistors operating region, meaning
+        # the first few hundred DAC values are guaranteed to be useless.
+        # Additionally, the CV to frequency response around the first note (A#2)
+        # is very low, meaning we don't have to be very precise to tune the first note.
+
+        self.select_note(min_note)
+        t_note = self.clock()
+        n_start = self.n_measurements
+        s_start = len(self.settle_times)
+
+        if min_note == OSC_MIN_NOTE:
+            # Set DAC to 0 and give it a second to settle
+            self.phase = "startup"
+            freq = self.msr_after_dac_chng(0, 1, RECORD_DURATION)
+            dac_val = 0
+
+            # Sometimes the min. Note is already slightly greater than A#2
+            if freq >= midi_note_to_freq(OSC_MIN_NOTE):
+                error = error_in_cents(midi_note_to_freq(OSC_MIN_NOTE), freq)
+                self.note_result(OSC_MIN_NOTE, 0, error, n_start, s_start, t_note)
+                tuned_at[OSC_MIN_NOTE] = self.clock()
+                dac_val = step_table[0] # Pretend first note succeeded as second note is not as flaky
+            else:
+                dac_val, error = self.tune_note(
+                    dac_val, step_table[0], 10, midi_note_to_freq(OSC_MIN_NOTE)
+                )
+                self.note_result(OSC_MIN_NOTE, dac_val, error, n_start, s_start, t_note)
+                tuned_at[OSC_MIN_NOTE] = self.clock()
+        else:
+            # Start from where the step table expects the note,
+            # searching with the step of the previous note
+            dac_val, error = self.tune_note(
+                self.expected_dac(step_table, min_note),
+                step_table[min_note - OSC_MIN_NOTE], 1, midi_note_to_freq(min_note)
+            )
+            self.note_result(min_note, dac_val, error, n_start, s_start, t_note)
+            tuned_at[min_note] = self.clock()
+
+        #####################################################
+        # Determine remaining notes
+        #####################################################
+
+        fine_step = 1
+
+        for i in range(min_note + 1, max_note + 1):
+            self.track_drift()
+            self.select_note(i)
+            t_note = self.clock()
+            n_start = self.n_measurements
+            s_start = len(self.settle_times)
+            dac_val, error = self.tune_note(
+                dac_val, step_table[i - OSC_MIN_NOTE], fine_step, midi_note_to_freq(i)
+            )
+            self.note_result(i, dac_val, error, n_start, s_start, t_note)
+            tuned_at[i] = self.clock()
+
+        if extended:
+            self.tune_extended(extended, tuned_at)
+
+        if self.drift_interval is not None:
+            self.correct_drift(tuned_at)
+
+        if unreachable:
+            self.extrapolate(unreachable)
+
+        n_notes = len(self.results)
+        self.log(
+            "Strategy: {}\tTotal measurements: {}\tAverage per note: {:.1f}\tTime: {:.1f}s{}".format(
+                self.strategy, self.n_measurements, self.n_measurements / n_notes, self.clock() - t_start,
+                self.cache_info() + self.rate_info(self.clock() - t_start)
+            )
+        )
+
+        self.log(self.capture_info())
+
+        if self.adaptive_settle:
+            self.log(
+                "Settle time: {:.1f}s\tFixed waits would have taken: {:.1f}s".format(
+                    startup_settle_time + sum(self.settle_times),
+                    OSC_STARTUP_SETTLE_TIME + len(self.settle_times) * MIDO_WAIT_TIME
+                )
+            )
+
+        self.set_gate(False)
+        self.log("GATE closed")
+
+        return self.results
+
+    # Tunes min_note to max_note by measuring a sparse sweep of DAC values and
+    # fitting the response model to it (see response.py), instead of searching
+    # every note. After FIT_INITIAL_POINTS evenly spaced DAC values, further
+    # points are placed where the response bends, until the model is resolved
+    # within FIT_INTERVAL_TOLERANCE or max_points have been measured.
+    # All notes are then solved from the model at once.
+    # With sweep, the DAC values are measured in batches by sweep_capture,
+    # starting with SWEEP_INITIAL_POINTS evenly spaced values. The captures are
+    # less precise, but many more points can be measured in the same time.
+    # With staircase, the first sweep is stepped by the Dampflog itself
+    # instead (see staircase_capture), further values are swept as above.
+    # With verify (default), every note is measured once at its solved DAC value
+    # and searched with the selected strategy if it is off by more than the
+    # tolerance. Without it, single noisy points can put notes of the steep
+    # upper range well over 10 cents off.
+    # With discover, the usable range is determined from the first sweep, which
+    # covers both ends of the DAC range (see usable_range). If the pass covers
+    # OSC_MIN_NOTE/OSC_MAX_NOTE, the usable notes beyond them are solved as well.
+    # Opens the GATE before and closes it after the pass.
+    # Returns the per-note results (see note_result), also kept in results.
+    def fit_pass(self, min_note=OSC_MIN_NOTE, max_note=OSC_MAX_NOTE, max_points=DEFAULT_FIT_POINTS,
+                 verify=True, sweep=False, staircase=False, discover=False):
+        self.reset_counters()
+        self.captures = {}
+        t_start = self.clock()
+
+        self.set_gate(True)
+        self.log("GATE opened")
+
+        self.settle_oscillator()
+
+        self.log("Sweeping DAC values...")
+        self.select_note(None)
+        self.phase = "sweep"
+
+        lo = response.midi_note_to_cents(min_note) - FIT_MARGIN
+        hi = response.midi_note_to_cents(max_note) + FIT_MARGIN
+
+        captured = None
+        if staircase:
+            captured = self.staircase_capture(0, MAX_DAC_VAL, STAIRCASE_STRIDE)
+            if captured is None:
+                self.log("Falling back to sweeps paced by the host")
+
+        if captured is not None:
+            dac, freq = captured[0], list(captured[1])
+        elif sweep or staircase:
+            dac = [int(v) for v in np.linspace(0, MAX_DAC_VAL, min(SWEEP_INITIAL_POINTS, max_points))]
+            freq = list(self.sweep_capture(dac))
+        else:
+            dac = [int(v) for v in np.linspace(0, MAX_DAC_VAL, FIT_INITIAL_POINTS)]
+            freq = [self.msr_after_dac_chng(v, ATTACK_TIME, RECORD_DURATION) for v in dac]
+
+        usable = None
+        if discover:
+            usable = self.usable_range(response.fit_response(dac, freq))
+            if usable is not None:
+                if min_note == OSC_MIN_NOTE:
+                    min_note = min(usable[0], min_note)
+                if max_note == OSC_MAX_NOTE:
+                    max_note = max(usable[1], max_note)
+                lo = response.midi_note_to_cents(min_note) - FIT_MARGIN
+                hi = response.midi_note_to_cents(max_note) + FIT_MARGIN
+
+        while True:
+            model = response.fit_response(dac, freq)
+            if len(dac) >= max_points:
+                break
+            if sweep or staircase:
+                nxt = response.next_sweep_points(
+                    model, lo, hi, FIT_INTERVAL_TOLERANCE, min(SWEEP_BATCH, max_points - len(dac))
+                )
+                if not nxt:
+                    break
+                dac += nxt
+                freq += list(self.sweep_capture(nxt))
+            else:
+                nxt = response.next_sweep_point(model, lo, hi, FIT_INTERVAL_TOLERANCE)
+                if nxt is None:
+                    break
+                dac.append(nxt)
+                freq.append(self.msr_after_dac_chng(nxt, ATTACK_TIME, RECORD_DURATION))
+
+        self.log("Measured {} DAC values, fitted response".format(len(dac)))
+
+        notes = np.arange(min_note, max_note + 1)
+        curve = response.response_curve(model)
+        solved, predicted = response.solve_notes(model, notes, curve)
+
+        for i, (note, dac_val, error) in enumerate(zip(notes, solved, predicted)):
+            note = int(note)
+            self.select_note(note)
+            t_note = self.clock()
+            n_start = self.n_measurements
+            s_start = len(self.settle_times)
+
+            # Notes the oscillator can't reach are neither verified nor searched
+            reachable = usable is None or usable[0] <= note <= usable[1]
+
+            if verify and reachable:
+                self.phase = "verify"
+                # Most notes pass, so the next one is verified next
+                next_value = int(solved[i + 1]) if i + 1 < len(solved) else None
+                f = self.msr_after_dac_chng(int(dac_val), ATTACK_TIME, RECORD_DURATION, next_value=next_value)
+                error = error_in_cents(self.target_freq, f)
+                if abs(error) > self.tolerance_for(note):
+                    # Initial step guess from the slope (cents per DAC value) of the model
+                    slope = max(curve[min(dac_val + 1, MAX_DAC_VAL)] - curve[dac_val], 1e-3)
+                    step = int(min(max(round(abs(error) / slope), 1), RETUNE_STEP))
+                    dac_val, error = self.tune_note(int(dac_val), step, 1, self.target_freq)
+
+            extra = {}
+            if note < OSC_MIN_NOTE or note > OSC_MAX_NOTE:
+                extra["extended"] = True
+            if not reachable:
+                extra["extrapolated"] = True
+            self.note_result(note, dac_val, error, n_start, s_start, t_note, verified=verify, **extra)
+
+        n_notes = max_note - min_note + 1
+        self.log(
+            "Sweep and fit\tTotal measurements: {}\tAverage per note: {:.1f}\tTime: {:.1f}s{}".format(
+                self.n_measurements, self.n_measurements / n_notes, self.clock() - t_start,
+                self.cache_info() + self.rate_info(self.clock() - t_start)
+            )
+        )
+
+        self.log(self.capture_info())
+
+        self.set_gate(False)
+        self.log("GATE closed")
+
+        return self.results
+
+    # Refines the results of a previous pass. Only notes whose error isn't
+    # within the tolerance with confidence (i.e. |error| + confidence interval
+    # exceeds it) are measured again, up to max_repeats times per note.
+    # All measurements of a note are kept across passes (see capture_stats),
+    # so every pass narrows the confidence interval. Notes that turn out to be
+    # off by more than the tolerance with confidence are searched again.
+    # Opens the GATE before and closes it after the pass.
+    # Returns the refined per-note results (see note_result), also kept in results.
+    def refine_pass(self, results, max_repeats=REFINE_MAX_REPEATS):
+        points = self.measured_points
+        self.reset_counters()
+        self.measured_points = points
+        t_start = self.clock()
+
+        # Returns the error and confidence interval of a note at a DAC value,
+        # falling back to the error of its result if it hasn't been measured
+        def note_stats(r, dac_val):
+            error, ci, _ = self.capture_stats(r["note"], dac_val)
+            if not np.isfinite(error):
+                error = r["error"]
+            return error, ci
+
+        pending = []
+        for r in results:
+            error, ci = note_stats(r, r["dac"])
+            if abs(error) + ci > self.tolerance_for(r["note"]) and not at_range_end(r["dac"], error):
+                pending.append(r["note"])
+
+        self.log("Refining {} of {} notes, which aren't within their tolerance with confidence...".format(
+            len(pending), len(results)
+        ))
+
+        if pending:
+            self.set_gate(True)
+            self.log("GATE opened")
+
+            self.settle_oscillator()
+
+        for r in results:
+            note = r["note"]
+            dac_val = r["dac"]
+            self.select_note(note)
+            t_note = self.clock()
+            n_start = self.n_measurements
+            s_start = len(self.settle_times)
+            error, ci = note_stats(r, dac_val)
+            tolerance = self.tolerance_for(note)
+
+            while note in pending and abs(error) + ci > tolerance and self.n_measurements - n_start < max_repeats:
+                if at_range_end(dac_val, error):
+                    break
+                if abs(error) - ci > tolerance:
+                    # Off for sure, search from the current value. The secant
+                    # search is used regardless of the strategy, as it is
+                    # bounded in measurements and stays within the DAC range.
+                    dac_val, _ = self.secant_tune(dac_val, RETUNE_STEP, self.target_freq, tolerance)
+                else:
+                    self.phase = "repeat"
+                    self.msr_after_dac_chng(dac_val, ATTACK_TIME, RECORD_DURATION, fresh=True)
+                error, ci = note_stats(r, dac_val)
+
+            if note in pending:
+                self.note_result(note, dac_val, error, n_start, s_start, t_note)
+            else:
+                self.results.append(dict(r, measurements=0, time=0.0))
+
+        self.log(
+            "Total measurements: {}\tTime: {:.1f}s{}".format(
+                self.n_measurements, self.clock() - t_start,
+                self.cache_info() + self.rate_info(self.clock() - t_start)
+            )
+        )
+
+        if pending:
+            self.set_gate(False)
+            self.log("GATE closed")
+
+        return self.results
+
+    # Incrementally retunes the notes min_note to max_note of the LUT stored on the device.
+    # Each note is verified with a single measurement at its stored DAC value,
+    # only notes that have drifted by more than the threshold (cents) are searched.
+    # As in refine_pass, the search is the secant search regardless of the
+    # strategy, starting from the stored DAC value.
+    # Returns the per-note results (see note_result), also kept in results.
+    def incremental_retune(self, device_lut, threshold, min_note=OSC_MIN_NOTE, max_note=OSC_MAX_NOTE):
+        n_retuned = 0
+
+        for i in range(min_note, max_note + 1):
+            self.select_note(i)
+            t_note = self.clock()
+            n_start = self.n_measurements
+            s_start = len(self.settle_times)
+            target_freq = midi_note_to_freq(i)
+            dac_val = device_lut[i]
+            self.phase = "verify"
+            error = error_in_cents(target_freq, self.msr_after_dac_chng(dac_val, ATTACK_TIME, RECORD_DURATION))
+
+            retuned = bool(abs(error) > threshold and not at_range_end(dac_val, error))
+            if retuned:
+                dac_val, error = self.secant_tune(dac_val, RETUNE_STEP, target_freq, self.tolerance_for(i))
+                n_retuned += 1
+
+            self.note_result(i, dac_val, error, n_start, s_start, t_note, stored_dac=device_lut[i], retuned=retuned)
+
+        self.log("Retuned {} of {} notes".format(n_retuned, max_note - min_note + 1))
+        return self.results
+
+    ######## Chromatic Check ########
+
+    # Checks the LUT of the Dampflog through the real note path: the notes
+    # min_note to max_note are played as note on messages (see
+    # handle_midi_msg() in src/main.c), each held for dwell seconds, within
+    # one continuous recording. The notes are played legato, as a note off
+    # closes the GATE regardless of the note, only the last one is released.
+    # The recording is segmented by the pitch steps it contains (see
+    # pitch.align_steps), starting from the sample counts read per note. The
+    # first guard seconds of every segment are skipped, the rest is evaluated
+    # at once by pitch.segment_freqs. A note fails only if its error exceeds
+    # its tolerance (see tolerance_for) by more than the confidence interval
+    # of the measurement. Notes whose LUT entry is pinned at an end of the DAC
+    # range (see at_range_end) can't be tuned any closer and are reported
+    # separately instead of failing.
+    # lut is the content the LUT is expected to have, only used for the report.
+    # The first note is held for settle seconds before recording, short by
+    # default as the oscillator is warm after tuning (pass
+    # OSC_STARTUP_SETTLE_TIME if it has been off).
+    # Returns the per-note check results.
+    def chromatic_check(self, min_note=OSC_MIN_NOTE, max_note=OSC_MAX_NOTE, lut=None,
+                        dwell=CHECK_DWELL, guard=CHECK_GUARD, settle=CHECK_SETTLE_TIME):
+        if guard >= dwell:
+            raise ValueError("Check guard time must be shorter than the dwell time")
+
+        notes = list(range(min_note, max_note + 1))
+        self.discard_speculative()
+        self.port.send(transport.note_on_msg(notes[0]))
+        self.wait(settle)
+
+        self.n_measurements += len(notes)
+        t_start = self.clock()
+        self.audio_in.flush()
+        chunks = []
+        bounds = [0]
+        for note in notes:
+            self.port.send(transport.note_on_msg(note))
+            chunks.append(np.ravel(self.audio_in.read(dwell)))
+            bounds.append(bounds[-1] + len(chunks[-1]))
+        self.port.send(transport.note_off_msg(notes[-1]))
+        play_time = self.clock() - t_start
+        self.record_time += len(notes) * (dwell - guard)
+
+        t = time.perf_counter()
+        sample = np.concatenate(chunks)
+        offset, length = pitch.align_steps(sample, len(notes), 0, bounds[-1] / len(notes))
+        bounds = offset + length * np.arange(len(notes) + 1)
+        freqs, stderrs = pitch.segment_freqs(sample, bounds, RECORD_SAMPLE_RATE, int(guard * RECORD_SAMPLE_RATE))
+        self.analyze_time += time.perf_counter() - t
+
+        checks = []
+        for note, f, stderr in zip(notes, freqs, stderrs):
+            error = error_in_cents(midi_note_to_freq(note), f) if np.isfinite(f) else np.nan
+            ci = CONFIDENCE_Z * stderr
+            range_end = lut is not None and at_range_end(lut[note], error)
+            passed = bool(abs(error) - ci <= self.tolerance_for(note) or range_end)
+            checks.append({
+                "note": note,
+                "dac": lut[note] if lut is not None else None,
+                "freq": float(f),
+                "error": float(error),
+                "uncertainty": float(stderr),
+                "ci": float(ci),
+                "at_range_end": range_end,
+                "passed": passed,
+            })
+            self.log("MIDI note: {} ({})\tDAC value: {}\tError (cents): {:+.2f} ± {:.2f}\t{}".format(
+                midi_note_to_name_oct(note), note, "-" if lut is None else lut[note],
+                error, ci, "RANGE END" if range_end else "PASS" if passed else "FAIL"
+            ))
+
+        failed = [c["note"] for c in checks if not c["passed"]]
+        range_ends = [c["note"] for c in checks if c["at_range_end"]]
+        self.log("Chromatic check: {} of {} notes within their tolerance\tPlayed in: {:.1f}s".format(
+            len(notes) - len(failed) - len(range_ends), len(notes), play_time
+        ))
+        if range_ends:
+            self.log("Notes at an end of the DAC range: {}".format(
+                ", ".join("{} ({})".format(midi_note_to_name_oct(n), n) for n in range_ends)
+            ))
+        if failed:
+            self.log("Notes to retune: {}".format(
+                ", ".join("{} ({})".format(midi_note_to_name_oct(n), n) for n in failed)
+            ))
+        return checks